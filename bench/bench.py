@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import requests
+
+import datagen
+from scenarios import SCENARIOS, Context, Scenario
+from server import Server
+
+# Load and latency benchmarks of the REST API
+#
+# For each driver (SQLite; Postgres if reachable), starts the backend in a
+# subprocess, seeds N dashboards across M dataCubes and runs every scenario with C
+# concurrent clients for D seconds. Results are printed (and written) as JSON, to be
+# compared between commits with compare.py
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(p / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict[str, Any]:
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1) if elapsed > 0 else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+    }
+
+
+def run_scenario(ctx: Context, scenario: Scenario, concurrency: int, duration: float) -> Dict[str, Any]:
+    latencies: List[float] = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker(n: int) -> None:
+        session = requests.Session()
+        rnd = random.Random(n)
+        local: List[float] = []
+        local_errors = 0
+        while time.monotonic() < deadline:
+            t0 = time.perf_counter()
+            try:
+                ok = scenario(ctx, session, rnd).status_code < 400
+            except requests.RequestException:
+                ok = False
+            local.append(time.perf_counter() - t0)
+            local_errors += 0 if ok else 1
+        with lock:
+            latencies.extend(local)
+            errors[0] += local_errors
+
+    t0 = time.monotonic()
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return summarize(latencies, errors[0], time.monotonic() - t0)
+
+
+def postgres_available() -> Optional[str]:
+    """
+    Returns None if Postgres (constants.POSTGRES_*) is reachable, or the reason why not
+    """
+    try:
+        import psycopg2
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+        import constants
+        psycopg2.connect(host=constants.POSTGRES_HOST, port=constants.POSTGRES_PORT,
+                         user=constants.POSTGRES_USERNAME, password=constants.POSTGRES_PASSWORD,
+                         dbname="postgres", connect_timeout=2).close()
+        return None
+    except Exception as e:
+        return str(e).strip() or type(e).__name__
+
+
+def driver_envs(tmp_dir: str) -> Dict[str, Dict[str, str]]:
+    return {
+        "sqlite": {"DRIVER": "sqlite", "SQLITE_FILE": os.path.join(tmp_dir, "bench.db")},
+        "postgres": {"DRIVER": "postgres", "POSTGRES_DB": f"bench_{os.getpid()}"},
+    }
+
+
+def bench_driver(env: Dict[str, str], args: argparse.Namespace) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    server = Server(env)
+    results["startup_s"] = round(server.start(), 3)
+    try:
+        t0 = time.monotonic()
+        indexes = datagen.seed(server.url, args.dashboards, args.datacubes)
+        results["seed_s"] = round(time.monotonic() - t0, 3)
+        ctx = Context(base_url=server.url, ids=list(indexes), indexes=indexes, datacubes=args.datacubes,
+                      dashboards=args.dashboards)
+        results["scenarios"] = {}
+        for name, scenario in SCENARIOS.items():
+            if args.scenario and name not in args.scenario:
+                continue
+            print(f"  {name}...", file=sys.stderr)
+            results["scenarios"][name] = run_scenario(ctx, scenario, args.concurrency, args.duration)
+    finally:
+        server.stop()
+    return results
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return "unknown"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load and latency benchmarks of the dashboard REST API")
+    parser.add_argument("-n", "--dashboards", type=int, default=10000, help="Dashboards to seed")
+    parser.add_argument("-m", "--datacubes", type=int, default=100, help="dataCubes to spread them across")
+    parser.add_argument("-c", "--concurrency", type=int, default=16, help="Concurrent clients")
+    parser.add_argument("-d", "--duration", type=float, default=10.0, help="Seconds per scenario")
+    parser.add_argument("-s", "--scenario", action="append", choices=list(SCENARIOS),
+                        help="Scenario to run (repeatable). Default: all")
+    parser.add_argument("--driver", action="append", choices=["sqlite", "postgres"],
+                        help="Driver to benchmark (repeatable). Default: all available")
+    parser.add_argument("-o", "--output", help="Write the JSON results to this file too")
+    args = parser.parse_args()
+
+    report: Dict[str, Any] = {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "dashboards": args.dashboards,
+            "datacubes": args.datacubes,
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+        },
+        "drivers": {},
+    }
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for driver, env in driver_envs(tmp_dir).items():
+            if args.driver and driver not in args.driver:
+                continue
+            if driver == "postgres":
+                reason = postgres_available()
+                if reason is not None:
+                    print(f"Skipping postgres: {reason}", file=sys.stderr)
+                    report["drivers"][driver] = {"skipped": reason}
+                    continue
+            print(f"Benchmarking {driver}...", file=sys.stderr)
+            report["drivers"][driver] = bench_driver(env, args)
+            if driver == "postgres":
+                _drop_postgres_db(env["POSTGRES_DB"])
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+def _drop_postgres_db(name: str) -> None:
+    import psycopg2
+    import constants
+    conn = psycopg2.connect(host=constants.POSTGRES_HOST, port=constants.POSTGRES_PORT,
+                            user=constants.POSTGRES_USERNAME, password=constants.POSTGRES_PASSWORD,
+                            dbname="postgres")
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute(f'DROP DATABASE IF EXISTS "{name}"')
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
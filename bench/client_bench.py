@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+import datagen
+from bench import git_revision
+from server import Server
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "test"))
+import client as per_call  # noqa: E402
+from turnilo_client import AsyncClient, Capabilities, Client  # noqa: E402
+
+# Client benchmark: syncs N dashboards (create, read back, update) with the per-call
+# functions of test/client.py, and with the pooled clients of turnilo_client
+#
+# - per_call: client.py functions, a new connection per call (output discarded)
+# - pooled: Client, one request per dashboard over keep-alive connections
+# - pooled_bulk: Client, _bulk requests of bulk_size dashboards
+# - async: AsyncClient, one request per dashboard, concurrency requests in flight
+# - async_bulk: AsyncClient, concurrent _bulk requests
+
+
+def _rate(t0: float, n: int) -> Dict[str, Any]:
+    elapsed = time.perf_counter() - t0
+    return {"s": round(elapsed, 3), "dashboards_per_s": round(n / elapsed, 1)}
+
+
+def timed(fn: Callable[[], Any], n: int) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    fn()
+    return _rate(t0, n)
+
+
+def run_per_call(url: str, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+    host, port = url.rsplit("//", 1)[1].split(":")
+    ids: List[int] = []
+    results: Dict[str, Any] = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        results["create"] = timed(lambda: ids.extend(
+            per_call.create_dashboard(host, port, json.dumps(d)).json()["id"] for d in items), len(items))
+        results["get"] = timed(lambda: [per_call.get_dashboard(host, port, _id) for _id in ids], len(items))
+        results["update"] = timed(lambda: [per_call.update_dashboard(host, port, json.dumps(dict(d, name="Updated")),
+                                                                     _id) for d, _id in zip(items, ids)], len(items))
+        per_call.bulk_delete(host, port, json.dumps([{"id": _id} for _id in ids]))
+    return results
+
+
+def run_pooled(url: str, items: List[Dict[str, Any]], bulk: bool) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    with Client(url) as client:
+        if not bulk:
+            client._capabilities = Capabilities(bulk=False)
+        ids: List[int] = []
+        results["create"] = timed(lambda: ids.extend(r["id"] for r in client.create_many(items)), len(items))
+        results["get"] = timed(lambda: [client.get(_id) for _id in ids], len(items))
+        updated = [dict(d, name="Updated") for d in items]
+        results["update"] = timed(lambda: client.upsert_many(updated) if bulk else
+                                  [client.update(_id, d) for d, _id in zip(updated, ids)], len(items))
+        client.bulk("delete", [{"id": _id} for _id in ids])
+    return results
+
+
+def run_async(url: str, items: List[Dict[str, Any]], bulk: bool, concurrency: int) -> Dict[str, Any]:
+    async def run() -> Dict[str, Any]:
+        results: Dict[str, Any] = {}
+        async with AsyncClient(url, concurrency=concurrency) as client:
+            if not bulk:
+                client._capabilities = Capabilities(bulk=False)
+            t0 = time.perf_counter()
+            ids = [r["id"] for r in await client.create_many(items)]
+            results["create"] = _rate(t0, len(items))
+            t0 = time.perf_counter()
+            await client.get_many(ids)
+            results["get"] = _rate(t0, len(items))
+            t0 = time.perf_counter()
+            updated = [dict(d, name="Updated") for d in items]
+            if bulk:
+                await client.upsert_many(updated)
+            else:
+                await asyncio.gather(*[client.update(_id, d) for d, _id in zip(updated, ids)])
+            results["update"] = _rate(t0, len(items))
+            await client.bulk("delete", [{"id": _id} for _id in ids])
+        return results
+    return asyncio.run(run())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Client benchmark")
+    parser.add_argument("-n", "--dashboards", type=int, default=2000, help="Dashboards to sync")
+    parser.add_argument("-c", "--concurrency", type=int, default=16, help="Requests in flight (async client)")
+    parser.add_argument("-o", "--output", help="Write the JSON results to this file too")
+    args = parser.parse_args()
+
+    items = list(datagen.dashboards(args.dashboards, 10))
+    report: Dict[str, Any] = {
+        "meta": {"revision": git_revision(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                 "dashboards": args.dashboards, "concurrency": args.concurrency},
+    }
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        env = {"DRIVER": "sqlite", "SQLITE_FILE": os.path.join(tmp_dir, "bench.db"),
+               "SCHEMA_LOCK_FILE": os.path.join(tmp_dir, "schema.lock")}
+        with Server(env) as server:
+            runs: List[Tuple[str, Callable[[], Dict[str, Any]]]] = [
+                ("per_call", lambda: run_per_call(server.url, items)),
+                ("pooled", lambda: run_pooled(server.url, items, bulk=False)),
+                ("pooled_bulk", lambda: run_pooled(server.url, items, bulk=True)),
+                ("async", lambda: run_async(server.url, items, False, args.concurrency)),
+                ("async_bulk", lambda: run_async(server.url, items, True, args.concurrency)),
+            ]
+            for name, run in runs:
+                print(f"{name}...", file=sys.stderr)
+                report[name] = run()
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
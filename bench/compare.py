@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+import argparse
+import json
+from typing import Any, Dict
+
+# Compares two bench.py JSON reports (e.g. before/after a change)
+
+METRICS = ["rps", "p50_ms", "p95_ms", "p99_ms"]
+
+
+def load(path: str) -> Dict[str, Any]:
+    with open(path) as f:
+        return json.load(f)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare two benchmark reports")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    args = parser.parse_args()
+    before, after = load(args.before), load(args.after)
+    print(f"{before['meta']['revision']} -> {after['meta']['revision']}")
+    for driver, results in after["drivers"].items():
+        old = before["drivers"].get(driver, {})
+        if "scenarios" not in results or "scenarios" not in old:
+            continue
+        print(f"\n[{driver}]")
+        print(f"{'scenario':<24}" + "".join(f"{m:>24}" for m in METRICS))
+        for name, new in results["scenarios"].items():
+            if name not in old["scenarios"]:
+                continue
+            row = f"{name:<24}"
+            for m in METRICS:
+                a, b = old["scenarios"][name][m], new[m]
+                delta = (b - a) / a * 100 if a else 0.0
+                row += f"{f'{a:g} -> {b:g} ({delta:+.1f}%)':>24}"
+            print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import random
+from typing import Dict, Iterator, List
+
+import requests
+
+BULK_PATH = "/rest/turnilo/dashboards/_bulk"
+BATCH_SIZE = 1000
+
+WORDS = ["network", "flows", "traffic", "top", "talkers", "bgp", "peering", "latency", "errors", "country",
+         "asn", "interface", "bytes", "packets", "daily", "weekly", "overview", "region", "customer", "edge"]
+
+
+def datacube_name(i: int) -> str:
+    return f"dataCube{i:04d}"
+
+
+def dashboards(n: int, m: int, seed: int = 42, hash_size: int = 512) -> Iterator[Dict]:
+    """
+    Generates n dashboards spread round-robin across m dataCubes
+    """
+    rnd = random.Random(seed)
+    for i in range(n):
+        words = rnd.sample(WORDS, 4)
+        yield {
+            "dataCube": datacube_name(i % m),
+            "shortName": f"dashboard_{i:07d}",
+            "name": " ".join(words[:3]).title(),
+            "description": f"Dashboard {i} showing {' and '.join(words)}",
+            "hash": "#" + "".join(rnd.choices("abcdefghijklmnopqrstuvwxyz0123456789", k=hash_size)),
+            "preset": i % 10 == 0,
+        }
+
+
+def seed(base_url: str, n: int, m: int) -> Dict[int, int]:
+    """
+    Creates n dashboards across m dataCubes through the bulk endpoint. Returns the index
+    (in dashboards()) of the generated dashboard of each id: ids are not contiguous
+    (concurrent creators, shard-prefixed ids)
+    """
+    indexes: Dict[int, int] = {}
+    session = requests.Session()
+    batch: List[Dict] = []
+    for dashboard in dashboards(n, m):
+        batch.append(dashboard)
+        if len(batch) == BATCH_SIZE:
+            indexes.update(_create(session, base_url, batch, len(indexes)))
+            batch = []
+    if batch:
+        indexes.update(_create(session, base_url, batch, len(indexes)))
+    return indexes
+
+
+def _create(session: requests.Session, base_url: str, batch: List[Dict], offset: int) -> Dict[int, int]:
+    res = session.post(base_url + BULK_PATH, params={"op": "upsert"}, json=batch)
+    res.raise_for_status()
+    return {item["id"]: offset + item["index"] for item in res.json() if item["status"] == 200}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Seed N dashboards across M dataCubes")
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("-n", "--dashboards", type=int, default=10000)
+    parser.add_argument("-m", "--datacubes", type=int, default=100)
+    parser.add_argument("--dump", action="store_true", help="Print the dashboards as NDJSON instead of seeding")
+    args = parser.parse_args()
+    if args.dump:
+        for dashboard in dashboards(args.dashboards, args.datacubes):
+            print(json.dumps(dashboard))
+    else:
+        print(f"Created {len(seed(args.url, args.dashboards, args.datacubes))} dashboards")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import datagen
+from bench import git_revision, summarize
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from sqlalchemy import URL, Engine, insert, text  # noqa: E402
+from sqlmodel import Session  # noqa: E402
+
+import data.engine_config as engine_config  # noqa: E402
+import data.migrations as migrations  # noqa: E402
+from data.migrations import v0007_hash_store  # noqa: E402
+from models.turnilo_dashboard import TurniloDashboard  # noqa: E402
+from services import hash_store  # noqa: E402
+from services import turnilo_dashboards as td  # noqa: E402
+
+# Hash store benchmark
+#
+# Loads N generated dashboards into a SQLite file with their hash inline (the layout
+# before the hash store), measures the size of the tables and the latency of the list,
+# then moves the values to the store (the data migration) and measures them again.
+# Runs for several ratios of distinct hash values (dashboards cloned from one another
+# share the same one)
+
+DISTINCT_RATIOS = [1.0, 0.1, 0.01]
+LISTS: Dict[str, Dict[str, str]] = {
+    "all_fields": {},
+    "digests": {"fields": "id,name,hashDigest"},
+}
+
+
+def load(engine: Engine, n: int, m: int, distinct: float, hash_size: int) -> None:
+    rnd = random.Random(42)
+    dashboards = list(datagen.dashboards(n, m, hash_size=hash_size))
+    values = [d["hash"] for d in dashboards[:max(1, int(n * distinct))]]
+    with Session(engine) as session:
+        for i in range(0, n, datagen.BATCH_SIZE):
+            session.execute(insert(TurniloDashboard), [dict(d, hash=rnd.choice(values))
+                                                       for d in dashboards[i:i + datagen.BATCH_SIZE]])
+        session.commit()
+
+
+def table_sizes(engine: Engine) -> Dict[str, Any]:
+    # Bytes of the pages of each table (and its indexes), after a VACUUM. The dbstat
+    # virtual table is optional in SQLite builds: the file size only without it
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("VACUUM"))
+        size = conn.execute(text("SELECT page_count * page_size FROM pragma_page_count, pragma_page_size")).scalar()
+        sizes: Dict[str, Any] = {"file_bytes": size}
+        try:
+            for table in ("turniloDashboards", "turniloDashboardHashes"):
+                sizes[f"{table}_bytes"] = conn.execute(text(
+                    "SELECT coalesce(sum(s.pgsize), 0) FROM dbstat s JOIN sqlite_schema t ON t.name = s.name "
+                    "WHERE t.tbl_name = :table"), {"table": table}).scalar()
+        except Exception:
+            pass
+    return sizes
+
+
+def time_lists(engine: Engine, iterations: int, cold: bool) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    for name, params in LISTS.items():
+        query_params = td.GetQueryParams(**params)
+        run: Callable[[], Any] = lambda: td.dashboards_get_all(session, query_params)  # noqa: E731
+        latencies: List[float] = []
+        t0 = time.monotonic()
+        with Session(engine) as session:
+            run()
+            for _ in range(iterations):
+                if cold:
+                    hash_store.value_cache.clear()
+                t1 = time.perf_counter()
+                run()
+                latencies.append(time.perf_counter() - t1)
+        results[name] = summarize(latencies, 0, time.monotonic() - t0)
+    return results
+
+
+def measure(engine: Engine, iterations: int, cold: Optional[bool]) -> Dict[str, Any]:
+    result = table_sizes(engine)
+    if cold is None:
+        result["list"] = time_lists(engine, iterations, False)
+    else:
+        result["list_cold_cache"] = time_lists(engine, iterations, True)
+        result["list_warm_cache"] = time_lists(engine, iterations, False)
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Hash store benchmark (table size and list latency)")
+    parser.add_argument("-n", "--dashboards", type=int, default=20000, help="Dashboards to load")
+    parser.add_argument("-m", "--datacubes", type=int, default=100, help="dataCubes to spread them across")
+    parser.add_argument("-s", "--hash-size", type=int, default=2048, help="Length of the hash values")
+    parser.add_argument("-d", "--distinct", type=float, action="append",
+                        help="Ratio of distinct hash values (repeatable). Default: "
+                             + ", ".join(map(str, DISTINCT_RATIOS)))
+    parser.add_argument("-i", "--iterations", type=int, default=10, help="Lists per measure")
+    parser.add_argument("-o", "--output", help="Write the JSON results to this file too")
+    args = parser.parse_args()
+
+    report: Dict[str, Any] = {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "dashboards": args.dashboards,
+            "hash_size": args.hash_size,
+        },
+    }
+    for distinct in args.distinct or DISTINCT_RATIOS:
+        print(f"distinct={distinct}...", file=sys.stderr)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            engine = engine_config.make_engine(URL.create("sqlite", database=os.path.join(tmp_dir, "hash.db")))
+            migrations.migrate(engine)
+            load(engine, args.dashboards, args.datacubes, distinct, args.hash_size)
+            inline = measure(engine, args.iterations, None)
+            t0 = time.monotonic()
+            v0007_hash_store._move_hashes(engine)
+            migrate_s = time.monotonic() - t0
+            hash_store.value_cache.clear()
+            store = measure(engine, args.iterations, True)
+            report[str(distinct)] = {"inline": inline, "store": dict(store, migrate_s=round(migrate_s, 3))}
+            engine.dispose()
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
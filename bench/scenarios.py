@@ -0,0 +1,65 @@
+import random
+import uuid
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List
+
+import requests
+
+from datagen import datacube_name, dashboards
+
+DASHBOARDS_PATH = "/rest/turnilo/dashboards/"
+
+
+@dataclass
+class Context:
+    base_url: str
+    ids: List[int]
+    # Index (in datagen.dashboards()) of the generated dashboard of each id
+    indexes: Dict[int, int]
+    datacubes: int
+    dashboards: int
+    extra: Dict = field(default_factory=dict)
+
+
+# A scenario performs one request and returns its response
+Scenario = Callable[[Context, requests.Session, random.Random], requests.Response]
+
+
+def read_by_id(ctx: Context, session: requests.Session, rnd: random.Random) -> requests.Response:
+    return session.get(ctx.base_url + DASHBOARDS_PATH + str(rnd.choice(ctx.ids)))
+
+
+def filtered_list(ctx: Context, session: requests.Session, rnd: random.Random) -> requests.Response:
+    # What Turnilo does: by dataCube, or by dataCube+shortName
+    i = rnd.randrange(ctx.dashboards)
+    params = {"dataCube": datacube_name(i % ctx.datacubes)}
+    if rnd.random() < 0.5:
+        params["shortName"] = f"dashboard_{i:07d}"
+    return session.get(ctx.base_url + DASHBOARDS_PATH, params=params)
+
+
+def mixed_read_write(ctx: Context, session: requests.Session, rnd: random.Random) -> requests.Response:
+    # 90% reads, 10% updates
+    if rnd.random() < 0.9:
+        return read_by_id(ctx, session, rnd) if rnd.random() < 0.5 else filtered_list(ctx, session, rnd)
+    _id = rnd.choice(ctx.ids)
+    i = ctx.indexes[_id]
+    dashboard = dict(next(dashboards(1, 1, seed=i)), dataCube=datacube_name(i % ctx.datacubes),
+                     shortName=f"dashboard_{i:07d}", name=f"Updated {rnd.random()}")
+    return session.put(ctx.base_url + DASHBOARDS_PATH + str(_id), json=dashboard)
+
+
+def bulk_provisioning(ctx: Context, session: requests.Session, rnd: random.Random) -> requests.Response:
+    # A new tenant: 100 preset dashboards in a new dataCube
+    tenant = "tenant_" + uuid.uuid4().hex[:12]
+    batch = [dict(d, dataCube=tenant, preset=True) for d in dashboards(100, 1, seed=rnd.randrange(1 << 30))]
+    return session.post(ctx.base_url + DASHBOARDS_PATH + "_bulk", params={"op": "create"}, json=batch)
+
+
+# Run in this order: scenarios that write go last
+SCENARIOS: Dict[str, Scenario] = {
+    "read_by_id": read_by_id,
+    "filtered_list": filtered_list,
+    "mixed_read_write": mixed_read_write,
+    "bulk_provisioning": bulk_provisioning,
+}
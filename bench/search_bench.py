@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+import datagen
+from bench import git_revision, summarize
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from sqlalchemy import URL, insert  # noqa: E402
+from sqlmodel import Session, select  # noqa: E402
+
+import data.engine_config as engine_config  # noqa: E402
+import data.migrations as migrations  # noqa: E402
+from models.turnilo_dashboard import TurniloDashboard  # noqa: E402
+from services import search  # noqa: E402
+
+# Full-text search benchmark
+#
+# Loads N generated dashboards into a SQLite file and compares the latency of the
+# search backends (FTS5, in-process inverted index) with the previous option: fetching
+# every dashboard and filtering them in Python
+
+QUERIES = {
+    "one_word": "traffic",
+    "two_words": "country latency",
+    "prefix": "peer",
+    "rare_word": "12345",
+    "no_match": "nonexistent",
+}
+
+
+def load(engine: Any, n: int, m: int) -> float:
+    """
+    Inserts n dashboards (FTS5 triggers included). Returns the time it took (s)
+    """
+    t0 = time.monotonic()
+    with Session(engine) as session:
+        batch: List[Dict] = []
+        for dashboard in datagen.dashboards(n, m, hash_size=64):
+            batch.append(dashboard)
+            if len(batch) == datagen.BATCH_SIZE:
+                session.execute(insert(TurniloDashboard), batch)
+                batch = []
+        if batch:
+            session.execute(insert(TurniloDashboard), batch)
+        session.commit()
+    return time.monotonic() - t0
+
+
+def grep(session: Session, q: str, limit: int) -> List[TurniloDashboard]:
+    words = search.tokenize(q)
+    results = []
+    for dashboard in session.exec(select(TurniloDashboard)).all():
+        text = search.tokenize(dashboard.name) + search.tokenize(dashboard.description)
+        if all(any(t.startswith(w) for t in text) for w in words):
+            results.append(dashboard)
+    return results[:limit]
+
+
+def time_queries(fn: Callable[[str], Any], iterations: int) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    for name, q in QUERIES.items():
+        latencies = []
+        t0 = time.monotonic()
+        for _ in range(iterations):
+            t1 = time.perf_counter()
+            fn(q)
+            latencies.append(time.perf_counter() - t1)
+        results[name] = summarize(latencies, 0, time.monotonic() - t0)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Full-text search benchmark")
+    parser.add_argument("-n", "--dashboards", type=int, default=100000, help="Dashboards to load")
+    parser.add_argument("-m", "--datacubes", type=int, default=100, help="dataCubes to spread them across")
+    parser.add_argument("-i", "--iterations", type=int, default=50, help="Searches per query and backend")
+    parser.add_argument("--limit", type=int, default=20, help="Results per search")
+    parser.add_argument("--grep-iterations", type=int, default=3, help="Searches per query without index")
+    parser.add_argument("-o", "--output", help="Write the JSON results to this file too")
+    args = parser.parse_args()
+
+    report: Dict[str, Any] = {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "dashboards": args.dashboards,
+            "limit": args.limit,
+        },
+        "backends": {},
+    }
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        engine = engine_config.make_engine(URL.create("sqlite", database=os.path.join(tmp_dir, "search.db")))
+        migrations.migrate(engine)
+        search.enable_search_index(engine)
+        report["meta"]["load_s"] = round(load(engine, args.dashboards, args.datacubes), 3)
+
+        with Session(engine) as session:
+            print("fts5...", file=sys.stderr)
+            assert search.backend(session) == search.BACKEND_FTS5
+            report["backends"][search.BACKEND_FTS5] = {
+                "queries": time_queries(lambda q: search.search(session, q, args.limit), args.iterations)}
+
+            print("python...", file=sys.stderr)
+            index = search.InvertedIndex()
+            t0 = time.monotonic()
+            index.sync(session)
+            report["backends"][search.BACKEND_PYTHON] = {
+                "build_s": round(time.monotonic() - t0, 3),
+                "queries": time_queries(lambda q: index.search(session, search.tokenize(q), args.limit),
+                                        args.iterations)}
+
+            print("grep (no index)...", file=sys.stderr)
+            report["backends"]["grep"] = {
+                "queries": time_queries(lambda q: grep(session, q, args.limit), args.grep_iterations)}
+        engine.dispose()
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
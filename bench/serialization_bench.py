@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, MutableMapping
+
+import datagen
+from bench import git_revision, summarize
+
+# List response serialization micro-benchmark
+#
+# Compares, on the same SQLite DB and through the whole FastAPI stack (ASGI calls, no
+# network), the two ways of answering GET /rest/turnilo/dashboards/:
+# - orm: ORM instances, validated against response_model and encoded with json
+# - rows: plain rows, encoded with orjson (the current route)
+
+TMP_DIR = tempfile.mkdtemp()
+os.environ["SQLITE_FILE"] = os.path.join(TMP_DIR, "serialization.db")
+os.environ["CACHE_MAX_ENTRIES"] = "0"
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from fastapi import FastAPI  # noqa: E402
+from fastapi.responses import ORJSONResponse  # noqa: E402
+from sqlalchemy import delete, insert  # noqa: E402
+from sqlmodel import Session, select  # noqa: E402
+
+import data.database as db  # noqa: E402
+from models.turnilo_dashboard import TurniloDashboard  # noqa: E402
+from services import turnilo_dashboards as td  # noqa: E402
+
+app = FastAPI()
+
+
+@app.get("/orm", response_model=List[TurniloDashboard])
+async def get_orm():
+    with Session(db.engine) as session:
+        return session.exec(select(TurniloDashboard).order_by(TurniloDashboard.id)).all()  # type: ignore
+
+
+@app.get("/rows", response_model=List[TurniloDashboard], response_class=ORJSONResponse)
+async def get_rows():
+    with Session(db.engine) as session:
+        return ORJSONResponse(td.dashboards_get_all(session, td.GetQueryParams()))
+
+
+async def call(path: str) -> bytes:
+    scope = {"type": "http", "method": "GET", "path": path, "raw_path": path.encode(), "query_string": b"",
+             "root_path": "", "headers": [], "http_version": "1.1", "scheme": "http",
+             "server": ("bench", 80), "client": ("bench", 1)}
+    body: List[bytes] = []
+
+    async def receive() -> MutableMapping[str, Any]:
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message: MutableMapping[str, Any]) -> None:
+        if message["type"] == "http.response.body":
+            body.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return b"".join(body)
+
+
+def load(n: int) -> None:
+    db.init()
+    with Session(db.engine) as session:
+        session.execute(delete(TurniloDashboard))
+        session.execute(insert(TurniloDashboard), list(datagen.dashboards(n, 100)))
+        session.commit()
+
+
+async def bench(path: str, iterations: int) -> Dict[str, Any]:
+    latencies = []
+    t0 = time.monotonic()
+    for _ in range(iterations):
+        t1 = time.perf_counter()
+        await call(path)
+        latencies.append(time.perf_counter() - t1)
+    return summarize(latencies, 0, time.monotonic() - t0)
+
+
+async def run(sizes: List[int], iterations: int) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    for n in sizes:
+        print(f"{n} dashboards...", file=sys.stderr)
+        load(n)
+        # Both paths must produce the same document
+        assert json.loads(await call("/orm")) == json.loads(await call("/rows"))
+        orm, rows = await bench("/orm", iterations), await bench("/rows", iterations)
+        results[str(n)] = {"orm": orm, "rows": rows, "speedup_p50": round(orm["p50_ms"] / rows["p50_ms"], 2)}
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="List response serialization micro-benchmark")
+    parser.add_argument("-n", "--dashboards", type=int, action="append", help="List sizes (repeatable)")
+    parser.add_argument("-i", "--iterations", type=int, default=20, help="Requests per size and path")
+    parser.add_argument("-o", "--output", help="Write the JSON results to this file too")
+    args = parser.parse_args()
+
+    try:
+        report = {
+            "meta": {"revision": git_revision(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z")},
+            "sizes": asyncio.run(run(args.dashboards or [100, 1000, 10000], args.iterations)),
+        }
+    finally:
+        db.engine.dispose()
+        shutil.rmtree(TMP_DIR, ignore_errors=True)
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, Optional
+
+import requests
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+HOST = "127.0.0.1"
+READY_PATH = "/health/ready"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind((HOST, 0))
+        return s.getsockname()[1]
+
+
+class Server:
+    """
+    REST backend (uvicorn main:app) running in a subprocess, configured through env
+    """
+
+    def __init__(self, env: Dict[str, str], port: Optional[int] = None):
+        self.env = env
+        self.port = port or free_port()
+        self.process: Optional[subprocess.Popen] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{HOST}:{self.port}"
+
+    def start(self, timeout: float = 30) -> float:
+        """
+        Starts the server and waits until it serves requests. Returns the time it took (s)
+        """
+        env = dict(os.environ)
+        env.update(self.env)
+        t0 = time.monotonic()
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", HOST, "--port", str(self.port),
+             "--log-level", "warning"],
+            cwd=SRC_DIR, env=env)
+        while time.monotonic() - t0 < timeout:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {self.process.returncode}")
+            try:
+                if requests.get(self.url + READY_PATH, timeout=1).status_code == 200:
+                    return time.monotonic() - t0
+            except requests.ConnectionError:
+                pass
+            time.sleep(0.01)
+        self.stop()
+        raise RuntimeError("Server did not become ready")
+
+    def stop(self) -> None:
+        if self.process is None:
+            return
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.process = None
+
+    def __enter__(self) -> "Server":
+        self.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.stop()
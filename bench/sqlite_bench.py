@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List
+
+from bench import git_revision, summarize
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from sqlalchemy import URL, Engine, func  # noqa: E402
+from sqlmodel import Session, select  # noqa: E402
+
+import data.database as db  # noqa: E402
+import data.engine_config as engine_config  # noqa: E402
+from models.turnilo_dashboard import TurniloDashboard  # noqa: E402
+
+# SQLite journal mode benchmark
+#
+# Readers and writers hammer the same SQLite file, directly through the engine (no
+# server), for each journal mode. With WAL, readers are not blocked by the writers'
+# commits. DELETE runs with synchronous=FULL, SQLite's default for it
+
+JOURNAL_MODES = ["DELETE", "WAL"]
+
+
+def make_engine(path: str, journal_mode: str) -> Engine:
+    pragmas = engine_config.sqlite_pragmas()
+    pragmas["journal_mode"] = journal_mode
+    if journal_mode != "WAL":
+        pragmas["synchronous"] = "FULL"
+    return engine_config.make_engine(URL.create("sqlite", database=path), pragmas)
+
+
+def run(engine: Engine, readers: int, writers: int, duration: float) -> Dict[str, Any]:
+    latencies: Dict[str, List[float]] = {"reads": [], "writes": []}
+    errors = {"reads": 0, "writes": 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def read() -> None:
+        with Session(engine) as session:
+            session.exec(select(func.count()).select_from(TurniloDashboard).where(
+                TurniloDashboard.dataCube == "networkFlows")).one()
+
+    def write(n: int, i: int) -> None:
+        with Session(engine_config.for_writes(engine)) as session:
+            session.add(TurniloDashboard(dataCube="networkFlows", shortName=f"load_{n}_{i}", name="load", hash="#"))
+            session.commit()
+
+    def worker(kind: str, n: int) -> None:
+        local: List[float] = []
+        local_errors = 0
+        i = 0
+        while time.monotonic() < deadline:
+            t0 = time.perf_counter()
+            try:
+                if kind == "reads":
+                    read()
+                else:
+                    write(n, i)
+                    i += 1
+                local.append(time.perf_counter() - t0)
+            except Exception:
+                local_errors += 1
+        with lock:
+            latencies[kind].extend(local)
+            errors[kind] += local_errors
+
+    threads = [threading.Thread(target=worker, args=("reads", n)) for n in range(readers)]
+    threads += [threading.Thread(target=worker, args=("writes", n)) for n in range(writers)]
+    t0 = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - t0
+    return {kind: summarize(latencies[kind], errors[kind], elapsed) for kind in latencies}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="SQLite journal mode benchmark (concurrent reads and writes)")
+    parser.add_argument("-r", "--readers", type=int, default=4, help="Reader threads")
+    parser.add_argument("-w", "--writers", type=int, default=2, help="Writer threads")
+    parser.add_argument("-d", "--duration", type=float, default=5.0, help="Seconds per journal mode")
+    parser.add_argument("-o", "--output", help="Write the JSON results to this file too")
+    args = parser.parse_args()
+
+    report: Dict[str, Any] = {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "readers": args.readers,
+            "writers": args.writers,
+            "duration_s": args.duration,
+        },
+    }
+    for journal_mode in JOURNAL_MODES:
+        print(f"journal_mode={journal_mode}...", file=sys.stderr)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            engine = make_engine(os.path.join(tmp_dir, "load.db"), journal_mode)
+            db.init_schema(engine)
+            report[journal_mode] = run(engine, args.readers, args.writers, args.duration)
+            engine.dispose()
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+from bench import git_revision, summarize
+from server import SRC_DIR, Server
+
+# Startup time benchmark
+#
+# Measures, over several runs, what a cold start costs:
+# - import: `import main` in a fresh interpreter (must not touch the DB)
+# - ready_new_db: from process start to a ready /health/ready, creating the DB
+# - ready_existing_db: the same, on a DB that is already initialized
+
+IMPORT_SCRIPT = "import time; t0 = time.perf_counter(); import main; print(time.perf_counter() - t0)"
+
+
+def time_import(env: Dict[str, str]) -> float:
+    output = subprocess.check_output([sys.executable, "-c", IMPORT_SCRIPT], cwd=SRC_DIR,
+                                     env=dict(os.environ, **env), text=True)
+    return float(output.strip().splitlines()[-1])
+
+
+def time_ready(env: Dict[str, str]) -> float:
+    server = Server(env)
+    try:
+        return server.start()
+    finally:
+        server.stop()
+
+
+def repeat(fn: Callable[[int], float], runs: int) -> Dict[str, Any]:
+    t0 = time.monotonic()
+    latencies: List[float] = [fn(run) for run in range(runs)]
+    return summarize(latencies, 0, time.monotonic() - t0)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Startup time benchmark")
+    parser.add_argument("-r", "--runs", type=int, default=10, help="Runs per measurement")
+    parser.add_argument("-o", "--output", help="Write the JSON results to this file too")
+    args = parser.parse_args()
+
+    report: Dict[str, Any] = {
+        "meta": {"revision": git_revision(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z")},
+    }
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        def sqlite_env(name: str) -> Dict[str, str]:
+            return {"DRIVER": "sqlite", "SQLITE_FILE": os.path.join(tmp_dir, name),
+                    "SCHEMA_LOCK_FILE": os.path.join(tmp_dir, "schema.lock")}
+
+        print("import...", file=sys.stderr)
+        report["import"] = repeat(lambda run: time_import(sqlite_env("import.db")), args.runs)
+        report["import"]["db_created"] = os.path.exists(os.path.join(tmp_dir, "import.db"))
+
+        print("ready_new_db...", file=sys.stderr)
+        report["ready_new_db"] = repeat(lambda run: time_ready(sqlite_env(f"new-{run}.db")), args.runs)
+
+        print("ready_existing_db...", file=sys.stderr)
+        time_ready(sqlite_env("existing.db"))
+        report["ready_existing_db"] = repeat(lambda run: time_ready(sqlite_env("existing.db")), args.runs)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Tuple
+from urllib.parse import urlsplit
+
+import requests
+
+import datagen
+from bench import git_revision, percentile
+from server import Server
+from scenarios import DASHBOARDS_PATH
+
+# Watchers benchmark: N idle Server-Sent Events watchers on one server (uvicorn, SQLite).
+# Reports the server memory they take, and how long it takes for a write to reach all
+# of them (fan-out latency, from the POST to each watcher's event)
+
+WATCHERS = [100, 1000, 5000]
+WATCH_PATH = DASHBOARDS_PATH + "_watch"
+# Connections opened at once (below the listen backlog)
+CONNECT_CONCURRENCY = 200
+
+
+def rss_mb(pid: int) -> float:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+async def open_watcher(host: str, port: int) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(f"GET {WATCH_PATH} HTTP/1.1\r\nHost: {host}\r\nAccept: text/event-stream\r\n\r\n".encode())
+    # Headers, then the ready event
+    await reader.readuntil(b"\r\n\r\n")
+    await reader.readuntil(b"event: ready")
+    return reader, writer
+
+
+async def wait_event(reader: asyncio.StreamReader) -> float:
+    await reader.readuntil(b"event: create")
+    return time.perf_counter()
+
+
+async def run_watchers(url: str, pid: int, watchers: int) -> Dict[str, Any]:
+    parts = urlsplit(url)
+    host, port = parts.hostname or "127.0.0.1", parts.port or 80
+    rss_before = rss_mb(pid)
+    semaphore = asyncio.Semaphore(CONNECT_CONCURRENCY)
+
+    async def connect() -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        async with semaphore:
+            return await open_watcher(host, port)
+
+    t0 = time.perf_counter()
+    connections = await asyncio.gather(*(connect() for _ in range(watchers)))
+    connect_s = time.perf_counter() - t0
+    await asyncio.sleep(1)
+    rss_after = rss_mb(pid)
+
+    waiting = [asyncio.ensure_future(wait_event(reader)) for reader, _ in connections]
+    dashboard = dict(next(datagen.dashboards(1, 1)), shortName=f"watched_{watchers}")
+    t0 = time.perf_counter()
+    await asyncio.get_running_loop().run_in_executor(None, lambda: requests.post(url + DASHBOARDS_PATH, json=dashboard))
+    received = await asyncio.gather(*waiting)
+    latencies: List[float] = sorted(t - t0 for t in received)
+
+    for _, writer in connections:
+        writer.close()
+    return {
+        "connect_s": round(connect_s, 3),
+        "rss_before_mb": round(rss_before, 1),
+        "rss_after_mb": round(rss_after, 1),
+        "kb_per_watcher": round((rss_after - rss_before) * 1024 / watchers, 1),
+        "fanout_p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "fanout_p99_ms": round(percentile(latencies, 99) * 1000, 3),
+        "fanout_max_ms": round(latencies[-1] * 1000, 3),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Watchers benchmark (_watch, Server-Sent Events)")
+    parser.add_argument("-w", "--watchers", type=int, action="append",
+                        help="Number of watchers (repeatable). Default: " + ", ".join(map(str, WATCHERS)))
+    parser.add_argument("-o", "--output", help="Write the JSON results to this file too")
+    args = parser.parse_args()
+
+    report: Dict[str, Any] = {
+        "meta": {"revision": git_revision(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z")},
+    }
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        env = {"DRIVER": "sqlite", "SQLITE_FILE": os.path.join(tmp_dir, "watch.db"),
+               "SCHEMA_LOCK_FILE": os.path.join(tmp_dir, "schema.lock")}
+        with Server(env) as server:
+            assert server.process is not None
+            for watchers in args.watchers or WATCHERS:
+                print(f"{watchers} watchers...", file=sys.stderr)
+                report[str(watchers)] = asyncio.run(run_watchers(server.url, server.process.pid, watchers))
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
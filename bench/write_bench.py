@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Dict, List
+
+import requests
+
+import datagen
+from bench import git_revision, summarize
+from server import Server
+from scenarios import DASHBOARDS_PATH
+
+# Write throughput benchmark: 1, 8 and 64 concurrent writers creating dashboards (one
+# POST each) for D seconds, with every write committing on its own and with group
+# commit (GROUP_COMMIT=true), on SQLite. Admission control is disabled, so that the
+# writers queue up on the DB and not in front of it
+
+WRITERS = [1, 8, 64]
+
+
+def run_writers(url: str, writers: int, duration: float) -> Dict[str, Any]:
+    latencies: List[float] = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+    template = next(datagen.dashboards(1, 1))
+
+    def writer(n: int) -> None:
+        session = requests.Session()
+        prefix = uuid.uuid4().hex[:8]
+        local: List[float] = []
+        local_errors = 0
+        i = 0
+        while time.monotonic() < deadline:
+            t0 = time.perf_counter()
+            try:
+                ok = session.post(url + DASHBOARDS_PATH, json=dict(template, shortName=f"{prefix}_{i}")).ok
+            except requests.RequestException:
+                ok = False
+            local.append(time.perf_counter() - t0)
+            local_errors += 0 if ok else 1
+            i += 1
+        with lock:
+            latencies.extend(local)
+            errors[0] += local_errors
+
+    t0 = time.monotonic()
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return summarize(latencies, errors[0], time.monotonic() - t0)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Write throughput benchmark (group commit)")
+    parser.add_argument("-d", "--duration", type=float, default=5.0, help="Seconds per measurement")
+    parser.add_argument("--synchronous", action="append", choices=["NORMAL", "FULL"],
+                        help="SQLite synchronous setting (repeatable). Default: both")
+    parser.add_argument("--max-delay", type=float, default=0.0, help="GROUP_COMMIT_MAX_DELAY (s)")
+    parser.add_argument("-o", "--output", help="Write the JSON results to this file too")
+    args = parser.parse_args()
+
+    report: Dict[str, Any] = {
+        "meta": {"revision": git_revision(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                 "duration_s": args.duration},
+    }
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for synchronous in args.synchronous or ["NORMAL", "FULL"]:
+            for group in (False, True):
+                name = f"{'group' if group else 'single'}_{synchronous.lower()}"
+                env = {"DRIVER": "sqlite", "SQLITE_FILE": os.path.join(tmp_dir, name + ".db"),
+                       "SCHEMA_LOCK_FILE": os.path.join(tmp_dir, "schema.lock"),
+                       "SQLITE_SYNCHRONOUS": synchronous, "GROUP_COMMIT": str(group).lower(),
+                       "ADMISSION_MAX_WRITES": "0",
+                       "GROUP_COMMIT_MAX_DELAY": str(args.max_delay)}
+                report[name] = {}
+                with Server(env) as server:
+                    for writers in WRITERS:
+                        print(f"{name}, {writers} writers...", file=sys.stderr)
+                        report[name][str(writers)] = run_writers(server.url, writers, args.duration)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,169 @@
+import os
+
+# Settings read with _env_*() can be overridden with an environment variable of the same name
+
+
+def _env_str(name: str, default: str) -> str:
+    return os.environ.get(name, default)
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.environ.get(name, default))
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.environ.get(name, default))
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    return os.environ.get(name, str(default)).lower() in ("1", "true", "yes")
+
+
 # DB
 
 # Driver
-DRIVER = "sqlite"
+DRIVER = _env_str("DRIVER", "sqlite")
+
+# I/O mode. When True, routes use an async engine (aiosqlite/asyncpg) and never
+# borrow a threadpool slot for DB round-trips
+DB_ASYNC = _env_bool("DB_ASYNC", False)
 
 # SQLite
-SQLITE_FILE = "./data/backend.db"
+SQLITE_FILE = _env_str("SQLITE_FILE", "./data/backend.db")
+# PRAGMAs set on every connection. WAL lets readers proceed while a writer commits
+SQLITE_JOURNAL_MODE = _env_str("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = _env_str("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE = _env_int("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)
+SQLITE_BUSY_TIMEOUT_MS = _env_int("SQLITE_BUSY_TIMEOUT_MS", 5000)
 
 # Postgres
-POSTGRES_HOST = "127.0.0.1"
-POSTGRES_PORT = 5432
-POSTGRES_DB = "stack"
-POSTGRES_USERNAME = "postgres"
-POSTGRES_PASSWORD = "test"
+POSTGRES_HOST = _env_str("POSTGRES_HOST", "127.0.0.1")
+POSTGRES_PORT = _env_int("POSTGRES_PORT", 5432)
+POSTGRES_DB = _env_str("POSTGRES_DB", "stack")
+POSTGRES_USERNAME = _env_str("POSTGRES_USERNAME", "postgres")
+POSTGRES_PASSWORD = _env_str("POSTGRES_PASSWORD", "test")
+# Optional read replica, used by GET routes. Empty host disables it
+POSTGRES_REPLICA_HOST = _env_str("POSTGRES_REPLICA_HOST", "")
+POSTGRES_REPLICA_PORT = _env_int("POSTGRES_REPLICA_PORT", 5432)
+
+# Sharding (data.shards): dashboards are spread over DB_SHARDS DBs by dataCube. Shard 0
+# is the DB above. Shard k > 0 is SQLITE_FILE with a .shard<k> suffix, or the
+# <POSTGRES_DB>_shard<k> DB on the k-th host of POSTGRES_SHARD_HOSTS (comma separated
+# host[:port]; POSTGRES_HOST if missing). Only shard 0 has a read replica
+DB_SHARDS = _env_int("DB_SHARDS", 1)
+POSTGRES_SHARD_HOSTS = _env_str("POSTGRES_SHARD_HOSTS", "")
+
+# Connection pool (per engine, per process)
+DB_POOL_SIZE = _env_int("DB_POOL_SIZE", 5)
+DB_POOL_MAX_OVERFLOW = _env_int("DB_POOL_MAX_OVERFLOW", 10)
+DB_POOL_TIMEOUT = _env_float("DB_POOL_TIMEOUT", 30.0)
+DB_POOL_RECYCLE = _env_int("DB_POOL_RECYCLE", 1800)
+DB_POOL_PRE_PING = _env_bool("DB_POOL_PRE_PING", True)
+
+# Apply the pending schema migrations (data.migrations) at startup. Otherwise, the app
+# doesn't start until they are applied with python -m data.migrations
+DB_MIGRATE_ON_STARTUP = _env_bool("DB_MIGRATE_ON_STARTUP", True)
+# Serializes the schema initialization of the processes (workers) that start at once
+SCHEMA_LOCK_FILE = _env_str("SCHEMA_LOCK_FILE", "/tmp/rest_backend_schema.lock")
 
 # API
 URL_PATH = "/rest"
+
+# Production server (gunicorn_conf.py). 0 workers means one per CPU
+SERVER_BIND = _env_str("SERVER_BIND", "0.0.0.0:80")
+SERVER_WORKERS = _env_int("SERVER_WORKERS", 0)
+# On SIGTERM, workers stop accepting connections and have this long (s) to finish the
+# requests in flight
+SERVER_GRACEFUL_TIMEOUT = _env_int("SERVER_GRACEFUL_TIMEOUT", 30)
+SERVER_TIMEOUT = _env_int("SERVER_TIMEOUT", 60)
+SERVER_KEEPALIVE = _env_int("SERVER_KEEPALIVE", 5)
+
+# Readiness probe: timeout (s) of the DB pings
+HEALTH_CHECK_TIMEOUT = _env_float("HEALTH_CHECK_TIMEOUT", 2.0)
+
+# Admission control (per process). Requests beyond the in-flight limit of their class
+# wait in a bounded queue for up to ADMISSION_QUEUE_TIMEOUT seconds, then get a 503.
+# A limit of 0 disables admission control for the class
+ADMISSION_MAX_READS = _env_int("ADMISSION_MAX_READS", 64)
+ADMISSION_MAX_WRITES = _env_int("ADMISSION_MAX_WRITES", 16)
+ADMISSION_QUEUE_SIZE = _env_int("ADMISSION_QUEUE_SIZE", 64)
+ADMISSION_QUEUE_TIMEOUT = _env_float("ADMISSION_QUEUE_TIMEOUT", 1.0)
+ADMISSION_RETRY_AFTER = _env_int("ADMISSION_RETRY_AFTER", 1)
+# Not subject to admission control (path prefixes). Watchers mostly wait, holding no DB
+# connection, so they are not counted as reads
+ADMISSION_EXEMPT_PATHS = ["/metrics", "/health", "/docs", "/redoc", "/openapi.json",
+                          URL_PATH + "/turnilo/dashboards/_watch"]
+
+# Logging: level (DEBUG logs whole dashboards) and format ("text" or "json")
+LOG_LEVEL = _env_str("LOG_LEVEL", "WARNING")
+LOG_FORMAT = _env_str("LOG_FORMAT", "text")
+
+# Pagination
+PAGINATION_MAX_LIMIT = _env_int("PAGINATION_MAX_LIMIT", 1000)
+
+# List filters: max number of values of the *In filters
+FILTER_IN_MAX_VALUES = _env_int("FILTER_IN_MAX_VALUES", 100)
+
+# Full-text search. "auto" uses FTS5 (SQLite) or a tsvector index (Postgres) when
+# available, "python" always uses the in-process inverted index
+SEARCH_BACKEND = _env_str("SEARCH_BACKEND", "auto")
+SEARCH_DEFAULT_LIMIT = _env_int("SEARCH_DEFAULT_LIMIT", 20)
+
+# Bulk requests
+BULK_MAX_ITEMS = _env_int("BULK_MAX_ITEMS", 10000)
+
+# Dashboard revisions: every REVISION_SNAPSHOT_INTERVAL revisions, one is stored whole
+# instead of as a delta against the previous one
+REVISION_SNAPSHOT_INTERVAL = _env_int("REVISION_SNAPSHOT_INTERVAL", 10)
+REVISION_COMPRESS_LEVEL = _env_int("REVISION_COMPRESS_LEVEL", 9)
+
+# Content-addressed store of the dashboard hash values: zlib level of the stored values,
+# and size (characters) of the in-process cache of the values read (0 disables it)
+HASH_COMPRESS_LEVEL = _env_int("HASH_COMPRESS_LEVEL", 6)
+HASH_CACHE_MAX_SIZE = _env_int("HASH_CACHE_MAX_SIZE", 32 * 1024 * 1024)
+
+# Group commit: single-dashboard writes (create, update, delete) are queued and
+# committed by one writer, in transactions of up to GROUP_COMMIT_MAX_BATCH writes. A
+# batch takes the writes queued while the previous one committed, plus the ones that
+# arrive within GROUP_COMMIT_MAX_DELAY seconds (0: no waiting, no added latency)
+GROUP_COMMIT = _env_bool("GROUP_COMMIT", False)
+GROUP_COMMIT_MAX_BATCH = _env_int("GROUP_COMMIT_MAX_BATCH", 64)
+GROUP_COMMIT_MAX_DELAY = _env_float("GROUP_COMMIT_MAX_DELAY", 0.0)
+
+# Export/import (gzip'd NDJSON archives). Imports commit (and checkpoint) every
+# IMPORT_BATCH_SIZE lines, and report up to IMPORT_MAX_ERRORS failed lines
+EXPORT_COMPRESS_LEVEL = _env_int("EXPORT_COMPRESS_LEVEL", 6)
+IMPORT_BATCH_SIZE = _env_int("IMPORT_BATCH_SIZE", 1000)
+IMPORT_MAX_ERRORS = _env_int("IMPORT_MAX_ERRORS", 100)
+
+# Read cache (dashboards by id and by dataCube/shortName). 0 entries disables it
+CACHE_MAX_ENTRIES = _env_int("CACHE_MAX_ENTRIES", 1024)
+CACHE_TTL_SECONDS = _env_float("CACHE_TTL_SECONDS", 60.0)
+
+# Encoded list payloads (cached with the list). Compressed with gzip, or brotli if the
+# brotli package is installed, on first request of each encoding
+PAYLOAD_MIN_COMPRESS_SIZE = _env_int("PAYLOAD_MIN_COMPRESS_SIZE", 1024)
+PAYLOAD_GZIP_LEVEL = _env_int("PAYLOAD_GZIP_LEVEL", 6)
+PAYLOAD_BROTLI_QUALITY = _env_int("PAYLOAD_BROTLI_QUALITY", 5)
+
+# Change feed (cross-replica cache coherence)
+CHANGE_FEED_POLL_INTERVAL = _env_float("CHANGE_FEED_POLL_INTERVAL", 1.0)
+CHANGE_FEED_GAP_TIMEOUT = _env_float("CHANGE_FEED_GAP_TIMEOUT", 10.0)
+CHANGE_FEED_RETENTION = _env_int("CHANGE_FEED_RETENTION", 10000)
+CHANGE_FEED_PRUNE_INTERVAL = _env_float("CHANGE_FEED_PRUNE_INTERVAL", 300.0)
+
+# Watchers (_watch): the last WATCH_BUFFER_SIZE changes are kept in memory, older ones
+# are read from the change log (at most WATCH_BACKLOG_LIMIT per query). Event streams
+# send a heartbeat every WATCH_HEARTBEAT_INTERVAL seconds and end after
+# WATCH_MAX_DURATION seconds (clients reconnect and resume), long polls wait for up to
+# WATCH_MAX_TIMEOUT seconds
+WATCH_BUFFER_SIZE = _env_int("WATCH_BUFFER_SIZE", 4096)
+WATCH_BACKLOG_LIMIT = _env_int("WATCH_BACKLOG_LIMIT", 1000)
+WATCH_HEARTBEAT_INTERVAL = _env_float("WATCH_HEARTBEAT_INTERVAL", 15.0)
+WATCH_MAX_DURATION = _env_float("WATCH_MAX_DURATION", 300.0)
+WATCH_RETRY_MS = _env_int("WATCH_RETRY_MS", 1000)
+WATCH_DEFAULT_TIMEOUT = _env_float("WATCH_DEFAULT_TIMEOUT", 30.0)
+WATCH_MAX_TIMEOUT = _env_float("WATCH_MAX_TIMEOUT", 60.0)
+
+# Streaming (NDJSON) responses: rows fetched from the DB per query
+STREAM_CHUNK_SIZE = _env_int("STREAM_CHUNK_SIZE", 500)
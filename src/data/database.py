@@ -1,38 +1,308 @@
-from typing import Any, Generator
-from sqlmodel import SQLModel, create_engine, Session
-from sqlalchemy_utils import database_exists, create_database
+import asyncio
+import fcntl
+import logging
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from typing import (Any, AsyncContextManager, AsyncGenerator, AsyncIterator, Callable, Dict, Generator, Iterator,
+                    List, NamedTuple, Optional, Sequence, TypeVar, Union)
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import Engine, text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.concurrency import run_in_threadpool
+import data.engine_config as engine_config
+import data.migrations as migrations
+import data.shards as shards
+from services import metrics, search
 import constants
 
+logger = logging.getLogger(__name__)
 
-def create_tables(db_engine) -> None:
-    from models.turnilo_dashboard import TurniloDashboard
-    SQLModel.metadata.create_all(db_engine, tables=[TurniloDashboard.__table__])
+T = TypeVar("T")
+DbSession = Union[Session, AsyncSession]
 
+# pg_advisory_lock() key of the schema initialization
+SCHEMA_LOCK_KEY = 0x7475726e696c6f
 
-if constants.DRIVER == "sqlite":
-    engine = create_engine("sqlite:///" + constants.SQLITE_FILE, connect_args={"check_same_thread": False})
-else:
-    engine = create_engine(
-        "postgresql://"
-        + constants.POSTGRES_USERNAME
-        + ":"
-        + constants.POSTGRES_PASSWORD
-        + "@"
-        + constants.POSTGRES_HOST
-        + ":"
-        + str(constants.POSTGRES_PORT)
-        + "/"
-        + constants.POSTGRES_DB)
 
-if not database_exists(engine.url):
-    print("Creating DB...")
-    create_database(engine.url)  # type: ignore
-    create_tables(engine)
+@contextmanager
+def _schema_lock(db_engine: Engine) -> Iterator[None]:
+    # Processes of this host (workers) are serialized by the lock file. On Postgres, an
+    # advisory lock also serializes the replicas that run on other hosts
+    # Slow to import, and only needed here
+    from sqlalchemy_utils import database_exists, create_database
+    with open(constants.SCHEMA_LOCK_FILE, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        if not database_exists(db_engine.url):
+            logger.info("Creating DB...")
+            create_database(db_engine.url)  # type: ignore
+        if db_engine.dialect.name != "postgresql":
+            yield
+            return
+        with db_engine.connect() as conn:
+            conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": SCHEMA_LOCK_KEY})
+            try:
+                yield
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": SCHEMA_LOCK_KEY})
+
+
+def init_schema(db_engine: Engine, target: Optional[int] = None) -> List[int]:
+    """
+    Creates the DB if needed and applies the pending migrations (up to target). Returns
+    the versions applied. Safe to run from several processes at once: the first one does
+    the work, the others wait for it and then find nothing to do
+    """
+    with _schema_lock(db_engine):
+        return migrations.migrate(db_engine, target)
+
+
+class Engines(NamedTuple):
+    engine: Engine
+    # GET routes read from the replica, if configured
+    read_engine: Engine
+    # Only in async mode (constants.DB_ASYNC)
+    async_engine: Optional[AsyncEngine]
+    async_read_engine: Optional[AsyncEngine]
+
+
+# Nothing connects to the DB at import time: the engines are created on first use, and
+# the schema is initialized by init() (from the app lifespan)
+_engines: Optional[List[Engines]] = None
+_schema_initialized = False
+_init_lock = threading.RLock()
+
+
+def _make_engines(shard: int) -> Engines:
+    engine = engine_config.make_engine(engine_config.database_url(shard=shard))
+    read_engine = engine_config.make_engine(engine_config.database_url(replica=True)) \
+        if engine_config.has_replica(shard) else engine
+
+    async_engine: Optional[AsyncEngine] = None
+    async_read_engine: Optional[AsyncEngine] = None
+    if constants.DB_ASYNC:
+        async_engine = engine_config.make_async_engine(engine_config.database_url(async_mode=True, shard=shard))
+        async_read_engine = engine_config.make_async_engine(
+            engine_config.database_url(async_mode=True, replica=True)) \
+            if engine_config.has_replica(shard) else async_engine
+
+    for _engine in {engine, read_engine}:
+        metrics.instrument_engine(_engine)
+    for _async_engine in {async_engine, async_read_engine} - {None}:
+        metrics.instrument_engine(_async_engine.sync_engine)  # type: ignore
+    return Engines(engine, read_engine, async_engine, async_read_engine)
+
+
+def shard_engines() -> List[Engines]:
+    """
+    The engines of this process, by shard, created on first use (creating an engine does
+    not connect)
+    """
+    global _engines
+    if _engines is None:
+        with _init_lock:
+            if _engines is None:
+                _engines = [_make_engines(shard) for shard in shards.all_shards()]
+    return _engines
+
+
+def get_engines(shard: int = 0) -> Engines:
+    return shard_engines()[shard]
+
+
+def __getattr__(name: str) -> Any:
+    # db.engine, db.read_engine, db.async_engine and db.async_read_engine (of shard 0)
+    if name in Engines._fields:
+        return getattr(get_engines(), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def init() -> None:
+    """
+    Creates the engines and initializes the schema of every shard, once per process
+    (forked workers inherit it). Blocking: call it from a thread in async code
+    """
+    global _schema_initialized
+    with _init_lock:
+        if _schema_initialized:
+            return
+        for shard, engines_ in enumerate(shard_engines()):
+            engine = engines_.engine
+            # A single query on every boot: the DB is only checked for (and created) when
+            # its schema is not current
+            if not migrations.is_current(engine):
+                if not constants.DB_MIGRATE_ON_STARTUP:
+                    raise RuntimeError(f"The DB schema is not at version {migrations.LATEST_VERSION}: "
+                                       "run python -m data.migrations")
+                init_schema(engine)
+            if not shards.is_registered(engine, shard):
+                with _schema_lock(engine):
+                    shards.register(engine, shard)
+            search.enable_search_index(engine)
+        _schema_initialized = True
+
+
+def engines() -> Dict[str, Union[Engine, AsyncEngine]]:
+    """
+    The distinct engines of this process, by role (prefixed with their shard, but the
+    ones of shard 0)
+    """
+    named: Dict[str, Union[Engine, AsyncEngine]] = {}
+    for shard, e in enumerate(shard_engines()):
+        prefix = f"shard{shard}_" if shard else ""
+        named[prefix + "primary"] = e.engine
+        if e.read_engine is not e.engine:
+            named[prefix + "replica"] = e.read_engine
+        if e.async_engine is not None:
+            named[prefix + "async_primary"] = e.async_engine
+        if e.async_read_engine is not None and e.async_read_engine is not e.async_engine:
+            named[prefix + "async_replica"] = e.async_read_engine
+    return named
+
+
+def reset_engines_after_fork() -> None:
+    """
+    Run in forked workers: forgets the pooled connections inherited from the parent
+    (still owned by it) without closing them, so each worker opens its own
+    """
+    if _engines is None:
+        return
+    for _engine in engines().values():
+        sync_engine = _engine.sync_engine if isinstance(_engine, AsyncEngine) else _engine
+        sync_engine.dispose(close=False)
+
+
+async def dispose_engines() -> None:
+    """
+    Closes the pooled connections, on shutdown
+    """
+    if _engines is None:
+        return
+    for _engine in engines().values():
+        if isinstance(_engine, AsyncEngine):
+            await _engine.dispose()
+        else:
+            _engine.dispose()
+
+
+class ShardedSession(Session):
+    """
+    Session over an engine per shard (of the same role). Statements go to the shard set
+    by use_shard(), shard 0 by default. A session that used several shards has a
+    transaction on each: commit() commits them one after the other
+    """
+
+    def __init__(self, bind: Optional[Engine] = None, shard_binds: Optional[Sequence[Engine]] = None, **kwargs: Any):
+        super().__init__(bind=bind, **kwargs)
+        self.shard_binds = list(shard_binds) if shard_binds is not None else [bind]
+        self.shard = 0
+
+    def get_bind(self, mapper: Any = None, **kwargs: Any) -> Any:
+        return self.shard_binds[self.shard]
+
+
+def use_shard(db_session: Union[Session, AsyncSession], shard: int) -> None:
+    """
+    Routes the next statements of db_session to shard. A plain Session only has shard 0
+    """
+    sync_session = db_session.sync_session if isinstance(db_session, AsyncSession) else db_session
+    if isinstance(sync_session, ShardedSession):
+        sync_session.shard = shard
+    elif shard != 0:
+        raise RuntimeError(f"Not a sharded session: can't use shard {shard}")
+
+
+def _session(write: bool) -> Session:
+    # Returned objects are not refreshed (SELECT) after commit
+    binds = [engine_config.for_writes(e.engine) if write else e.read_engine for e in shard_engines()]
+    return ShardedSession(binds[0], binds, expire_on_commit=False)
+
+
+def _async_session(write: bool) -> AsyncSession:
+    # Objects must stay readable after commit: a lazy refresh outside of
+    # run_sync() would need to do I/O from the event loop
+    binds = [e.async_engine if write else e.async_read_engine for e in shard_engines()]
+    if write:
+        binds = [engine_config.for_writes(b) for b in binds if b is not None]
+    return AsyncSession(binds[0], sync_session_class=ShardedSession, expire_on_commit=False,
+                        shard_binds=[b.sync_engine for b in binds if b is not None])
 
 
 def get_session() -> Generator[Session, Any, None]:
-    db_session = Session(engine)
+    db_session = _session(write=True)
     try:
         yield db_session
     finally:
         db_session.close()
+
+
+def get_read_session() -> Generator[Session, Any, None]:
+    db_session = _session(write=False)
+    try:
+        yield db_session
+    finally:
+        db_session.close()
+
+
+async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
+    async with _async_session(write=True) as db_session:
+        yield db_session
+
+
+async def get_async_read_session() -> AsyncGenerator[AsyncSession, None]:
+    async with _async_session(write=False) as db_session:
+        yield db_session
+
+
+@asynccontextmanager
+async def shard_session(shard: int = 0, write: bool = False) -> AsyncIterator[DbSession]:
+    """
+    A session of the current I/O mode, routed to shard, for the code that must not hold
+    a pooled connection for the whole request (a session dependency keeps its connection
+    until the response is sent), or that runs on several shards at once
+    """
+    if constants.DB_ASYNC:
+        async with _async_session(write) as db_session:
+            use_shard(db_session, shard)
+            yield db_session
+        return
+    with _session(write) as sync_session:
+        use_shard(sync_session, shard)
+        yield sync_session
+
+
+def read_session() -> AsyncContextManager[DbSession]:
+    """
+    A read session of the current I/O mode (see shard_session())
+    """
+    return shard_session()
+
+
+# Session dependencies for the routes, depending on the I/O mode
+session_dependency: Callable[[], Any] = get_async_session if constants.DB_ASYNC else get_session
+read_session_dependency: Callable[[], Any] = get_async_read_session if constants.DB_ASYNC else get_read_session
+
+
+async def run(db_session: DbSession, fn: Callable[..., T], *args: Any) -> T:
+    """
+    Runs fn(session, *args), a function written against a sync Session, without
+    blocking the event loop.
+
+    For AsyncSession, fn runs on the async driver via run_sync() (greenlet, no thread).
+    For Session (sync mode), fn runs in Starlette's threadpool.
+    """
+    if isinstance(db_session, AsyncSession):
+        return await db_session.run_sync(fn, *args)
+    return await run_in_threadpool(fn, db_session, *args)
+
+
+async def run_on_shards(shard_ids: Sequence[int], fn: Callable[..., T], *args: Any, write: bool = False) -> List[T]:
+    """
+    Runs fn(session, *args) on each of shard_ids at once, a session (and transaction)
+    per shard. Returns the results in the order of shard_ids
+    """
+    async def run_on_shard(shard: int) -> T:
+        async with shard_session(shard, write) as db_session:
+            return await run(db_session, fn, *args)
+
+    return list(await asyncio.gather(*(run_on_shard(shard) for shard in shard_ids)))
@@ -0,0 +1,147 @@
+import os
+from typing import Any, Dict, Optional, Tuple, TypeVar, Union
+from sqlalchemy import Engine, URL, create_engine, event
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+import constants
+
+# Engine configuration: URLs, pool parameters and SQLite PRAGMAs, from constants
+
+EngineT = TypeVar("EngineT", bound=Union[Engine, AsyncEngine])
+
+_DRIVERS = {
+    # (driver, async): SQLAlchemy drivername
+    ("sqlite", False): "sqlite",
+    ("sqlite", True): "sqlite+aiosqlite",
+    ("postgres", False): "postgresql+psycopg2",
+    ("postgres", True): "postgresql+asyncpg",
+}
+
+
+def sqlite_file(shard: int = 0) -> str:
+    if shard == 0:
+        return constants.SQLITE_FILE
+    root, ext = os.path.splitext(constants.SQLITE_FILE)
+    return f"{root}.shard{shard}{ext}"
+
+
+def _postgres_host(shard: int, replica: bool) -> Tuple[str, int]:
+    if replica:
+        return constants.POSTGRES_REPLICA_HOST, constants.POSTGRES_REPLICA_PORT
+    hosts = [h.strip() for h in constants.POSTGRES_SHARD_HOSTS.split(",") if h.strip()]
+    if shard == 0 or len(hosts) < shard:
+        return constants.POSTGRES_HOST, constants.POSTGRES_PORT
+    host, _, port = hosts[shard - 1].partition(":")
+    return host, int(port) if port else constants.POSTGRES_PORT
+
+
+def database_url(async_mode: bool = False, replica: bool = False, shard: int = 0) -> URL:
+    driver = "sqlite" if constants.DRIVER == "sqlite" else "postgres"
+    drivername = _DRIVERS[(driver, async_mode)]
+    if driver == "sqlite":
+        return URL.create(drivername, database=sqlite_file(shard))
+    host, port = _postgres_host(shard, replica)
+    return URL.create(
+        drivername,
+        username=constants.POSTGRES_USERNAME,
+        password=constants.POSTGRES_PASSWORD,
+        host=host,
+        port=port,
+        database=constants.POSTGRES_DB if shard == 0 else f"{constants.POSTGRES_DB}_shard{shard}")
+
+
+def has_replica(shard: int = 0) -> bool:
+    return shard == 0 and constants.DRIVER != "sqlite" and constants.POSTGRES_REPLICA_HOST != ""
+
+
+def sqlite_pragmas() -> Dict[str, Any]:
+    return {
+        "journal_mode": constants.SQLITE_JOURNAL_MODE,
+        "synchronous": constants.SQLITE_SYNCHRONOUS,
+        "mmap_size": constants.SQLITE_MMAP_SIZE,
+        "busy_timeout": constants.SQLITE_BUSY_TIMEOUT_MS,
+    }
+
+
+def pool_options() -> Dict[str, Any]:
+    return {
+        "pool_size": constants.DB_POOL_SIZE,
+        "max_overflow": constants.DB_POOL_MAX_OVERFLOW,
+        "pool_timeout": constants.DB_POOL_TIMEOUT,
+        "pool_recycle": constants.DB_POOL_RECYCLE,
+        "pool_pre_ping": constants.DB_POOL_PRE_PING,
+    }
+
+
+def _set_pragmas_on_connect(engine: Engine, pragmas: Dict[str, Any]) -> None:
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record) -> None:
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+# Execution option of the write transactions (see for_writes())
+_BEGIN_IMMEDIATE = "sqlite_begin_immediate"
+
+
+def _begin_immediate_on_demand(engine: Engine) -> None:
+    # Transactions still begin implicitly (pysqlite), but the ones of for_writes()
+    @event.listens_for(engine, "begin")
+    def begin(conn) -> None:
+        if conn.get_execution_options().get(_BEGIN_IMMEDIATE):
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def for_writes(engine: EngineT) -> EngineT:
+    """
+    engine (sharing its pool), for the sessions that write. On SQLite, their transactions
+    take the write lock up front: pysqlite only begins a transaction at the first write,
+    so the reads before it (the If-Match checks, the versions that writes replace) could
+    see rows that a concurrent write is about to change. SELECT ... FOR UPDATE covers
+    that on Postgres
+    """
+    return engine.execution_options(**{_BEGIN_IMMEDIATE: True})  # type: ignore
+
+
+def make_engine(url: Optional[URL] = None, pragmas: Optional[Dict[str, Any]] = None) -> Engine:
+    url = url if url is not None else database_url()
+    if url.get_backend_name() == "sqlite":
+        engine = create_engine(url, connect_args={"check_same_thread": False}, **pool_options())
+        _set_pragmas_on_connect(engine, pragmas if pragmas is not None else sqlite_pragmas())
+        _begin_immediate_on_demand(engine)
+        return engine
+    return create_engine(url, **pool_options())
+
+
+def _begin_immediate(engine: Engine) -> None:
+    # pysqlite begins transactions implicitly, right before the first write: a SAVEPOINT
+    # would start (and its RELEASE commit) a transaction of its own. Transactions are
+    # begun explicitly instead, taking the write lock up front
+    @event.listens_for(engine, "connect")
+    def disable_implicit_begin(dbapi_connection, connection_record) -> None:
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def begin(conn) -> None:
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def make_writer_engine(shard: int = 0) -> Engine:
+    """
+    Engine of the group commit writer (of shard): its transactions support savepoints,
+    also on SQLite
+    """
+    engine = make_engine(database_url(shard=shard))
+    if engine.url.get_backend_name() == "sqlite":
+        _begin_immediate(engine)
+    return engine
+
+
+def make_async_engine(url: Optional[URL] = None, pragmas: Optional[Dict[str, Any]] = None) -> AsyncEngine:
+    url = url if url is not None else database_url(async_mode=True)
+    engine = create_async_engine(url, **pool_options())
+    if url.get_backend_name() == "sqlite":
+        _set_pragmas_on_connect(engine.sync_engine, pragmas if pragmas is not None else sqlite_pragmas())
+        _begin_immediate_on_demand(engine.sync_engine)
+    return engine
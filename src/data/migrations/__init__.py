@@ -0,0 +1,373 @@
+import datetime
+import importlib
+import logging
+import pkgutil
+import re
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence
+from sqlalchemy import Column, Connection, DateTime, Engine, Integer, MetaData, String, Table, exc, func, insert, \
+    inspect, select, text
+
+# Schema migrations
+#
+# Each module vNNNN_<name>.py of this package migrates the schema to version NNNN. It
+# defines a DESCRIPTION and a list of STEPS. The versions applied to a DB are recorded
+# in the schemaMigrations table, one row per version.
+#
+# Steps must be idempotent (IF NOT EXISTS...): a migration that fails midway is re-run
+# from its first step. Each step runs in its own transaction, except the online ones
+# (CREATE INDEX CONCURRENTLY on Postgres), which can't run in a transaction, and the
+# batched data migrations (RunPythonBatches), which commit a transaction per batch.
+#
+# Run them with `python -m data.migrations` (from src/; --dry-run reports the locks
+# they would take), or let the app run them at startup (constants.DB_MIGRATE_ON_STARTUP)
+
+logger = logging.getLogger(__name__)
+
+VERSION_TABLE = "schemaMigrations"
+
+# Rough rate (rows/s) of a blocking step (e.g. an index build), to estimate how long
+# its lock is held
+ESTIMATED_ROWS_PER_SECOND = 500000
+
+_metadata = MetaData()
+schema_migrations = Table(
+    VERSION_TABLE, _metadata,
+    Column("version", Integer, primary_key=True, autoincrement=False),
+    Column("description", String, nullable=False),
+    Column("appliedAt", DateTime, nullable=False),
+)
+
+
+@dataclass
+class LockImpact:
+    # Lock taken, in the DB's terms
+    lock: str
+    blocks_reads: bool
+    blocks_writes: bool
+    # Table whose size drives how long the lock is held, if any
+    table: Optional[str] = None
+
+
+class Step:
+    description = ""
+    dialects: Optional[Sequence[str]] = None
+
+    def applies(self, dialect: str) -> bool:
+        return self.dialects is None or dialect in self.dialects
+
+    def online(self, dialect: str) -> bool:
+        """
+        Whether the step must run outside of a transaction
+        """
+        return False
+
+    def lock_impact(self, dialect: str) -> LockImpact:
+        raise NotImplementedError
+
+    def run(self, conn: Connection) -> None:
+        raise NotImplementedError
+
+    def apply(self, engine: Engine) -> None:
+        """
+        Runs the step on engine's DB: in a transaction, unless it's online
+        """
+        if self.online(engine.dialect.name):
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                self.run(conn)
+        else:
+            with engine.begin() as conn:
+                self.run(conn)
+
+
+class CreateTables(Step):
+    """
+    Creates the tables (and their indexes) that don't exist
+    """
+
+    def __init__(self, *tables: Table):
+        self.tables = tables
+        self.description = "Create table " + ", ".join(table.name for table in tables)
+
+    def lock_impact(self, dialect: str) -> LockImpact:
+        return LockImpact("none (new tables)", False, False)
+
+    def run(self, conn: Connection) -> None:
+        for table in self.tables:
+            table.create(conn, checkfirst=True)
+
+
+class CreateIndex(Step):
+    """
+    CREATE INDEX IF NOT EXISTS. On Postgres, it is built CONCURRENTLY (without blocking
+    writes); an invalid index left by a failed concurrent build is rebuilt. Elsewhere,
+    the build blocks the writers of the table
+    """
+
+    def __init__(self, name: str, table: str, expressions: str, using: Optional[str] = None,
+                 dialects: Optional[Sequence[str]] = None):
+        self.name = name
+        self.table = table
+        self.expressions = expressions
+        self.using = using
+        self.dialects = dialects
+        self.description = f"Create index {name}"
+
+    def online(self, dialect: str) -> bool:
+        return dialect == "postgresql"
+
+    def lock_impact(self, dialect: str) -> LockImpact:
+        if dialect == "postgresql":
+            return LockImpact("SHARE UPDATE EXCLUSIVE (concurrent build)", False, False, self.table)
+        if dialect == "sqlite":
+            return LockImpact("write transaction", False, True, self.table)
+        return LockImpact("SHARE", False, True, self.table)
+
+    def run(self, conn: Connection) -> None:
+        concurrently = ""
+        if self.online(conn.dialect.name):
+            concurrently = "CONCURRENTLY "
+            valid = conn.execute(text("SELECT i.indisvalid FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+                                      "WHERE c.relname = :name"), {"name": self.name}).scalar()
+            if valid is False:
+                logger.warning("Rebuilding invalid index %s", self.name)
+                conn.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{self.name}"'))
+        using = f" USING {self.using}" if self.using else ""
+        conn.execute(text(f'CREATE INDEX {concurrently}IF NOT EXISTS "{self.name}" '
+                          f'ON "{self.table}"{using} ({self.expressions})'))
+
+
+class DropIndex(Step):
+    """
+    DROP INDEX IF EXISTS, CONCURRENTLY on Postgres (without blocking reads or writes).
+    Elsewhere, it blocks the writers of the table for as long as it takes
+    """
+
+    def __init__(self, name: str, table: str, dialects: Optional[Sequence[str]] = None):
+        self.name = name
+        self.table = table
+        self.dialects = dialects
+        self.description = f"Drop index {name}"
+
+    def online(self, dialect: str) -> bool:
+        return dialect == "postgresql"
+
+    def lock_impact(self, dialect: str) -> LockImpact:
+        if dialect == "postgresql":
+            return LockImpact("SHARE UPDATE EXCLUSIVE (concurrent drop)", False, False)
+        return LockImpact("write transaction", False, True)
+
+    def run(self, conn: Connection) -> None:
+        concurrently = "CONCURRENTLY " if self.online(conn.dialect.name) else ""
+        conn.execute(text(f'DROP INDEX {concurrently}IF EXISTS "{self.name}"'))
+
+
+class AddColumn(Step):
+    """
+    ALTER TABLE ... ADD COLUMN, unless the column exists. The column must be nullable
+    (and without a default): a catalog only change, that doesn't rewrite the table
+    """
+
+    def __init__(self, table: str, column: Column):
+        assert column.nullable and column.server_default is None
+        self.table = table
+        self.column = column
+        self.description = f"Add column {table}.{column.name}"
+
+    def lock_impact(self, dialect: str) -> LockImpact:
+        if dialect == "postgresql":
+            # Held for an instant, but it waits for (and then blocks) the queries in flight
+            return LockImpact("ACCESS EXCLUSIVE (catalog only)", True, True)
+        return LockImpact("write transaction (catalog only)", False, True)
+
+    def run(self, conn: Connection) -> None:
+        if any(column["name"] == self.column.name for column in inspect(conn).get_columns(self.table)):
+            return
+        column_type = self.column.type.compile(dialect=conn.dialect)
+        conn.execute(text(f'ALTER TABLE "{self.table}" ADD COLUMN "{self.column.name}" {column_type}'))
+
+
+class RunSql(Step):
+    """
+    Runs SQL statements (idempotent ones) in a transaction
+    """
+
+    def __init__(self, description: str, statements: Sequence[str], lock: LockImpact,
+                 dialects: Optional[Sequence[str]] = None):
+        self.description = description
+        self.statements = statements
+        self.lock = lock
+        self.dialects = dialects
+
+    def lock_impact(self, dialect: str) -> LockImpact:
+        return self.lock
+
+    def run(self, conn: Connection) -> None:
+        for statement in self.statements:
+            conn.execute(text(statement))
+
+
+class RunPython(Step):
+    """
+    Calls fn(connection) in a transaction
+    """
+
+    def __init__(self, description: str, fn: Callable[[Connection], None], lock: LockImpact,
+                 dialects: Optional[Sequence[str]] = None):
+        self.description = description
+        self.fn = fn
+        self.lock = lock
+        self.dialects = dialects
+
+    def lock_impact(self, dialect: str) -> LockImpact:
+        return self.lock
+
+    def run(self, conn: Connection) -> None:
+        self.fn(conn)
+
+
+class RunPythonBatches(Step):
+    """
+    Calls fn(engine), which commits a transaction per batch: the locks of a batch are
+    released when it commits, not at the end of the step. fn must resume from the
+    batches that were committed (the step is re-run after a failure)
+    """
+
+    def __init__(self, description: str, fn: Callable[[Engine], None], lock: LockImpact,
+                 dialects: Optional[Sequence[str]] = None):
+        self.description = description
+        self.fn = fn
+        self.lock = lock
+        self.dialects = dialects
+
+    def lock_impact(self, dialect: str) -> LockImpact:
+        return self.lock
+
+    def apply(self, engine: Engine) -> None:
+        self.fn(engine)
+
+
+@dataclass
+class Migration:
+    version: int
+    description: str
+    steps: List[Step]
+
+
+_MODULE_RE = re.compile(r"v(\d+)_\w+$")
+
+
+def load() -> List[Migration]:
+    """
+    The migrations of this package, by version
+    """
+    migrations = []
+    for module_info in pkgutil.iter_modules(__path__):
+        match = _MODULE_RE.match(module_info.name)
+        if match is None:
+            continue
+        module = importlib.import_module(f"{__name__}.{module_info.name}")
+        migrations.append(Migration(int(match.group(1)), module.DESCRIPTION, module.STEPS))
+    migrations.sort(key=lambda m: m.version)
+    versions = [m.version for m in migrations]
+    assert versions == list(range(1, len(versions) + 1)), f"Migration versions must be 1..n: {versions}"
+    return migrations
+
+
+MIGRATIONS = load()
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def current_version(engine: Engine) -> int:
+    """
+    Latest version applied to engine's DB; 0 if none. Raises if the DB is unreachable
+    """
+    with engine.connect() as conn:
+        if not engine.dialect.has_table(conn, VERSION_TABLE):
+            return 0
+        return conn.execute(select(func.max(schema_migrations.c.version))).scalar() or 0
+
+
+def pending(engine: Engine) -> List[Migration]:
+    version = current_version(engine)
+    return [m for m in MIGRATIONS if m.version > version]
+
+
+def _table_rows(conn: Connection, table: str) -> int:
+    """
+    Number of rows of table (an estimate on Postgres); 0 if it doesn't exist
+    """
+    if not conn.dialect.has_table(conn, table):
+        return 0
+    if conn.dialect.name == "postgresql":
+        rows = conn.execute(text("SELECT reltuples FROM pg_class WHERE relname = :table"), {"table": table}).scalar()
+        return max(int(rows or 0), 0)
+    return conn.execute(text(f'SELECT count(*) FROM "{table}"')).scalar() or 0
+
+
+def plan(engine: Engine) -> List[Dict[str, Any]]:
+    """
+    The pending migrations and, for each step, the lock it takes and an estimate of how
+    long it blocks reads/writes (dry run: changes nothing)
+    """
+    dialect = engine.dialect.name
+    report = []
+    with engine.connect() as conn:
+        for migration in pending(engine):
+            steps = []
+            for step in migration.steps:
+                if not step.applies(dialect):
+                    continue
+                impact = step.lock_impact(dialect)
+                rows = _table_rows(conn, impact.table) if impact.table else 0
+                blocking = impact.blocks_reads or impact.blocks_writes
+                steps.append({
+                    "step": step.description,
+                    "online": step.online(dialect),
+                    "lock": impact.lock,
+                    "table": impact.table,
+                    "rows": rows,
+                    "blocksReads": impact.blocks_reads,
+                    "blocksWrites": impact.blocks_writes,
+                    "estimatedBlockingSeconds": round(rows / ESTIMATED_ROWS_PER_SECOND, 3) if blocking else 0.0,
+                })
+            report.append({"version": migration.version, "description": migration.description, "steps": steps})
+    return report
+
+
+def migrate(engine: Engine, target: Optional[int] = None) -> List[int]:
+    """
+    Applies the pending migrations up to target (default: the latest). Returns the
+    versions applied. Callers serialize concurrent runs (see data.database.init_schema)
+    """
+    dialect = engine.dialect.name
+    _metadata.create_all(engine, tables=[schema_migrations])
+    applied = []
+    for migration in pending(engine):
+        if target is not None and migration.version > target:
+            break
+        logger.info("Migrating schema to version %d: %s", migration.version, migration.description)
+        for step in migration.steps:
+            if not step.applies(dialect):
+                continue
+            step.apply(engine)
+        with engine.begin() as conn:
+            conn.execute(insert(schema_migrations).values(
+                version=migration.version, description=migration.description,
+                appliedAt=datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)))
+        applied.append(migration.version)
+    return applied
+
+
+def is_current(engine: Engine) -> bool:
+    """
+    Whether engine's DB is at the latest version. False if it can't be read (e.g. the
+    DB doesn't exist yet)
+    """
+    try:
+        version = current_version(engine)
+    except exc.DBAPIError:
+        return False
+    if version > LATEST_VERSION:
+        logger.warning("Schema version %d is newer than this code's (%d)", version, LATEST_VERSION)
+    return version >= LATEST_VERSION
@@ -0,0 +1,42 @@
+import argparse
+import json
+import logging
+import sys
+
+import data.database as db
+import data.migrations as migrations
+import data.shards as shards
+
+# python -m data.migrations [--dry-run] [--target N], from src/
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m data.migrations", description="Migrates the DB schema")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Report the pending migrations and the locks they would take, as JSON")
+    parser.add_argument("--target", type=int, help="Version to migrate to (default: the latest)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    sharded = shards.count() > 1
+    reports = []
+    for shard, engines in enumerate(db.shard_engines()):
+        engine = engines.engine
+        if args.dry_run:
+            report = {
+                "version": migrations.current_version(engine),
+                "latestVersion": migrations.LATEST_VERSION,
+                "pending": [m for m in migrations.plan(engine) if args.target is None or m["version"] <= args.target],
+            }
+            reports.append(dict(shard=shard, **report) if sharded else report)
+            continue
+        applied = db.init_schema(engine, args.target)
+        prefix = f"Shard {shard}: " if sharded else ""
+        print(f"{prefix}Applied: {applied or 'none'}. Schema version: {migrations.current_version(engine)}")
+    if args.dry_run:
+        json.dump(reports if sharded else reports[0], sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
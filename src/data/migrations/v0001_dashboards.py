@@ -0,0 +1,23 @@
+from sqlalchemy import Boolean, Column, Integer, MetaData, String, Table, UniqueConstraint
+from data.migrations import CreateTables
+
+# Schema of the first releases. DBs created before the migrations already have it
+
+DESCRIPTION = "Dashboards table"
+
+_metadata = MetaData()
+_dashboards = Table(
+    "turniloDashboards", _metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("dataCube", String, nullable=False),
+    Column("shortName", String, nullable=False, index=True),
+    Column("name", String, nullable=False),
+    Column("description", String),
+    Column("hash", String, nullable=False),
+    Column("preset", Boolean),
+    UniqueConstraint("dataCube", "shortName", name="_dataCube_shortName"),
+)
+
+STEPS = [
+    CreateTables(_dashboards),
+]
@@ -0,0 +1,21 @@
+from sqlalchemy import Column, Integer, MetaData, String, Table
+from data.migrations import CreateTables
+
+DESCRIPTION = "Dashboard change feed"
+
+_metadata = MetaData()
+_changes = Table(
+    "turniloDashboardChanges", _metadata,
+    Column("seq", Integer, primary_key=True),
+    Column("dashboardId", Integer, nullable=False),
+    Column("op", String, nullable=False),
+    Column("dataCube", String, nullable=False),
+    Column("shortName", String, nullable=False),
+    Column("origin", String, nullable=False),
+    # seq must never be reused
+    sqlite_autoincrement=True,
+)
+
+STEPS = [
+    CreateTables(_changes),
+]
@@ -0,0 +1,13 @@
+from data.migrations import CreateIndex
+
+DESCRIPTION = "Indexes of the dashboard list filters and orderings"
+
+STEPS = [
+    CreateIndex("ix_turniloDashboards_preset_dataCube", "turniloDashboards", 'preset, "dataCube"'),
+    CreateIndex("ix_turniloDashboards_name_id", "turniloDashboards", "name, id"),
+    # Prefix filters (LIKE 'prefix%') on Postgres
+    CreateIndex("ix_turniloDashboards_dataCube_pattern", "turniloDashboards", '"dataCube" text_pattern_ops',
+                dialects=["postgresql"]),
+    CreateIndex("ix_turniloDashboards_shortName_pattern", "turniloDashboards", '"shortName" text_pattern_ops',
+                dialects=["postgresql"]),
+]
@@ -0,0 +1,51 @@
+import logging
+from sqlalchemy import Connection, exc, text
+from data.migrations import CreateIndex, LockImpact, RunPython
+
+DESCRIPTION = "Dashboard full-text search index"
+
+logger = logging.getLogger(__name__)
+
+_FTS_TABLE = "turniloDashboardsFts"
+
+_FTS5_DDL = [
+    f'CREATE VIRTUAL TABLE IF NOT EXISTS "{_FTS_TABLE}" USING fts5(name, description, '
+    f'content="turniloDashboards", content_rowid="id")',
+    f'''CREATE TRIGGER IF NOT EXISTS "{_FTS_TABLE}_insert" AFTER INSERT ON "turniloDashboards" BEGIN
+        INSERT INTO "{_FTS_TABLE}"(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS "{_FTS_TABLE}_delete" AFTER DELETE ON "turniloDashboards" BEGIN
+        INSERT INTO "{_FTS_TABLE}"("{_FTS_TABLE}", rowid, name, description)
+            VALUES ('delete', old.id, old.name, old.description);
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS "{_FTS_TABLE}_update" AFTER UPDATE ON "turniloDashboards" BEGIN
+        INSERT INTO "{_FTS_TABLE}"("{_FTS_TABLE}", rowid, name, description)
+            VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO "{_FTS_TABLE}"(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END''',
+    # Indexes the rows that existed before the FTS table
+    f'INSERT INTO "{_FTS_TABLE}"("{_FTS_TABLE}") VALUES (\'rebuild\')',
+]
+
+# Must be the expression of the search queries (services.search) for the index to be used
+_PG_TSVECTOR = "setweight(to_tsvector('simple', coalesce(name, '')), 'A') || " \
+               "setweight(to_tsvector('simple', coalesce(description, '')), 'B')"
+
+
+def _create_fts5(conn: Connection) -> None:
+    try:
+        conn.execute(text(_FTS5_DDL[0]))
+    except exc.OperationalError as e:
+        # SQLite built without FTS5: search uses the in-process index
+        logger.warning("No FTS5 table: %s", e)
+        return
+    for ddl in _FTS5_DDL[1:]:
+        conn.execute(text(ddl))
+
+
+STEPS = [
+    RunPython("Create FTS5 table and triggers", _create_fts5,
+              LockImpact("write transaction", False, True, "turniloDashboards"), dialects=["sqlite"]),
+    CreateIndex("ix_turniloDashboards_search", "turniloDashboards", f"({_PG_TSVECTOR})", using="gin",
+                dialects=["postgresql"]),
+]
@@ -0,0 +1,19 @@
+from sqlalchemy import BigInteger, Column, DateTime, Integer, LargeBinary, MetaData, Table
+from data.migrations import CreateTables
+
+DESCRIPTION = "Dashboard revisions"
+
+_metadata = MetaData()
+_revisions = Table(
+    "turniloDashboardRevisions", _metadata,
+    Column("dashboardId", Integer, primary_key=True, autoincrement=False),
+    Column("revision", Integer, primary_key=True, autoincrement=False),
+    Column("snapshotRevision", Integer, nullable=False),
+    Column("checksum", BigInteger, nullable=False),
+    Column("data", LargeBinary, nullable=False),
+    Column("createdAt", DateTime, nullable=False),
+)
+
+STEPS = [
+    CreateTables(_revisions),
+]
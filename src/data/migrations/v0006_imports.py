@@ -0,0 +1,20 @@
+from sqlalchemy import Boolean, Column, DateTime, Integer, MetaData, String, Table
+from data.migrations import CreateTables
+
+DESCRIPTION = "Dashboard import checkpoints"
+
+_metadata = MetaData()
+_imports = Table(
+    "turniloDashboardImports", _metadata,
+    Column("importId", String, primary_key=True),
+    Column("lines", Integer, nullable=False),
+    Column("created", Integer, nullable=False),
+    Column("updated", Integer, nullable=False),
+    Column("failed", Integer, nullable=False),
+    Column("done", Boolean, nullable=False),
+    Column("updatedAt", DateTime, nullable=False),
+)
+
+STEPS = [
+    CreateTables(_imports),
+]
@@ -0,0 +1,77 @@
+import hashlib
+import zlib
+from collections import Counter
+from typing import Any, Dict, List, Optional
+from sqlalchemy import Column, Connection, Engine, Integer, LargeBinary, MetaData, String, Table, bindparam, \
+    select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from data.migrations import AddColumn, CreateTables, LockImpact, RunPythonBatches
+
+DESCRIPTION = "Content-addressed store of the dashboard hash values"
+
+# Rows per batch of the data migration
+_BATCH_SIZE = 1000
+_COMPRESS_LEVEL = 6
+
+_metadata = MetaData()
+_hashes = Table(
+    "turniloDashboardHashes", _metadata,
+    Column("digest", String, primary_key=True),
+    Column("data", LargeBinary, nullable=False),
+    Column("size", Integer, nullable=False),
+    Column("refs", Integer, nullable=False),
+)
+_dashboards = Table(
+    "turniloDashboards", _metadata,
+    Column("id", Integer, primary_key=True),
+    Column("hash", String, nullable=False),
+    Column("hashDigest", String, nullable=True),
+)
+
+
+def _upsert(conn: Connection, rows: List[Dict[str, Any]]) -> None:
+    insert = postgresql.insert if conn.dialect.name == "postgresql" else sqlite.insert
+    statement = insert(_hashes)
+    conn.execute(statement.on_conflict_do_update(index_elements=["digest"],
+                                                 set_={"refs": _hashes.c.refs + statement.excluded.refs}), rows)
+
+
+def _move_batch(conn: Connection, last_id: int) -> Optional[int]:
+    """
+    Moves the hash values of the next batch of rows after last_id. Returns the last id
+    of the batch; None when no rows are left
+    """
+    rows = conn.execute(select(_dashboards.c.id, _dashboards.c.hash).where(
+        _dashboards.c.hashDigest.is_(None), _dashboards.c.id > last_id).order_by(
+        _dashboards.c.id).limit(_BATCH_SIZE)).all()
+    if not rows:
+        return None
+    digests = {_id: hashlib.sha256(value.encode()).hexdigest() for _id, value in rows}
+    values = {digests[_id]: value.encode() for _id, value in rows}
+    refs = Counter(digests.values())
+    _upsert(conn, [{"digest": digest, "data": zlib.compress(data, _COMPRESS_LEVEL), "size": len(data),
+                    "refs": refs[digest]} for digest, data in values.items()])
+    conn.execute(update(_dashboards).where(_dashboards.c.id == bindparam("_id")).values(
+        hash="", hashDigest=bindparam("_digest")),
+        [{"_id": _id, "_digest": digest} for _id, digest in digests.items()])
+    return int(rows[-1][0])
+
+
+def _move_hashes(engine: Engine) -> None:
+    # The rows written before this version have their hash inline: store each value once
+    # (same format as services.hash_store) and reference it. A transaction per batch, so
+    # writers only wait for the batch of their row; a re-run resumes from the rows
+    # without hashDigest
+    last_id: Optional[int] = 0
+    while last_id is not None:
+        with engine.begin() as conn:
+            last_id = _move_batch(conn, last_id)
+
+
+STEPS = [
+    CreateTables(_hashes),
+    AddColumn("turniloDashboards", Column("hashDigest", String, nullable=True)),
+    RunPythonBatches("Move the hash values to the store", _move_hashes,
+                     LockImpact(f"row locks of a batch ({_BATCH_SIZE} rows) at a time, committed per batch",
+                                False, False, "turniloDashboards")),
+]
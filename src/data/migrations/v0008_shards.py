@@ -0,0 +1,20 @@
+from sqlalchemy import Column, Integer, MetaData, Table
+from data.migrations import CreateTables, LockImpact, RunSql
+
+DESCRIPTION = "Shard registration and id allocation"
+
+_metadata = MetaData()
+_shard = Table(
+    "turniloDashboardShard", _metadata,
+    Column("shard", Integer, primary_key=True, autoincrement=False),
+    Column("shards", Integer, nullable=False),
+    Column("lastId", Integer, nullable=False),
+)
+
+STEPS = [
+    CreateTables(_shard),
+    # Ids of the shard on Postgres. Its bounds are set when the DB is registered as a
+    # shard (data.shards.register): the shard is not known here
+    RunSql("Create sequence turniloDashboardIds", ['CREATE SEQUENCE IF NOT EXISTS "turniloDashboardIds"'],
+           LockImpact("none (new sequence)", False, False), dialects=["postgresql"]),
+]
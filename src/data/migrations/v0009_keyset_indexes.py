@@ -0,0 +1,14 @@
+from data.migrations import CreateIndex, DropIndex
+
+DESCRIPTION = "Indexes that end in id, for the keyset pages of the filtered dashboard lists"
+
+STEPS = [
+    CreateIndex("ix_turniloDashboards_dataCube_id", "turniloDashboards", '"dataCube", id'),
+    CreateIndex("ix_turniloDashboards_shortName_id", "turniloDashboards", '"shortName", id'),
+    CreateIndex("ix_turniloDashboards_preset_dataCube_id", "turniloDashboards", 'preset, "dataCube", id'),
+    CreateIndex("ix_turniloDashboards_id_filters", "turniloDashboards", 'id, "dataCube", "shortName", preset'),
+    # Prefixes of the new ones
+    DropIndex("ix_turniloDashboards_id", "turniloDashboards"),
+    DropIndex("ix_turniloDashboards_shortName", "turniloDashboards"),
+    DropIndex("ix_turniloDashboards_preset_dataCube", "turniloDashboards"),
+]
@@ -0,0 +1,114 @@
+import zlib
+from typing import List
+from sqlalchemy import Engine, delete, exc, func, text, update
+from sqlmodel import Session, select
+from models.turnilo_dashboard import TurniloDashboard
+from models.turnilo_dashboard_shard import TurniloDashboardShard
+
+import constants
+
+# Sharding
+#
+# Dashboards are spread over constants.DB_SHARDS DBs (shards) by dataCube. Every shard
+# has the whole schema, and a dashboard's revisions, changes and hash values live on its
+# shard: a single-dashboard write is a transaction on one DB.
+#
+# Ids are shard-prefixed: shard k allocates them in [k * SHARD_ID_SPAN, (k + 1) *
+# SHARD_ID_SPAN), so the shard of an id is id // SHARD_ID_SPAN, and sorting by id sorts
+# by shard first. With a single shard, ids come from the DB as they always did. On
+# Postgres, a shard allocates them from a sequence, whose nextval() doesn't hold a lock
+# until the transaction ends: the writers of a shard don't queue on a counter row.
+# Elsewhere (SQLite serializes the writes anyway) they come from a counter.
+#
+# Each shard records its place in the set of shards, checked on startup. Changing the
+# number of shards moves dataCubes to other shards: a shard that has dashboards of
+# other shards doesn't start (export them, and import them into the new set of shards).
+
+SHARD_ID_SPAN = 100_000_000
+# Ids are 32-bit integers on Postgres
+MAX_SHARDS = (2 ** 31 - 1) // SHARD_ID_SPAN
+# Id sequence of a shard, on Postgres (created by the migrations)
+ID_SEQUENCE = "turniloDashboardIds"
+
+
+def count() -> int:
+    return constants.DB_SHARDS
+
+
+def all_shards() -> List[int]:
+    return list(range(count()))
+
+
+def of_data_cube(data_cube: str) -> int:
+    # crc32: stable across processes (unlike hash())
+    return zlib.crc32(data_cube.encode()) % count()
+
+
+def of_id(_id: int) -> int:
+    """
+    Shard of a dashboard id. Can be past the last shard (no such dashboard)
+    """
+    return _id // SHARD_ID_SPAN if count() > 1 else 0
+
+
+def allocate_ids(session: Session, n: int) -> List[int]:
+    """
+    n new ids of the shard that session is routed to: from its sequence on Postgres;
+    elsewhere, in session's transaction (which holds the shard's id counter until it
+    ends)
+    """
+    if session.get_bind().dialect.name == "postgresql":
+        try:
+            return list(session.execute(text(f"SELECT nextval('\"{ID_SEQUENCE}\"') FROM generate_series(1, :n)"),
+                                        {"n": n}).scalars())
+        except exc.DataError as e:
+            # Past the sequence's MAXVALUE
+            raise RuntimeError("The shard has no ids left") from e
+    statement = update(TurniloDashboardShard).values(lastId=TurniloDashboardShard.lastId + n)
+    if session.get_bind().dialect.update_returning:
+        shard, last_id = session.execute(statement.returning(
+            TurniloDashboardShard.shard, TurniloDashboardShard.lastId)).one()  # type: ignore
+    else:
+        session.execute(statement)
+        shard, last_id = session.exec(select(TurniloDashboardShard.shard, TurniloDashboardShard.lastId)).one()
+    if last_id >= (shard + 1) * SHARD_ID_SPAN:
+        raise RuntimeError(f"Shard {shard} has no ids left")
+    return list(range(last_id - n + 1, last_id + 1))
+
+
+def is_registered(engine: Engine, shard: int) -> bool:
+    """
+    Whether engine's DB is registered as shard of the current set of shards
+    """
+    with Session(engine) as session:
+        row = session.exec(select(TurniloDashboardShard)).first()
+    return row is not None and (row.shard, row.shards) == (shard, count())
+
+
+def register(engine: Engine, shard: int) -> None:
+    """
+    Registers engine's DB as shard of the current set of shards. Raises if it has
+    dashboards that belong to other shards
+    """
+    if not 1 <= count() <= MAX_SHARDS:
+        raise RuntimeError(f"DB_SHARDS must be in [1, {MAX_SHARDS}]")
+    with Session(engine) as session:
+        misplaced = [data_cube for data_cube in session.exec(select(TurniloDashboard.dataCube).distinct()).all()
+                     if of_data_cube(data_cube) != shard]
+        min_id, max_id = session.exec(select(func.min(TurniloDashboard.id), func.max(TurniloDashboard.id))).one()
+        if count() > 1 and max_id is not None and not shard * SHARD_ID_SPAN <= min_id <= max_id < (
+                shard + 1) * SHARD_ID_SPAN:
+            misplaced.append(f"ids {min_id}..{max_id}")
+        if misplaced:
+            raise RuntimeError(f"Shard {shard} has dashboards of other shards with DB_SHARDS={count()} "
+                               f"({', '.join(misplaced[:5])}): export them, and import them into an empty set "
+                               "of shards")
+        last_id = max(max_id or 0, shard * SHARD_ID_SPAN)
+        if count() > 1 and engine.dialect.name == "postgresql":
+            if last_id + 1 >= (shard + 1) * SHARD_ID_SPAN:
+                raise RuntimeError(f"Shard {shard} has no ids left")
+            session.execute(text(f'ALTER SEQUENCE "{ID_SEQUENCE}" MINVALUE {shard * SHARD_ID_SPAN + 1} '
+                                 f'MAXVALUE {(shard + 1) * SHARD_ID_SPAN - 1} RESTART WITH {last_id + 1}'))
+        session.exec(delete(TurniloDashboardShard))  # type: ignore
+        session.add(TurniloDashboardShard(shard=shard, shards=count(), lastId=last_id))
+        session.commit()
@@ -0,0 +1,31 @@
+import multiprocessing
+import constants
+
+# Production server: gunicorn master, one uvicorn worker process per CPU (by default).
+# Run with: gunicorn -c gunicorn_conf.py main:app
+#
+# The app is imported, and the schema initialized, once in the master before the
+# workers fork. On SIGTERM, workers stop accepting connections, finish the requests in
+# flight (up to graceful_timeout) and close their DB pools (see main.lifespan).
+
+bind = constants.SERVER_BIND
+workers = constants.SERVER_WORKERS or multiprocessing.cpu_count()
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+graceful_timeout = constants.SERVER_GRACEFUL_TIMEOUT
+timeout = constants.SERVER_TIMEOUT
+keepalive = constants.SERVER_KEEPALIVE
+# Same as uvicorn --proxy-headers
+forwarded_allow_ips = "*"
+
+
+def when_ready(server) -> None:
+    # In the master, before the workers fork: they inherit the initialized schema
+    import data.database as db
+    db.init()
+
+
+def post_fork(server, worker) -> None:
+    # The DB connections opened by the master (schema init) belong to it
+    import data.database as db
+    db.reset_engines_after_fork()
@@ -0,0 +1,40 @@
+import json
+import logging
+import constants
+
+# Logging: level-gated (constants.LOG_LEVEL) and optionally structured (JSON lines).
+# Context goes in `extra`, e.g. logger.info("Created dashboard", extra={"dashboard_id": 1})
+
+# Attributes of every LogRecord; anything else was passed in `extra`
+_RECORD_ATTRS = set(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update({k: v for k, v in record.__dict__.items() if k not in _RECORD_ATTRS})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self) -> None:
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        extra = " ".join(f"{k}={v}" for k, v in record.__dict__.items() if k not in _RECORD_ATTRS)
+        return super().format(record) + (" " + extra if extra else "")
+
+
+def configure() -> None:
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter() if constants.LOG_FORMAT == "json" else TextFormatter())
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(constants.LOG_LEVEL.upper())
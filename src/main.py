@@ -1,5 +1,40 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
 from fastapi import FastAPI
+from starlette.concurrency import run_in_threadpool
+from middleware.admission import AdmissionMiddleware
+from middleware.metrics import MetricsMiddleware
 from routes import routes
+from services import change_feed, group_commit, health, watch
 
-app = FastAPI()
+import data.database as db
+import data.shards as shards
+import log_config
+
+log_config.configure()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    await run_in_threadpool(db.init)
+    listener, *_ = change_feed.start_listeners([e.engine for e in db.shard_engines()],
+                                               [e.read_engine for e in db.shard_engines()])
+    if shards.count() == 1:
+        # Watch cursors are change log seqs: there is a log per shard
+        watch.hub.start(asyncio.get_running_loop(), listener.last_seq or 0)
+    health.set_serving(True)
+    yield
+    # The server stopped accepting connections and finished the requests in flight
+    health.set_serving(False)
+    group_commit.stop()
+    change_feed.stop_listener()
+    watch.hub.stop()
+    await db.dispose_engines()
+
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(routes.api_router)
+# Outermost last: the metrics include the requests rejected by admission control
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(MetricsMiddleware)
@@ -0,0 +1,129 @@
+import asyncio
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Sequence
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+from services import metrics
+
+import constants
+
+CLASS_READ = "read"
+CLASS_WRITE = "write"
+
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+REJECTED_QUEUE_FULL = "queue_full"
+REJECTED_TIMEOUT = "timeout"
+
+
+class Limiter:
+    """
+    At most limit concurrent holders; up to queue_size callers wait (FIFO) for up to
+    timeout seconds. Used from a single event loop, so it needs no locking
+    """
+
+    def __init__(self, name: str, limit: int, queue_size: int, timeout: float):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.in_flight = 0
+        self._waiters: Deque["asyncio.Future[None]"] = deque()
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> Optional[str]:
+        """
+        Returns None once admitted (call release() when done), or the rejection reason
+        """
+        if self.in_flight < self.limit and not self._waiters:
+            self._admitted(0.0)
+            return None
+        if len(self._waiters) >= self.queue_size:
+            return REJECTED_QUEUE_FULL
+        waiter: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        metrics.admission_queue_depth.set(len(self._waiters), (self.name,))
+        t0 = time.perf_counter()
+        try:
+            await asyncio.wait({waiter}, timeout=self.timeout)
+        except asyncio.CancelledError:
+            self._leave(waiter)
+            raise
+        if not waiter.done():
+            self._leave(waiter)
+            return REJECTED_TIMEOUT
+        # release() handed its slot over: in_flight is already accounted for
+        metrics.admission_wait_seconds.observe(time.perf_counter() - t0, (self.name,))
+        return None
+
+    def release(self) -> None:
+        if self._waiters:
+            self._waiters.popleft().set_result(None)
+            metrics.admission_queue_depth.set(len(self._waiters), (self.name,))
+            return
+        self.in_flight -= 1
+        metrics.admission_in_flight.set(self.in_flight, (self.name,))
+
+    def _leave(self, waiter: "asyncio.Future[None]") -> None:
+        if waiter.done():
+            # The slot was handed over meanwhile: pass it on
+            self.release()
+            return
+        waiter.cancel()
+        self._waiters.remove(waiter)
+        metrics.admission_queue_depth.set(len(self._waiters), (self.name,))
+
+    def _admitted(self, waited: float) -> None:
+        self.in_flight += 1
+        metrics.admission_in_flight.set(self.in_flight, (self.name,))
+        metrics.admission_wait_seconds.observe(waited, (self.name,))
+
+
+class AdmissionMiddleware:
+    """
+    Bounds the number of requests served concurrently, separately for reads and writes.
+    Beyond the limit, requests wait in a short bounded queue; when it is full, or the
+    wait times out, they are rejected with a 503 and Retry-After, instead of piling up
+    behind the DB pool.
+    """
+
+    def __init__(self, app: ASGIApp,
+                 max_reads: int = constants.ADMISSION_MAX_READS,
+                 max_writes: int = constants.ADMISSION_MAX_WRITES,
+                 queue_size: int = constants.ADMISSION_QUEUE_SIZE,
+                 queue_timeout: float = constants.ADMISSION_QUEUE_TIMEOUT,
+                 retry_after: int = constants.ADMISSION_RETRY_AFTER,
+                 exempt_paths: Sequence[str] = constants.ADMISSION_EXEMPT_PATHS):
+        self.app = app
+        self.retry_after = retry_after
+        self.exempt_paths = tuple(exempt_paths)
+        self.limiters: Dict[str, Limiter] = {
+            CLASS_READ: Limiter(CLASS_READ, max_reads, queue_size, queue_timeout),
+            CLASS_WRITE: Limiter(CLASS_WRITE, max_writes, queue_size, queue_timeout),
+        }
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"].startswith(self.exempt_paths):
+            await self.app(scope, receive, send)
+            return
+        request_class = CLASS_READ if scope["method"] in READ_METHODS else CLASS_WRITE
+        limiter = self.limiters[request_class]
+        if limiter.limit <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        rejected = await limiter.acquire()
+        if rejected is not None:
+            metrics.admission_rejected_total.inc((request_class, rejected))
+            response = JSONResponse({"detail": "Server overloaded, retry later"}, status_code=503,
+                                    headers={"Retry-After": str(self.retry_after)})
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
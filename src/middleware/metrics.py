@@ -0,0 +1,45 @@
+import time
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from services import metrics
+
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+class MetricsMiddleware:
+    """
+    Records, per route template (not per URL), request latency, status codes and the
+    number/time of DB queries
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        stats = metrics.RequestDbStats()
+        token = metrics.request_db_stats.set(stats)
+        metrics.http_requests_in_flight.inc()
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - t0
+            metrics.http_requests_in_flight.dec()
+            metrics.request_db_stats.reset(token)
+            # The router stores the matched route in the scope
+            route = scope.get("route")
+            labels = (scope["method"], getattr(route, "path", UNMATCHED_ROUTE))
+            metrics.http_requests_total.inc(labels + (str(status[0]),))
+            metrics.http_request_duration_seconds.observe(elapsed, labels)
+            metrics.http_request_db_queries.observe(stats.queries, labels)
+            metrics.http_request_db_duration_seconds.observe(stats.seconds, labels)
@@ -1,15 +1,37 @@
 from typing import Optional
+from sqlalchemy import Index
 from sqlmodel import Field, SQLModel, UniqueConstraint
 
 
 class TurniloDashboard(SQLModel, table=True):
     __tablename__ = "turniloDashboards"  # type: ignore
-    __table_args__ = (UniqueConstraint('dataCube', 'shortName', name='_dataCube_shortName'),)
+    __table_args__ = (
+        UniqueConstraint('dataCube', 'shortName', name='_dataCube_shortName'),
+        # The equality filters, in id order: keyset pages of the lists seek on them
+        # without sorting
+        Index('ix_turniloDashboards_dataCube_id', 'dataCube', 'id'),
+        Index('ix_turniloDashboards_shortName_id', 'shortName', 'id'),
+        Index('ix_turniloDashboards_preset_dataCube_id', 'preset', 'dataCube', 'id'),
+        # The other filters (prefix, IN, preset) are evaluated walking this one, in id
+        # order: the ids of a page are read from it alone (see _dashboards_select)
+        Index('ix_turniloDashboards_id_filters', 'id', 'dataCube', 'shortName', 'preset'),
+        # orderBy=name (and its keyset pagination) without sorting
+        Index('ix_turniloDashboards_name_id', 'name', 'id'),
+        # Prefix filters are LIKE 'prefix%' on Postgres, which can only use a btree index
+        # with pattern ops (unless the DB collation is C). SQLite uses GLOB instead
+        Index('ix_turniloDashboards_dataCube_pattern', 'dataCube',
+              postgresql_ops={'dataCube': 'text_pattern_ops'}).ddl_if(dialect='postgresql'),
+        Index('ix_turniloDashboards_shortName_pattern', 'shortName',
+              postgresql_ops={'shortName': 'text_pattern_ops'}).ddl_if(dialect='postgresql'),
+    )
 
-    id: Optional[int] = Field(default=None, primary_key=True, index=True)
+    id: Optional[int] = Field(default=None, primary_key=True)
     dataCube: str
-    shortName: str = Field(index=True)
+    shortName: str
     name: str
     description: Optional[str] = ""
     hash: str
     preset: Optional[bool] = False
+    # Digest of hash in the content-addressed store (services.hash_store), set by the
+    # writes; the hash column is then left empty. Not part of the default representation
+    hashDigest: Optional[str] = Field(default=None, exclude=True)
@@ -0,0 +1,18 @@
+from typing import Optional
+from sqlmodel import Field, SQLModel
+
+
+class TurniloDashboardChange(SQLModel, table=True):
+    """
+    Change log of turniloDashboards. One row per write, inserted in the same
+    transaction as the write; seq is monotonic
+    """
+    __tablename__ = "turniloDashboardChanges"  # type: ignore
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    seq: Optional[int] = Field(default=None, primary_key=True)
+    dashboardId: int
+    op: str
+    dataCube: str
+    shortName: str
+    origin: str
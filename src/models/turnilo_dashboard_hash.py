@@ -0,0 +1,16 @@
+from sqlmodel import Field, SQLModel
+
+
+class TurniloDashboardHash(SQLModel, table=True):
+    """
+    Content-addressed store of the dashboard hash values: each distinct value is kept
+    once, zlib compressed, keyed by its SHA-256 digest. refs counts the dashboards that
+    reference it; the value is deleted when it drops to 0
+    """
+    __tablename__ = "turniloDashboardHashes"  # type: ignore
+
+    digest: str = Field(primary_key=True)
+    data: bytes
+    # Uncompressed size, in bytes
+    size: int
+    refs: int
@@ -0,0 +1,18 @@
+from datetime import datetime
+from sqlmodel import Field, SQLModel
+
+
+class TurniloDashboardImport(SQLModel, table=True):
+    """
+    Checkpoint of an import (POST .../_import): the lines of the archive committed so far,
+    in the same transaction as their dashboards. A failed import resumes from there
+    """
+    __tablename__ = "turniloDashboardImports"  # type: ignore
+
+    importId: str = Field(primary_key=True)
+    lines: int = 0
+    created: int = 0
+    updated: int = 0
+    failed: int = 0
+    done: bool = False
+    updatedAt: datetime
@@ -0,0 +1,21 @@
+from datetime import datetime
+from sqlalchemy import BigInteger
+from sqlmodel import Field, SQLModel
+
+
+class TurniloDashboardRevision(SQLModel, table=True):
+    """
+    Version of a dashboard, recorded by every write. data is the JSON of the dashboard,
+    zlib compressed: whole in snapshots (snapshotRevision == revision), otherwise as a
+    delta against the previous revision (which is the compression dictionary)
+    """
+    __tablename__ = "turniloDashboardRevisions"  # type: ignore
+
+    dashboardId: int = Field(primary_key=True)
+    revision: int = Field(primary_key=True)
+    # Revision of the snapshot that this one is rebuilt from
+    snapshotRevision: int
+    # CRC-32 of the uncompressed JSON
+    checksum: int = Field(sa_type=BigInteger)
+    data: bytes
+    createdAt: datetime
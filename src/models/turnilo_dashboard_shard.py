@@ -0,0 +1,15 @@
+from sqlmodel import Field, SQLModel
+
+
+class TurniloDashboardShard(SQLModel, table=True):
+    """
+    Single row: the place of this DB in the set of shards (data.shards), checked on
+    startup, and the last dashboard id it allocated (Postgres allocates them from a
+    sequence: see data.shards)
+    """
+    __tablename__ = "turniloDashboardShard"  # type: ignore
+
+    shard: int = Field(primary_key=True)
+    # Number of shards of the set
+    shards: int
+    lastId: int
@@ -0,0 +1,24 @@
+from fastapi import APIRouter
+from fastapi.responses import ORJSONResponse
+from services import health
+
+health_router = APIRouter()
+
+
+@health_router.get(
+    "/health/live",
+    summary="Liveness probe: the process answers requests",
+    include_in_schema=False
+)
+async def get_health_live():
+    return ORJSONResponse({"status": "ok"})
+
+
+@health_router.get(
+    "/health/ready",
+    summary="Readiness probe: 503 while starting or shutting down, or when a DB engine is unusable",
+    include_in_schema=False
+)
+async def get_health_ready():
+    report = await health.readiness()
+    return ORJSONResponse(report, status_code=200 if report["ready"] else 503)
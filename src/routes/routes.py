@@ -1,5 +1,9 @@
 from fastapi import APIRouter
+from routes.health_routes import health_router
+from routes.metrics_routes import metrics_router
 from routes.turnilo_dashboard_routes import turnilo_router
 
 api_router = APIRouter()
 api_router.include_router(turnilo_router)
+api_router.include_router(metrics_router)
+api_router.include_router(health_router)
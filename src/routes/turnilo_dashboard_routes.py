@@ -1,26 +1,176 @@
-from fastapi import APIRouter, Depends, HTTPException
-from typing import List
-from sqlmodel import Session
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from typing import AsyncIterable, AsyncIterator, Dict, List, Optional
+import orjson
+import uuid
 from models.turnilo_dashboard import TurniloDashboard
+from services import archives, etags, payloads, revisions, watch
 from services import turnilo_dashboards as td
+from services.cache import dashboard_cache
 
 import constants
 import data.database as db
+import data.shards as shards
 
 turnilo_router = APIRouter()
 
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+_payload_builds = payloads.SingleFlight()
+
 ### Dashboards ###
 
 
+def _not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
+
+
+async def _ndjson_lines(rows: AsyncIterable[td.DashboardRow]) -> AsyncIterator[bytes]:
+    async for row in rows:
+        yield orjson.dumps(row) + b"\n"
+
+
 @turnilo_router.get(
     constants.URL_PATH + "/turnilo/dashboards/",
     response_model=List[TurniloDashboard],
-    summary="Gets all Turnilo dashboards"
+    response_class=ORJSONResponse,
+    summary="Gets all Turnilo dashboards",
+    description="Use limit/after for keyset pagination; the cursor of the next page is returned in the "
+                + NEXT_CURSOR_HEADER + " header. Send 'Accept: " + NDJSON_MEDIA_TYPE + "' to get a streamed "
+                + "NDJSON response instead. Use fields to return only some of the fields of the dashboards; "
+                + "fields can also ask for hashDigest, the digest of hash (get its value from _hashes/{digest}).",
+    responses={200: {"content": {NDJSON_MEDIA_TYPE: {}}}}
 )
-def turnilo_get_dashboards(db_session: Session = Depends(db.get_session),
-                           query_params: td.GetQueryParams = Depends()):
+async def turnilo_get_dashboards(request: Request,
+                                 db_session: db.DbSession = Depends(db.read_session_dependency),
+                                 query_params: td.GetQueryParams = Depends(),
+                                 if_none_match: Optional[str] = Header(default=None)):
     query_params.validate()
-    return td.dashboards_get_all(db_session, query_params)
+    ndjson = NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+    if query_params.is_cacheable() and not ndjson:
+        return await _turnilo_get_dashboards_payload(request, db_session, query_params, if_none_match)
+
+    # The version must be read before the list: a concurrent write can then only make
+    # the ETag older than the payload, never the opposite
+    version = await td.dashboards_version_async(db_session, query_params)
+    etag = td.dashboards_list_etag(version, query_params, NDJSON_MEDIA_TYPE if ndjson else "")
+    if etags.weak_match(etag, etags.parse_etags(if_none_match)):
+        return _not_modified(etag)
+
+    headers = {"ETag": etag}
+    if ndjson:
+        return StreamingResponse(_ndjson_lines(td.dashboards_iter_async(db_session, query_params)),
+                                 media_type=NDJSON_MEDIA_TYPE, headers=headers)
+    if not query_params.is_paginated():
+        rows = await td.dashboards_get_all_async(db_session, query_params)
+    else:
+        rows, next_cursor = await td.dashboards_get_page_async(db_session, query_params)
+        if next_cursor:
+            headers[NEXT_CURSOR_HEADER] = next_cursor
+    # Rows are encoded as they come from the DB: returning a Response skips the
+    # response_model validation (which still documents the schema)
+    return ORJSONResponse(rows, headers=headers)
+
+
+async def _turnilo_get_dashboards_payload(request: Request, db_session: db.DbSession,
+                                          query_params: td.GetQueryParams, if_none_match: Optional[str]) -> Response:
+    # Hot lists (all dashboards, by dataCube/shortName): the encoded body is cached and
+    # rebuilt once (by a single request) after the writes that affect it
+    payload = await _payload_builds.do(td.dashboards_payload_key(query_params),
+                                       lambda: td.dashboards_get_payload_async(db_session, query_params))
+    encoding = payloads.negotiate(request.headers.get("accept-encoding"), len(payload.body))
+    headers = {"ETag": td.dashboards_list_etag(payload.version, query_params, encoding or ""),
+               "Vary": "Accept-Encoding"}
+    if etags.weak_match(headers["ETag"], etags.parse_etags(if_none_match)):
+        return Response(status_code=304, headers=headers)
+    body = payload.get(encoding)
+    if body is None:
+        body = await run_in_threadpool(payload.encode, encoding)
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return Response(body, media_type="application/json", headers=headers)
+
+
+@turnilo_router.get(
+    constants.URL_PATH + "/turnilo/dashboards/_search",
+    response_model=List[TurniloDashboard],
+    summary="Full-text search of Turnilo dashboards by name and description",
+    description="Returns the dashboards that match every word of q, best match first. Matches in name rank "
+                "higher than in description. The last word also matches as a prefix."
+)
+async def turnilo_search_dashboards(q: str,
+                                    limit: int = constants.SEARCH_DEFAULT_LIMIT,
+                                    db_session: db.DbSession = Depends(db.read_session_dependency)):
+    return await td.dashboards_search_async(db_session, q, limit)
+
+
+@turnilo_router.get(
+    constants.URL_PATH + "/turnilo/dashboards/_export",
+    summary="Export all Turnilo dashboards as a gzip'd NDJSON archive",
+    description="The archive is streamed from a single query: a consistent snapshot of the dashboards, one per "
+                "line. POST it to _import to load it in (another) store",
+    response_class=StreamingResponse,
+    responses={200: {"content": {archives.MEDIA_TYPE: {}}}}
+)
+async def turnilo_export_dashboards(db_session: db.DbSession = Depends(db.read_session_dependency)):
+    return StreamingResponse(td.dashboards_export_async(db_session), media_type=archives.MEDIA_TYPE,
+                             headers={"Content-Disposition": f'attachment; filename="{archives.FILENAME}"'})
+
+
+@turnilo_router.get(
+    constants.URL_PATH + "/turnilo/dashboards/_watch",
+    response_model=watch.WatchResult,
+    summary="Watch the creates, updates and deletes of Turnilo dashboards",
+    description="Send 'Accept: " + watch.SSE_MEDIA_TYPE + "' to get a stream of Server-Sent Events: the event ids "
+                "are cursors, and reconnecting with Last-Event-ID resumes after it. Otherwise, a long poll: returns "
+                "the events after the after cursor as soon as there are some (or none after timeout seconds), with "
+                "the cursor of the next call; without after, returns the current cursor right away. Use dataCube "
+                "to only get the events of its dashboards.",
+    responses={200: {"content": {watch.SSE_MEDIA_TYPE: {}}}}
+)
+async def turnilo_watch_dashboards(request: Request,
+                                   after: Optional[int] = None,
+                                   dataCube: Optional[str] = None,
+                                   timeout: float = constants.WATCH_DEFAULT_TIMEOUT,
+                                   last_event_id: Optional[str] = Header(default=None)):
+    if shards.count() > 1:
+        # Cursors are the seqs of a change log, and each shard has its own
+        raise HTTPException(status_code=501, detail="Watch is not supported with several shards (DB_SHARDS)")
+    if watch.SSE_MEDIA_TYPE in request.headers.get("accept", ""):
+        if last_event_id:
+            try:
+                after = int(last_event_id)
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Last-Event-ID is not an integer")
+        if after is not None and after < 0:
+            raise HTTPException(status_code=400, detail="after must not be negative")
+        return StreamingResponse(watch.stream(after, dataCube), media_type=watch.SSE_MEDIA_TYPE,
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    if after is not None and after < 0:
+        raise HTTPException(status_code=400, detail="after must not be negative")
+    if not 0 < timeout <= constants.WATCH_MAX_TIMEOUT:
+        raise HTTPException(status_code=400, detail=f"timeout must be in (0, {constants.WATCH_MAX_TIMEOUT}]")
+    return Response(await watch.poll(after, dataCube, timeout), media_type="application/json",
+                    headers={"Cache-Control": "no-store"})
+
+
+@turnilo_router.get(
+    constants.URL_PATH + "/turnilo/dashboards/_hashes/{digest}",
+    response_class=Response,
+    summary="Get a dashboard hash value by its digest (hashDigest)",
+    description="Values never change for a digest: responses can be cached forever",
+    responses={200: {"content": {"text/plain": {}}}}
+)
+async def turnilo_get_dashboard_hash(digest: str,
+                                     db_session: db.DbSession = Depends(db.read_session_dependency),
+                                     if_none_match: Optional[str] = Header(default=None)):
+    headers = {"ETag": etags.make_etag(digest), "Cache-Control": "public, max-age=31536000, immutable"}
+    if etags.weak_match(headers["ETag"], etags.parse_etags(if_none_match)):
+        return Response(status_code=304, headers=headers)
+    value = await td.dashboards_hash_get_async(db_session, digest)
+    return Response(value, media_type="text/plain", headers=headers)
 
 
 @turnilo_router.get(
@@ -28,12 +178,71 @@ def turnilo_get_dashboards(db_session: Session = Depends(db.get_session),
     response_model=TurniloDashboard,
     summary="Get a Turnilo dashboard by id (integer)"
 )
-def turnilo_get_dashboard_id(id: str, db_session: Session = Depends(db.get_session)):
+async def turnilo_get_dashboard_id(id: str,
+                                   response: Response,
+                                   db_session: db.DbSession = Depends(db.read_session_dependency),
+                                   if_none_match: Optional[str] = Header(default=None)):
     try:
         int_id = int(id)
     except BaseException:
         raise HTTPException(status_code=400, detail="Id is not an integer")
-    return td.dashboards_get_id(db_session, int_id)
+    dashboard = await td.dashboards_get_id_async(db_session, int_id)
+    etag = td.dashboard_etag(dashboard)
+    if etags.weak_match(etag, etags.parse_etags(if_none_match)):
+        return _not_modified(etag)
+    response.headers["ETag"] = etag
+    return dashboard
+
+
+@turnilo_router.get(
+    constants.URL_PATH + "/turnilo/dashboards/{id}/revisions",
+    response_model=List[revisions.RevisionInfo],
+    summary="List the revisions of a Turnilo dashboard, oldest first",
+    description="Every write of a dashboard records a revision. Dashboards that were not written since "
+                "revisions exist have none"
+)
+async def turnilo_get_dashboard_revisions(id: str,
+                                          db_session: db.DbSession = Depends(db.read_session_dependency)):
+    try:
+        int_id = int(id)
+    except BaseException:
+        raise HTTPException(status_code=400, detail="Id is not an integer")
+    return await td.dashboards_revisions_async(db_session, int_id)
+
+
+@turnilo_router.get(
+    constants.URL_PATH + "/turnilo/dashboards/{id}/revisions/{revision}",
+    response_model=TurniloDashboard,
+    summary="Get a Turnilo dashboard as of a revision"
+)
+async def turnilo_get_dashboard_revision(id: str, revision: int,
+                                         db_session: db.DbSession = Depends(db.read_session_dependency)):
+    try:
+        int_id = int(id)
+    except BaseException:
+        raise HTTPException(status_code=400, detail="Id is not an integer")
+    return await td.dashboards_revision_get_async(db_session, int_id, revision)
+
+
+@turnilo_router.post(
+    constants.URL_PATH + "/turnilo/dashboards/{id}/revisions/{revision}/_restore",
+    response_model=TurniloDashboard,
+    summary="Restore a Turnilo dashboard to a revision",
+    description="Updates the dashboard with its content as of the revision, which records a new revision. "
+                "If-Match makes it conditional to the current ETag of the dashboard (412 otherwise)"
+)
+async def turnilo_restore_dashboard_revision(id: str, revision: int,
+                                             response: Response,
+                                             db_session: db.DbSession = Depends(db.session_dependency),
+                                             if_match: Optional[str] = Header(default=None)):
+    try:
+        int_id = int(id)
+    except BaseException:
+        raise HTTPException(status_code=400, detail="Id is not an integer")
+    dashboard = await td.dashboards_revision_restore_async(db_session, int_id, revision,
+                                                           etags.parse_etags(if_match))
+    response.headers["ETag"] = td.dashboard_etag(dashboard)
+    return dashboard
 
 
 @turnilo_router.post(
@@ -41,32 +250,124 @@ def turnilo_get_dashboard_id(id: str, db_session: Session = Depends(db.get_sessi
     response_model=TurniloDashboard,
     summary="Create a Turnilo dashboard. A unique id will be assigned."
 )
-def turnilo_create_dashboard(dashboard: TurniloDashboard, db_session: Session = Depends(db.get_session)):
-    return td.dashboards_create(db_session, dashboard)
+async def turnilo_create_dashboard(dashboard: TurniloDashboard,
+                                   response: Response,
+                                   db_session: db.DbSession = Depends(db.session_dependency)):
+    dashboard = await td.dashboards_create_async(db_session, dashboard)
+    response.headers["ETag"] = td.dashboard_etag(dashboard)
+    return dashboard
+
+
+@turnilo_router.post(
+    constants.URL_PATH + "/turnilo/dashboards/_bulk",
+    response_model=List[td.BulkItemResult],
+    summary="Create, upsert or delete Turnilo dashboards in bulk, in a single transaction",
+    description="The body is a JSON array (or NDJSON) of dashboards. op=upsert matches dashboards on "
+                "dataCube+shortName (ids are ignored). op=delete items must have an id or dataCube+shortName. "
+                "The status of each item is reported individually.",
+    openapi_extra={"requestBody": {"required": True, "content": {
+        "application/json": {"schema": {"type": "array", "items": {"$ref": "#/components/schemas/TurniloDashboard"}}},
+        NDJSON_MEDIA_TYPE: {"schema": {"$ref": "#/components/schemas/TurniloDashboard"}},
+    }}}
+)
+async def turnilo_bulk_dashboards(request: Request,
+                                  op: str = td.BULK_OP_CREATE,
+                                  db_session: db.DbSession = Depends(db.session_dependency)):
+    if op not in td.BULK_OPS:
+        raise HTTPException(status_code=400, detail=f"Invalid op='{op}'. Valid ops: {td.BULK_OPS}")
+    ndjson = request.headers.get("content-type", "").startswith(NDJSON_MEDIA_TYPE)
+    items = td.bulk_parse_items(op, await request.body(), ndjson)
+    return await td.dashboards_bulk_async(db_session, op, items)
+
+
+@turnilo_router.post(
+    constants.URL_PATH + "/turnilo/dashboards/_import",
+    response_model=td.ImportResult,
+    summary="Import Turnilo dashboards from an NDJSON archive (as made by _export), gzip'd or not",
+    description="Dashboards are upserted on dataCube+shortName (ids are ignored), committing every "
+                + str(constants.IMPORT_BATCH_SIZE) + " lines. If the import fails, POST the same archive with "
+                "the same importId to resume it after the last committed line. Send 'Content-Type: "
+                + archives.MEDIA_TYPE + "' (or 'Content-Encoding: gzip') for a gzip'd archive",
+    openapi_extra={"requestBody": {"required": True, "content": {
+        archives.MEDIA_TYPE: {"schema": {"type": "string", "format": "binary"}},
+        NDJSON_MEDIA_TYPE: {"schema": {"$ref": "#/components/schemas/TurniloDashboard"}},
+    }}}
+)
+async def turnilo_import_dashboards(request: Request,
+                                    importId: Optional[str] = None,
+                                    db_session: db.DbSession = Depends(db.session_dependency)):
+    import_id = importId or uuid.uuid4().hex
+    state = await td.dashboards_import_state_async(db_session, import_id)
+    errors: List[td.BulkItemResult] = []
+    if not state.done:
+        compressed = archives.is_compressed(request.headers.get("content-type", ""),
+                                            request.headers.get("content-encoding", ""))
+        # Lines committed by the previous attempts are skipped, not re-imported
+        skip = state.lines
+        batch: List[bytes] = []
+        try:
+            async for line in archives.read_lines(request.stream(), compressed):
+                if skip:
+                    skip -= 1
+                    continue
+                batch.append(line)
+                if len(batch) == constants.IMPORT_BATCH_SIZE:
+                    failed = await td.dashboards_import_batch_async(db_session, state, batch)
+                    errors += failed[:constants.IMPORT_MAX_ERRORS - len(errors)]
+                    batch = []
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid archive: {e}. Imported lines: {state.lines}; "
+                                                        f"resume with importId={import_id}")
+        if skip:
+            raise HTTPException(status_code=400, detail=f"The archive has fewer lines than already imported "
+                                                        f"by importId={import_id} ({state.lines})")
+        errors += await td.dashboards_import_batch_async(db_session, state, batch, done=True)
+    return td.ImportResult(**state.model_dump(exclude={"updatedAt"}), errors=errors[:constants.IMPORT_MAX_ERRORS])
 
 
 @turnilo_router.put(
     constants.URL_PATH + "/turnilo/dashboards/{id}",
     response_model=TurniloDashboard,
-    summary="Update/replace a Turnilo dashboard. The dashboard (id) must exist"
+    summary="Update/replace a Turnilo dashboard. The dashboard (id) must exist",
+    description="If-Match makes the update conditional to the current ETag of the dashboard (412 otherwise)"
 )
-def turnilo_update_dashboard(id: str, dashboard: TurniloDashboard, db_session: Session = Depends(db.get_session)):
+async def turnilo_update_dashboard(id: str, dashboard: TurniloDashboard,
+                                   response: Response,
+                                   db_session: db.DbSession = Depends(db.session_dependency),
+                                   if_match: Optional[str] = Header(default=None)):
     try:
         int_id = int(id)
         dashboard.id = int_id
     except BaseException:
         raise HTTPException(status_code=400, detail="Id is not an integer")
-    return td.dashboards_update(db_session, dashboard)
+    dashboard = await td.dashboards_update_async(db_session, dashboard, etags.parse_etags(if_match))
+    response.headers["ETag"] = td.dashboard_etag(dashboard)
+    return dashboard
 
 
 @turnilo_router.delete(
     constants.URL_PATH + "/turnilo/dashboards/{id}",
     response_model=TurniloDashboard,
-    summary="Delete a Turnilo dashboard"
+    summary="Delete a Turnilo dashboard",
+    description="If-Match makes the deletion conditional to the current ETag of the dashboard (412 otherwise)"
 )
-def turnilo_delete_dashboard(id: str, db_session: Session = Depends(db.get_session)):
+async def turnilo_delete_dashboard(id: str,
+                                   db_session: db.DbSession = Depends(db.session_dependency),
+                                   if_match: Optional[str] = Header(default=None)):
     try:
         int_id = int(id)
     except BaseException:
         raise HTTPException(status_code=400, detail="Id is not an integer")
-    return td.dashboards_delete(db_session, int_id)
+    return await td.dashboards_delete_async(db_session, int_id, etags.parse_etags(if_match))
+
+
+### Cache ###
+
+
+@turnilo_router.get(
+    constants.URL_PATH + "/turnilo/cache/stats",
+    response_model=Dict[str, int],
+    summary="Get the dashboard read cache counters (hits, misses, evictions...)"
+)
+async def turnilo_get_cache_stats():
+    return dashboard_cache.stats()
@@ -0,0 +1,71 @@
+import zlib
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterable, Iterator
+
+import orjson
+
+import constants
+
+# Dashboard archives (export/import): NDJSON, one dashboard per line, gzip compressed.
+# Both ends work incrementally, so memory usage does not depend on the archive size
+
+MEDIA_TYPE = "application/gzip"
+FILENAME = "dashboards.ndjson.gz"
+
+# zlib wbits: gzip format; gzip or zlib format (detected from the header)
+_GZIP_WBITS = 31
+_AUTO_WBITS = 47
+
+# Decompressed bytes per step, and longest line accepted (bounds the memory used by
+# a single request, whatever the compression ratio)
+_INFLATE_STEP = 256 * 1024
+MAX_LINE_BYTES = 16 * 1024 * 1024
+
+
+class ArchiveWriter:
+    """
+    Encodes rows as gzip'd NDJSON, a batch at a time
+    """
+
+    def __init__(self, level: int = constants.EXPORT_COMPRESS_LEVEL):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, _GZIP_WBITS)
+
+    def write(self, rows: Iterable[Dict[str, Any]]) -> bytes:
+        return self._compressor.compress(b"".join(orjson.dumps(row) + b"\n" for row in rows))
+
+    def close(self) -> bytes:
+        return self._compressor.flush()
+
+
+def is_compressed(content_type: str, content_encoding: str) -> bool:
+    return content_type.startswith(MEDIA_TYPE) or content_encoding == "gzip"
+
+
+def _inflate(decompressor: Any, chunk: bytes) -> Iterator[bytes]:
+    try:
+        data = decompressor.decompress(chunk, _INFLATE_STEP)
+        while data:
+            yield data
+            data = decompressor.decompress(decompressor.unconsumed_tail, _INFLATE_STEP)
+    except zlib.error as e:
+        raise ValueError(f"Invalid gzip data ({e})")
+
+
+async def read_lines(chunks: AsyncIterable[bytes], compressed: bool) -> AsyncIterator[bytes]:
+    """
+    Lines (blank ones included) of an NDJSON stream, gzip'd if compressed, as they
+    arrive. Raises ValueError on a truncated archive or a line over MAX_LINE_BYTES
+    """
+    decompressor = zlib.decompressobj(_AUTO_WBITS) if compressed else None
+    pending = b""
+    async for chunk in chunks:
+        for data in (_inflate(decompressor, chunk) if decompressor is not None else (chunk,)):
+            lines = (pending + data).split(b"\n")
+            pending = lines.pop()
+            if len(pending) > MAX_LINE_BYTES:
+                raise ValueError(f"Line longer than {MAX_LINE_BYTES} bytes")
+            for line in lines:
+                yield line
+    if decompressor is not None and not decompressor.eof:
+        raise ValueError("Truncated archive")
+    if pending:
+        yield pending
@@ -0,0 +1,159 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Set, Tuple
+from models.turnilo_dashboard_change import TurniloDashboardChange
+from services import metrics
+
+import constants
+
+# Dashboard read cache
+
+
+class DashboardCache:
+    """
+    Bounded LRU cache with TTL for dashboard reads.
+
+    Every entry records the ids of the dashboards it holds, so that a write to a
+    dashboard invalidates exactly the entries that contain it (plus the list
+    entries whose filter the new values match).
+
+    Keys are ("id", id) and ("list", dataCube, shortName).
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[Hashable, Tuple[float, Any, Tuple[int, ...]]] = OrderedDict()
+        self._by_id: Dict[int, Set[Hashable]] = {}
+        # Bumped on every invalidation. Readers that started before it cannot populate
+        # the cache, as their DB read might predate the write
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any, ids: Iterable[int], generation: int) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            if generation != self._generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            entry_ids = tuple(ids)
+            self._entries[key] = (time.monotonic() + self.ttl, value, entry_ids)
+            for _id in entry_ids:
+                self._by_id.setdefault(_id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate_dashboard(self, _id: Optional[int], dataCube: Optional[str], shortName: Optional[str]) -> None:
+        """
+        Drops every entry affected by a write to dashboard _id, whose (new) values are
+        dataCube and shortName
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._generation += 1
+            keys: Set[Hashable] = {
+                ("list", None, None),
+                ("list", dataCube, None),
+                ("list", None, shortName),
+                ("list", dataCube, shortName),
+            }
+            if _id is not None:
+                keys.add(("id", _id))
+                keys |= self._by_id.get(_id, set())
+            for key in keys:
+                if key in self._entries:
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._by_id.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "maxEntries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+    def _remove(self, key: Hashable) -> None:
+        _, _, ids = self._entries.pop(key)
+        for _id in ids:
+            keys = self._by_id.get(_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_id[_id]
+
+
+def invalidation_handler(cache: DashboardCache,
+                         replica_id: Optional[Callable[[], str]]) -> Callable[[TurniloDashboardChange], None]:
+    """
+    Change feed handler that applies the writes of other replicas to cache. replica_id
+    returns the id of this replica (it changes in forked workers). None applies the
+    writes of this replica too: when reads (that fill the cache) come from a lagging
+    replica, a read right after the synchronous invalidation of a local write can cache
+    the old version again
+    """
+    def handler(change: TurniloDashboardChange) -> None:
+        # Writes of this replica already invalidated the cache synchronously
+        if replica_id is None or change.origin != replica_id():
+            cache.invalidate_dashboard(change.dashboardId, change.dataCube, change.shortName)
+    return handler
+
+
+dashboard_cache = DashboardCache(constants.CACHE_MAX_ENTRIES, constants.CACHE_TTL_SECONDS)
+
+
+def _cache_metrics():
+    stats = dashboard_cache.stats()
+    for key in ("hits", "misses", "evictions", "expirations", "invalidations"):
+        yield "counter", f"dashboard_cache_{key}_total", f"Dashboard read cache {key}", \
+            [(f"dashboard_cache_{key}_total", {}, stats[key])]
+    yield "gauge", "dashboard_cache_entries", "Dashboard read cache entries", \
+        [("dashboard_cache_entries", {}, stats["entries"])]
+
+
+metrics.registry.register_collector(_cache_metrics)
@@ -0,0 +1,310 @@
+import json
+import logging
+import os
+import select
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import Engine, delete, event, func, insert, text
+from sqlalchemy.orm import Session as OrmSession
+from sqlmodel import Session, select as sql_select
+from models.turnilo_dashboard import TurniloDashboard
+from models.turnilo_dashboard_change import TurniloDashboardChange
+
+import constants
+
+# Dashboard change feed
+#
+# Every write to turniloDashboards appends a TurniloDashboardChange row in the same
+# transaction. Each replica runs a ChangeFeedListener that reads the new rows and
+# hands them to the subscribed handlers (e.g. to invalidate local caches).
+#
+# On Postgres, writes also NOTIFY the channel below so that listeners wake up
+# immediately; on SQLite, listeners poll the change log every POLL_INTERVAL, and the
+# listener of this process is also woken up by the local commits that published changes.
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "turnilo_dashboards"
+
+OP_CREATE = "create"
+OP_UPDATE = "update"
+OP_DELETE = "delete"
+
+# Identifies the writes of this process (replica). Forked workers get their own
+_replica_id = uuid.uuid4().hex
+
+ChangeHandler = Callable[[TurniloDashboardChange], None]
+Change = Tuple[str, int, str, str]
+
+_handlers: List[ChangeHandler] = []
+
+# Session.info key: the transaction published changes
+_PUBLISHED = "change_feed_published"
+
+
+def subscribe(handler: ChangeHandler) -> None:
+    """
+    Registers a handler for the changes read by this process' listener
+    """
+    _handlers.append(handler)
+
+
+def replica_id() -> str:
+    return _replica_id
+
+
+def _new_replica_id() -> None:
+    global _replica_id
+    _replica_id = uuid.uuid4().hex
+
+
+os.register_at_fork(after_in_child=_new_replica_id)
+
+
+def publish(session: Session, op: str, dashboard: TurniloDashboard, origin: Optional[str] = None) -> None:
+    """
+    Records a change of dashboard in session's transaction. It becomes visible
+    (and on Postgres, is notified) when the transaction commits
+    """
+    assert dashboard.id is not None
+    origin = origin or _replica_id
+    session.add(TurniloDashboardChange(dashboardId=dashboard.id, op=op, dataCube=dashboard.dataCube,
+                                       shortName=dashboard.shortName, origin=origin))
+    session.info[_PUBLISHED] = True
+    _notify(session, {"id": dashboard.id, "op": op, "origin": origin})
+
+
+def publish_many(session: Session, changes: Iterable[Change], origin: Optional[str] = None) -> None:
+    """
+    Same as publish(), for a batch of (op, id, dataCube, shortName) changes. Uses a
+    single executemany INSERT and a single NOTIFY
+    """
+    origin = origin or _replica_id
+    rows = [{"dashboardId": _id, "op": op, "dataCube": dataCube, "shortName": shortName, "origin": origin}
+            for op, _id, dataCube, shortName in changes]
+    if not rows:
+        return
+    session.execute(insert(TurniloDashboardChange), rows)
+    session.info[_PUBLISHED] = True
+    _notify(session, {"ids": [row["dashboardId"] for row in rows], "op": "bulk", "origin": origin})
+
+
+def _notify(session: Session, payload: dict) -> None:
+    if session.get_bind().dialect.name != "postgresql":
+        return
+    data = json.dumps(payload)
+    if len(data) > 7999:
+        # NOTIFY payloads are limited to 8000 bytes; listeners re-read the change log anyway
+        data = json.dumps({"op": payload["op"], "origin": payload["origin"]})
+    session.execute(text("SELECT pg_notify(:channel, :payload)"), params={"channel": CHANNEL, "payload": data})
+
+
+def last_seq(session: Session) -> int:
+    """
+    Sequence number of the last change; it works as a table version
+    """
+    return session.exec(sql_select(func.max(TurniloDashboardChange.seq))).one() or 0
+
+
+def seq_range(session: Session) -> Tuple[int, int]:
+    """
+    Sequence numbers of the first (oldest retained) and last changes, (0, 0) if none
+    """
+    first, last = session.exec(sql_select(func.min(TurniloDashboardChange.seq),
+                                          func.max(TurniloDashboardChange.seq))).one()
+    return first or 0, last or 0
+
+
+def changes_after(session: Session, after: int, data_cube: Optional[str] = None,
+                  limit: Optional[int] = None) -> List[TurniloDashboardChange]:
+    """
+    The changes with a seq greater than after, oldest first
+    """
+    statement = sql_select(TurniloDashboardChange).where(
+        TurniloDashboardChange.seq > after).order_by(TurniloDashboardChange.seq)  # type: ignore
+    if data_cube is not None:
+        statement = statement.where(TurniloDashboardChange.dataCube == data_cube)
+    if limit is not None:
+        statement = statement.limit(limit)
+    return list(session.exec(statement).all())
+
+
+@event.listens_for(OrmSession, "after_commit")
+def _after_commit(session: OrmSession) -> None:
+    # Also the sessions of the async mode (the sync session of an AsyncSession)
+    if session.info.pop(_PUBLISHED, False):
+        wake()
+
+
+@event.listens_for(OrmSession, "after_rollback")
+def _after_rollback(session: OrmSession) -> None:
+    session.info.pop(_PUBLISHED, None)
+
+
+class ChangeFeedListener:
+    """
+    Reads the change log and applies new changes to handlers, in a background thread.
+
+    Sequence numbers are allocated at insert time, so on Postgres a transaction can
+    commit a lower seq after a higher one is already visible. Holes are remembered
+    and re-queried for constants.CHANGE_FEED_GAP_TIMEOUT seconds (a rolled back
+    transaction leaves a permanent hole).
+
+    With a read replica, the change log is read from read_engine: a change is handed
+    to the handlers once the replica has it, so that caches filled from the replica
+    are not invalidated before the replica has the new rows. engine (the primary)
+    is the one listened to and pruned.
+    """
+
+    def __init__(self, engine: Engine, handlers: Optional[List[ChangeHandler]] = None,
+                 poll_interval: float = constants.CHANGE_FEED_POLL_INTERVAL, read_engine: Optional[Engine] = None):
+        self.engine = engine
+        self.read_engine = read_engine if read_engine is not None else engine
+        self.handlers = handlers if handlers is not None else _handlers
+        self.poll_interval = poll_interval
+        self.last_seq: Optional[int] = None
+        self._gaps: Dict[int, float] = {}
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_prune = time.monotonic()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        if self.last_seq is None:
+            with Session(self.read_engine) as session:
+                self.last_seq = last_seq(session)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="change-feed-listener", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def wake(self) -> None:
+        """
+        Polls now instead of at the end of the poll interval (there is nothing to wait
+        for on Postgres, where the listener blocks on notifications)
+        """
+        self._wake.set()
+
+    def poll_once(self) -> int:
+        """
+        Applies the changes committed since the last call. Returns the number of changes applied
+        """
+        if self.last_seq is None:
+            self.last_seq = 0
+        now = time.monotonic()
+        self._gaps = {seq: t for seq, t in self._gaps.items() if now - t < constants.CHANGE_FEED_GAP_TIMEOUT}
+        with Session(self.read_engine) as session:
+            condition = TurniloDashboardChange.seq > self.last_seq  # type: ignore
+            if self._gaps:
+                condition = condition | TurniloDashboardChange.seq.in_(list(self._gaps))  # type: ignore
+            statement = sql_select(TurniloDashboardChange).where(condition).order_by(
+                TurniloDashboardChange.seq)  # type: ignore
+            changes = list(session.exec(statement).all())
+        for change in changes:
+            assert change.seq is not None
+            if change.seq > self.last_seq:
+                for missing in range(self.last_seq + 1, change.seq):
+                    self._gaps[missing] = now
+                self.last_seq = change.seq
+            else:
+                self._gaps.pop(change.seq, None)
+            for handler in self.handlers:
+                handler(change)
+        return len(changes)
+
+    def prune(self) -> None:
+        """
+        Drops old changes, keeping the last constants.CHANGE_FEED_RETENTION ones
+        """
+        with Session(self.engine) as session:
+            newest = last_seq(session)
+            session.exec(delete(TurniloDashboardChange).where(
+                TurniloDashboardChange.seq <= newest - constants.CHANGE_FEED_RETENTION))  # type: ignore
+            session.commit()
+
+    def _tick(self) -> None:
+        self.poll_once()
+        if time.monotonic() - self._last_prune > constants.CHANGE_FEED_PRUNE_INTERVAL:
+            self._last_prune = time.monotonic()
+            self.prune()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                if self.engine.dialect.name == "postgresql":
+                    self._listen()
+                else:
+                    self._tick()
+                    self._wake.wait(self.poll_interval)
+                    self._wake.clear()
+            except Exception as e:
+                logger.warning("Change feed listener error: %s", e)
+                self._stop.wait(self.poll_interval)
+
+    def _listen(self) -> None:
+        # Blocks on the LISTEN connection and catches up from the change log on every
+        # wake up. The timeout keeps polling in case a notification is lost
+        conn = self.engine.raw_connection()
+        try:
+            dbapi_conn = conn.driver_connection
+            dbapi_conn.autocommit = True  # type: ignore
+            with dbapi_conn.cursor() as cursor:  # type: ignore
+                cursor.execute("LISTEN " + CHANNEL)
+            self._tick()
+            while not self._stop.is_set():
+                select.select([dbapi_conn], [], [], self.poll_interval)  # type: ignore
+                dbapi_conn.poll()  # type: ignore
+                dbapi_conn.notifies.clear()  # type: ignore
+                self._tick()
+        finally:
+            conn.invalidate()
+
+
+listener: Optional[ChangeFeedListener] = None
+# With several shards (data.shards), a listener per shard. listener is the one of shard 0
+listeners: List[ChangeFeedListener] = []
+
+
+def start_listener(engine: Engine, read_engine: Optional[Engine] = None) -> ChangeFeedListener:
+    global listener
+    if listener is None:
+        listener = ChangeFeedListener(engine, read_engine=read_engine)
+        listeners.insert(0, listener)
+    listener.start()
+    return listener
+
+
+def start_listeners(engines: List[Engine], read_engines: List[Engine]) -> List[ChangeFeedListener]:
+    """
+    Starts the listeners of the shards, whose engines are engines (and read_engines,
+    their replicas), by shard
+    """
+    start_listener(engines[0], read_engines[0])
+    for engine, read_engine in list(zip(engines, read_engines))[len(listeners):]:
+        listeners.append(ChangeFeedListener(engine, read_engine=read_engine))
+    for shard_listener in listeners:
+        shard_listener.start()
+    return listeners
+
+
+def stop_listener() -> None:
+    for shard_listener in listeners:
+        shard_listener.stop()
+
+
+def wake() -> None:
+    """
+    Wakes up the listeners of this process, if started: a local commit published changes
+    """
+    for shard_listener in listeners:
+        shard_listener.wake()
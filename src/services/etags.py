@@ -0,0 +1,41 @@
+import hashlib
+from typing import List, Optional
+
+# HTTP entity tags (RFC 9110, section 8.8.3)
+
+ANY = "*"
+
+
+def make_etag(*parts: object) -> str:
+    """
+    Strong ETag derived from parts
+    """
+    digest = hashlib.sha256("\x1f".join(str(p) for p in parts).encode()).hexdigest()
+    return '"' + digest[:32] + '"'
+
+
+def parse_etags(header: Optional[str]) -> Optional[List[str]]:
+    """
+    Parses an If-Match/If-None-Match header value. Returns None if the header is not present
+    """
+    if header is None:
+        return None
+    return [tag.strip() for tag in header.split(",") if tag.strip()]
+
+
+def weak_match(etag: str, etags: Optional[List[str]]) -> bool:
+    """
+    If-None-Match comparison: W/ prefixes are ignored
+    """
+    if etags is None:
+        return False
+    return any(tag == ANY or tag.removeprefix("W/") == etag for tag in etags)
+
+
+def strong_match(etag: str, etags: Optional[List[str]]) -> bool:
+    """
+    If-Match comparison: weak tags never match
+    """
+    if etags is None:
+        return True
+    return any(tag == ANY or tag == etag for tag in etags)
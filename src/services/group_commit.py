@@ -0,0 +1,152 @@
+import concurrent.futures
+import functools
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from sqlalchemy import Engine
+from sqlmodel import Session
+from services import metrics
+
+import constants
+import data.engine_config as engine_config
+
+logger = logging.getLogger(__name__)
+
+# Group commit
+#
+# Writes are queued and run by a single writer thread, a batch per transaction: one
+# commit (and fsync, and write lock) for many writes. Each write runs in a savepoint,
+# so a failing one (404, 412, duplicated dataCube+shortName...) is rolled back alone
+# and only its caller gets the error.
+
+Write = Callable[..., Any]
+_Request = Tuple[Write, Tuple[Any, ...], "concurrent.futures.Future[Any]"]
+
+
+class GroupCommitter:
+    """
+    Writer thread, started on first use (so forked workers start their own)
+    """
+
+    def __init__(self, engine_factory: Callable[[], Engine] = engine_config.make_writer_engine,
+                 max_batch: int = constants.GROUP_COMMIT_MAX_BATCH,
+                 max_delay: float = constants.GROUP_COMMIT_MAX_DELAY):
+        self.engine_factory = engine_factory
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.engine: Optional[Engine] = None
+        # None stops the writer
+        self._queue: "queue.Queue[Optional[_Request]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def submit(self, write: Write, *args: Any) -> "concurrent.futures.Future[Any]":
+        """
+        Runs write(session, *args) in the next batch. The future gets its result once
+        the batch is committed, or its exception
+        """
+        if self._thread is None:
+            self._start()
+        future: "concurrent.futures.Future[Any]" = concurrent.futures.Future()
+        self._queue.put((write, args, future))
+        return future
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+            if self.engine is None:
+                self.engine = self.engine_factory()
+                metrics.instrument_engine(self.engine)
+            self._thread = threading.Thread(target=self._run, name="group-commit-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Commits the queued writes and stops the writer
+        """
+        with self._lock:
+            if self._thread is None:
+                return
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+            if self.engine is not None:
+                self.engine.dispose()
+                self.engine = None
+
+    def _next_batch(self) -> Tuple[List[_Request], bool]:
+        # Blocks for the first write, then takes the ones queued meanwhile, waiting up
+        # to max_delay for more. Returns the batch and whether to stop after it
+        first = self._queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                request = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                return batch, True
+            batch.append(request)
+        return batch, False
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            batch, stopping = self._next_batch()
+            if batch:
+                self._commit(batch)
+
+    def _commit(self, batch: List[_Request]) -> None:
+        assert self.engine is not None
+        done: List[Tuple["concurrent.futures.Future[Any]", Any]] = []
+        try:
+            with Session(self.engine, expire_on_commit=False) as session:
+                for write, args, future in batch:
+                    # Callers that went away (cancelled) are skipped
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    try:
+                        with session.begin_nested():
+                            done.append((future, write(session, *args)))
+                    except Exception as e:
+                        future.set_exception(e)
+                session.commit()
+        except Exception as e:
+            logger.warning("Group commit of %d writes failed: %s", len(done), e)
+            for future, _ in done:
+                future.set_exception(e)
+            return
+        metrics.group_commit_batch_size.observe(len(done))
+        for future, result in done:
+            future.set_result(result)
+
+
+writer: Optional[GroupCommitter] = None
+# With several shards (data.shards), a writer per shard: the ones of the shards but 0
+_shard_writers: Dict[int, GroupCommitter] = {}
+_writers_lock = threading.Lock()
+
+
+def submit(write: Write, *args: Any, shard: int = 0) -> "concurrent.futures.Future[Any]":
+    global writer
+    if shard:
+        with _writers_lock:
+            if shard not in _shard_writers:
+                _shard_writers[shard] = GroupCommitter(functools.partial(engine_config.make_writer_engine, shard))
+        return _shard_writers[shard].submit(write, *args)
+    if writer is None:
+        writer = GroupCommitter()
+    return writer.submit(write, *args)
+
+
+def stop() -> None:
+    for shard_writer in [writer] + list(_shard_writers.values()):
+        if shard_writer is not None:
+            shard_writer.stop()
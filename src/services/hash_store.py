@@ -0,0 +1,204 @@
+import hashlib
+import threading
+import zlib
+from collections import Counter, OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+from fastapi import HTTPException
+from sqlalchemy import delete, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlmodel import Session, select
+from models.turnilo_dashboard import TurniloDashboard
+from models.turnilo_dashboard_hash import TurniloDashboardHash as Hash
+
+import constants
+
+# Content-addressed store of the dashboard hash values
+#
+# The hash of a dashboard (its Turnilo view state) is a long blob, and many dashboards
+# share the same one. Each distinct value is stored once in turniloDashboardHashes,
+# compressed, keyed by its SHA-256 digest; dashboard rows only keep the digest
+# (hashDigest) and an empty hash column. Values are reference counted by the writes,
+# in their transaction, and deleted when no dashboard references them.
+#
+# Values never change for a given digest, so the ones read are cached by digest with no
+# invalidation. Rows without a digest (written before the store existed, or by an older
+# version of the app) keep their hash inline and are served as is.
+
+# Rows per IN (...) statement
+_CHUNK_SIZE = 500
+
+
+def digest(value: str) -> str:
+    return hashlib.sha256(value.encode()).hexdigest()
+
+
+class ValueCache:
+    """
+    LRU cache of the values by digest, bounded by their total size (in characters)
+    """
+
+    def __init__(self, max_size: int = constants.HASH_CACHE_MAX_SIZE):
+        self.max_size = max_size
+        self.size = 0
+        self._values: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._values.get(key)
+            if value is not None:
+                self._values.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: str) -> None:
+        if len(value) > self.max_size:
+            return
+        with self._lock:
+            if key in self._values:
+                return
+            self._values[key] = value
+            self.size += len(value)
+            while self.size > self.max_size:
+                _, evicted = self._values.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+            self.size = 0
+
+
+value_cache = ValueCache()
+
+
+def _chunks(seq: Sequence[Any]) -> Iterable[Sequence[Any]]:
+    for i in range(0, len(seq), _CHUNK_SIZE):
+        yield seq[i:i + _CHUNK_SIZE]
+
+
+def _acquire(session: Session, values: Dict[str, str], refs: Dict[str, int]) -> None:
+    # Inserts the values that are not stored yet and adds refs to all of them, in a
+    # single statement: concurrent writers of a new value don't conflict. Rows are
+    # locked in digest order (by release() too), so that writers can't deadlock
+    rows = []
+    for key in sorted(values):
+        data = values[key].encode()
+        rows.append({"digest": key, "data": zlib.compress(data, constants.HASH_COMPRESS_LEVEL), "size": len(data),
+                     "refs": refs[key]})
+    insert = postgresql.insert if session.get_bind().dialect.name == "postgresql" else sqlite.insert
+    for chunk in _chunks(rows):
+        statement = insert(Hash)
+        session.execute(statement.on_conflict_do_update(  # type: ignore
+            index_elements=["digest"], set_={"refs": Hash.refs + statement.excluded.refs}), chunk)
+
+
+def release(session: Session, digests: Iterable[Optional[str]]) -> None:
+    """
+    Drops a reference on each of digests (None: an inline hash, nothing to release),
+    and deletes the values no longer referenced, in session's transaction
+    """
+    refs = Counter(d for d in digests if d is not None)
+    by_count: Dict[int, List[str]] = {}
+    for key, count in sorted(refs.items()):
+        by_count.setdefault(count, []).append(key)
+    returning = session.get_bind().dialect.update_returning
+    unreferenced: List[str] = []
+    for count, keys in by_count.items():
+        for chunk in _chunks(keys):
+            statement = update(Hash).where(Hash.digest.in_(chunk)).values(  # type: ignore
+                refs=Hash.refs - count).execution_options(synchronize_session=False)
+            if returning:
+                result = session.execute(statement.returning(Hash.digest, Hash.refs))  # type: ignore
+                unreferenced += [key for key, left in result if left <= 0]
+            else:
+                session.execute(statement)
+                unreferenced += chunk
+    for chunk in _chunks(sorted(unreferenced)):
+        session.execute(delete(Hash).where(Hash.digest.in_(chunk), Hash.refs <= 0).execution_options(  # type: ignore
+            synchronize_session=False))
+
+
+def store(session: Session, values: Sequence[str],
+          previous: Optional[Sequence[Optional[str]]] = None) -> List[str]:
+    """
+    Stores values, that replace the values of digests previous (None for none), in
+    session's transaction: takes a reference on each of values and drops one on each of
+    previous, except where they are the same. Returns the digests of values
+    """
+    digests = [digest(value) for value in values]
+    previous = previous if previous is not None else [None] * len(values)
+    changed = [i for i, (new, old) in enumerate(zip(digests, previous)) if new != old]
+    if changed:
+        _acquire(session, {digests[i]: values[i] for i in changed}, Counter(digests[i] for i in changed))
+        release(session, [previous[i] for i in changed])
+    # Read back right after their write, usually
+    for key, value in zip(digests, values):
+        value_cache.put(key, value)
+    return digests
+
+
+def load(session: Session, digests: Iterable[str]) -> Dict[str, str]:
+    """
+    The values of digests, from the cache or in one query per chunk
+    """
+    values: Dict[str, str] = {}
+    missing = []
+    for key in set(digests):
+        value = value_cache.get(key)
+        if value is None:
+            missing.append(key)
+        else:
+            values[key] = value
+    for chunk in _chunks(missing):
+        statement = select(Hash.digest, Hash.data).where(Hash.digest.in_(chunk))  # type: ignore
+        for key, data in session.exec(statement).all():  # type: ignore
+            values[key] = decode(key, data)
+    if any(key not in values for key in missing):
+        raise HTTPException(status_code=500, detail="Corrupted state. Hash value not found")
+    return values
+
+
+def get(session: Session, key: str) -> Optional[str]:
+    """
+    The value of digest key, None if it's not stored
+    """
+    value = value_cache.get(key)
+    if value is not None:
+        return value
+    data = session.exec(select(Hash.data).where(Hash.digest == key)).first()
+    return decode(key, data) if data is not None else None
+
+
+def decode(key: str, data: bytes) -> str:
+    """
+    Value of a stored (compressed) row, also cached
+    """
+    value = value_cache.get(key)
+    if value is None:
+        value = zlib.decompress(data).decode()
+        value_cache.put(key, value)
+    return value
+
+
+def resolve(session: Session, dashboards: Sequence[TurniloDashboard]) -> None:
+    """
+    Sets the hash of dashboards read from the table. ORM instances are not marked as
+    modified: the empty hash column is not written back
+    """
+    values = load(session, [d.hashDigest for d in dashboards if d.hashDigest is not None])
+    for dashboard in dashboards:
+        if dashboard.hashDigest is not None:
+            set_committed_value(dashboard, "hash", values[dashboard.hashDigest])
+
+
+def resolve_rows(session: Session, rows: List[Dict[str, Any]], keep_digest: bool = False) -> None:
+    """
+    Same as resolve(), for the rows (dicts with hash and hashDigest) of a list query. The
+    digests are dropped from the rows, unless keep_digest
+    """
+    values = load(session, [row["hashDigest"] for row in rows if row["hashDigest"] is not None])
+    for row in rows:
+        key = row["hashDigest"] if keep_digest else row.pop("hashDigest")
+        if key is not None:
+            row["hash"] = values[key]
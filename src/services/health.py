@@ -0,0 +1,70 @@
+import asyncio
+from typing import Any, Dict, Union
+from sqlalchemy import Engine, QueuePool, text
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.concurrency import run_in_threadpool
+
+import constants
+import data.database as db
+
+# Liveness and readiness
+#
+# A process is live when it answers at all. It is ready (to get traffic) when it has
+# started and is not shutting down, and every DB engine answers a ping and has a
+# connection to spare in its pool
+
+_serving = False
+
+
+def set_serving(serving: bool) -> None:
+    global _serving
+    _serving = serving
+
+
+def pool_status(engine: Union[Engine, AsyncEngine]) -> Dict[str, Any]:
+    pool = engine.pool
+    if not isinstance(pool, QueuePool):
+        return {"status": pool.status()}
+    return {
+        "size": pool.size(),
+        "checkedOut": pool.checkedout(),
+        "overflow": pool.overflow(),
+        # Every engine is created with the same pool options
+        "exhausted": pool.checkedout() >= pool.size() + constants.DB_POOL_MAX_OVERFLOW,
+    }
+
+
+def _ping(engine: Engine) -> None:
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+
+async def _ping_async(engine: AsyncEngine) -> None:
+    async with engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+
+
+async def check_engine(engine: Union[Engine, AsyncEngine]) -> Dict[str, Any]:
+    """
+    Pool status of engine, and whether it is usable (ok), with the error otherwise
+    """
+    status = pool_status(engine)
+    if status.get("exhausted"):
+        # A ping would wait for a connection: the pool can't serve more requests anyway
+        return {"ok": False, "error": "Connection pool exhausted", "pool": status}
+    ping = _ping_async(engine) if isinstance(engine, AsyncEngine) else run_in_threadpool(_ping, engine)
+    try:
+        await asyncio.wait_for(ping, constants.HEALTH_CHECK_TIMEOUT)
+    except Exception as e:
+        return {"ok": False, "error": str(e) or type(e).__name__, "pool": status}
+    return {"ok": True, "pool": status}
+
+
+async def readiness() -> Dict[str, Any]:
+    engines = db.engines()
+    checks = await asyncio.gather(*(check_engine(engine) for engine in engines.values()))
+    return {
+        "ready": _serving and all(check["ok"] for check in checks),
+        "serving": _serving,
+        "engines": dict(zip(engines, checks)),
+    }
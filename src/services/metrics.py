@@ -0,0 +1,242 @@
+import contextvars
+import math
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from sqlalchemy import Engine, event
+
+# Metrics registry, rendered in the Prometheus text exposition format (0.0.4)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelValues = Tuple[str, ...]
+Sample = Tuple[str, Dict[str, str], float]
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _labels(self, values: LabelValues) -> Dict[str, str]:
+        return dict(zip(self.labelnames, values))
+
+    def samples(self) -> Iterable[Sample]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, labels: LabelValues = (), amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels: LabelValues = ()) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self) -> Iterable[Sample]:
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield self.name, self._labels(labels), value
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value: float, labels: LabelValues = ()) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def dec(self, labels: LabelValues = (), amount: float = 1) -> None:
+        self.inc(labels, -amount)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # labels -> (bucket counts (non cumulative), sum, count)
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, labels: LabelValues = ()) -> None:
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = ([0] * len(self.buckets), [0.0, 0.0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1][0] += value
+            entry[1][1] += 1
+
+    def count(self, labels: LabelValues = ()) -> int:
+        entry = self._values.get(labels)
+        return int(entry[1][1]) if entry else 0
+
+    def samples(self) -> Iterable[Sample]:
+        with self._lock:
+            items = [(labels, list(counts), list(totals)) for labels, (counts, totals) in self._values.items()]
+        for labels, counts, (total, count) in items:
+            base = self._labels(labels)
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                yield self.name + "_bucket", dict(base, le=_format_value(bound)), cumulative
+            yield self.name + "_sum", base, total
+            yield self.name + "_count", base, count
+
+
+# A collector returns (metric type, name, documentation, samples) at scrape time
+Collector = Callable[[], Iterable[Tuple[str, str, str, Iterable[Sample]]]]
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: List[Metric] = []
+        self._collectors: List[Collector] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Collector) -> None:
+        self._collectors.append(collector)
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))  # type: ignore
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))  # type: ignore
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))  # type: ignore
+
+    def render(self) -> str:
+        lines: List[str] = []
+        families = [(m.type, m.name, m.documentation, m.samples()) for m in self._metrics]
+        for collector in self._collectors:
+            families += list(collector())
+        for metric_type, name, documentation, samples in families:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for sample_name, labels, value in samples:
+                lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# HTTP
+http_requests_total = registry.counter(
+    "http_requests_total", "HTTP requests by method, route and status code", ["method", "route", "status"])
+http_request_duration_seconds = registry.histogram(
+    "http_request_duration_seconds", "HTTP request latency by method and route", ["method", "route"])
+http_requests_in_flight = registry.gauge("http_requests_in_flight", "HTTP requests being served")
+http_request_db_queries = registry.histogram(
+    "http_request_db_queries", "DB queries per HTTP request", ["method", "route"], COUNT_BUCKETS)
+http_request_db_duration_seconds = registry.histogram(
+    "http_request_db_duration_seconds", "Time spent in DB queries per HTTP request", ["method", "route"])
+
+# Admission control
+admission_in_flight = registry.gauge(
+    "admission_in_flight", "Admitted HTTP requests being served, by request class", ["class"])
+admission_queue_depth = registry.gauge(
+    "admission_queue_depth", "HTTP requests waiting for admission, by request class", ["class"])
+admission_rejected_total = registry.counter(
+    "admission_rejected_total", "HTTP requests rejected with 503, by request class and reason", ["class", "reason"])
+admission_wait_seconds = registry.histogram(
+    "admission_wait_seconds", "Time waited for admission by admitted requests, by request class", ["class"])
+
+# Group commit
+group_commit_batch_size = registry.histogram(
+    "group_commit_batch_size", "Writes committed per group commit transaction", [], COUNT_BUCKETS)
+
+# Watchers
+watchers = registry.gauge("watchers", "Watch requests (event streams and long polls) being served", ["mode"])
+
+# DB
+db_queries_total = registry.counter("db_queries_total", "DB queries by statement type", ["statement"])
+db_query_duration_seconds = registry.histogram(
+    "db_query_duration_seconds", "DB query latency by statement type", ["statement"])
+
+
+# DB query accounting of the current request (None outside of requests)
+class RequestDbStats:
+    __slots__ = ("queries", "seconds")
+
+    def __init__(self) -> None:
+        self.queries = 0
+        self.seconds = 0.0
+
+
+request_db_stats: contextvars.ContextVar[Optional[RequestDbStats]] = contextvars.ContextVar(
+    "request_db_stats", default=None)
+
+
+def _statement_type(statement: str) -> str:
+    return statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+
+
+def instrument_engine(engine: Engine) -> None:
+    """
+    Counts and times every query executed by engine (for async engines, pass .sync_engine)
+    """
+    if getattr(engine, "_metrics_instrumented", False):
+        return
+    engine._metrics_instrumented = True  # type: ignore
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+        conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+        elapsed = time.perf_counter() - conn.info["metrics_query_start"].pop()
+        statement_type = (_statement_type(statement),)
+        db_queries_total.inc(statement_type)
+        db_query_duration_seconds.observe(elapsed, statement_type)
+        stats = request_db_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.seconds += elapsed
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context) -> None:
+        if context.connection is not None:
+            starts = context.connection.info.get("metrics_query_start")
+            if starts:
+                starts.pop()
@@ -0,0 +1,129 @@
+import asyncio
+import gzip
+import threading
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Tuple, TypeVar
+
+import constants
+
+try:
+    import brotli  # type: ignore
+except ImportError:  # Optional: only gzip is offered without it
+    brotli = None
+
+# Encoded response payloads
+#
+# A Payload is the JSON body of a response plus its compressed variants, each one
+# computed once (on first use) and then served as is by every request.
+
+T = TypeVar("T")
+
+ENCODING_GZIP = "gzip"
+ENCODING_BROTLI = "br"
+
+_COMPRESSORS: Dict[str, Callable[[bytes], bytes]] = {
+    ENCODING_GZIP: lambda body: gzip.compress(body, compresslevel=constants.PAYLOAD_GZIP_LEVEL),
+}
+if brotli is not None:
+    _COMPRESSORS[ENCODING_BROTLI] = lambda body: brotli.compress(body, quality=constants.PAYLOAD_BROTLI_QUALITY)
+
+# Preferred first, on equal q-values
+ENCODINGS = [e for e in (ENCODING_BROTLI, ENCODING_GZIP) if e in _COMPRESSORS]
+
+
+class Payload:
+    """
+    JSON body of a response, built from the data at version, and its compressed variants
+    """
+
+    def __init__(self, version: int, body: bytes):
+        self.version = version
+        self.body = body
+        self._lock = threading.Lock()
+        self._encoded: Dict[str, bytes] = {}
+
+    def get(self, encoding: Optional[str]) -> Optional[bytes]:
+        """
+        Body in encoding, if already computed
+        """
+        return self.body if encoding is None else self._encoded.get(encoding)
+
+    def encode(self, encoding: Optional[str]) -> bytes:
+        """
+        Body in encoding. Compresses it on first use: CPU bound, call it from a thread
+        """
+        if encoding is None:
+            return self.body
+        with self._lock:
+            encoded = self._encoded.get(encoding)
+            if encoded is None:
+                encoded = self._encoded[encoding] = _COMPRESSORS[encoding](self.body)
+            return encoded
+
+
+def negotiate(accept_encoding: Optional[str], size: int) -> Optional[str]:
+    """
+    Content coding for an Accept-Encoding header value, None for identity. Bodies
+    smaller than constants.PAYLOAD_MIN_COMPRESS_SIZE are not worth compressing
+    """
+    if not accept_encoding or size < constants.PAYLOAD_MIN_COMPRESS_SIZE:
+        return None
+    q_values: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                continue
+        q_values[coding.strip().lower()] = q
+    candidates: List[Tuple[float, int, str]] = []
+    for rank, encoding in enumerate(ENCODINGS):
+        q = q_values.get(encoding, q_values.get("*", 0.0))
+        if q > 0:
+            candidates.append((-q, rank, encoding))
+    return min(candidates)[2] if candidates else None
+
+
+class _Abandoned(Exception):
+    """
+    The caller running a SingleFlight call was cancelled
+    """
+
+
+class SingleFlight:
+    """
+    Runs a single call per key at a time: concurrent callers of the same key wait for
+    (and share) the result of the call in flight, instead of repeating it. If the
+    caller running it is cancelled (e.g. its client went away), one of the waiters
+    runs it again: fn may depend on its caller (e.g. its DB session)
+    """
+
+    def __init__(self) -> None:
+        self._calls: Dict[Hashable, "asyncio.Future"] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        while True:
+            call = self._calls.get(key)
+            if call is None:
+                break
+            try:
+                return await asyncio.shield(call)
+            except _Abandoned:
+                continue
+        call = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn()
+            call.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            call.set_exception(_Abandoned())
+            call.exception()  # Retrieved: no warning if nobody was waiting
+            raise
+        except BaseException as e:
+            call.set_exception(e)
+            call.exception()  # Retrieved: no warning if nobody was waiting
+            raise
+        finally:
+            del self._calls[key]
@@ -0,0 +1,136 @@
+import datetime
+import zlib
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+import orjson
+from fastapi import HTTPException
+from pydantic import BaseModel, Field
+from sqlalchemy import delete, func, insert
+from sqlmodel import Session, select
+from models.turnilo_dashboard import TurniloDashboard
+from models.turnilo_dashboard_revision import TurniloDashboardRevision as Revision
+
+import constants
+
+# Dashboard revisions
+#
+# Every write of a dashboard records its new version, in the same transaction. To keep
+# them small when only part of a dashboard changes (e.g. its hash), versions are stored
+# as zlib deltas: the previous version is the compression dictionary of the next one.
+# Every REVISION_SNAPSHOT_INTERVAL revisions, a version is stored whole (a snapshot), so
+# that rebuilding any of them takes at most that many decompressions.
+#
+# The previous version is the row being overwritten. If it doesn't match the last
+# revision (it was written before revisions existed, or behind the app's back), it is
+# recorded as a snapshot first.
+
+# Rows per IN (...) statement
+_CHUNK_SIZE = 500
+
+
+class RevisionInfo(BaseModel):
+    revision: int
+    createdAt: datetime.datetime
+    snapshot: bool = Field(description="Stored whole, rather than as a delta")
+    size: int = Field(description="Stored (compressed) size, in bytes")
+
+
+def content(dashboard: TurniloDashboard) -> bytes:
+    """
+    Versioned content of dashboard: its JSON, without the id
+    """
+    return orjson.dumps(dashboard.model_dump(exclude={"id"}), option=orjson.OPT_SORT_KEYS)
+
+
+def _compress(data: bytes, base: Optional[bytes]) -> bytes:
+    # Only the last 32 KB of the dictionary are used: larger dashboards get less of a gain
+    compressor = zlib.compressobj(constants.REVISION_COMPRESS_LEVEL, zdict=base) if base is not None \
+        else zlib.compressobj(constants.REVISION_COMPRESS_LEVEL)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _decompress(data: bytes, base: Optional[bytes]) -> bytes:
+    decompressor = zlib.decompressobj(zdict=base) if base is not None else zlib.decompressobj()
+    return decompressor.decompress(data) + decompressor.flush()
+
+
+def _latest(session: Session, ids: Sequence[int]) -> Dict[int, Tuple[int, int, int]]:
+    """
+    (revision, snapshotRevision, checksum) of the last revision of each of ids that has any
+    """
+    latest: Dict[int, Tuple[int, int, int]] = {}
+    for i in range(0, len(ids), _CHUNK_SIZE):
+        last = select(Revision.dashboardId, func.max(Revision.revision).label("revision")).where(
+            Revision.dashboardId.in_(ids[i:i + _CHUNK_SIZE])).group_by(Revision.dashboardId).subquery()  # type: ignore
+        statement = select(Revision.dashboardId, Revision.revision, Revision.snapshotRevision,
+                           Revision.checksum).join(last, (Revision.dashboardId == last.c.dashboardId)
+                                                   & (Revision.revision == last.c.revision))
+        for dashboard_id, revision, snapshot_revision, checksum in session.exec(statement).all():  # type: ignore
+            latest[dashboard_id] = (revision, snapshot_revision, checksum)
+    return latest
+
+
+def record(session: Session, versions: Iterable[Tuple[int, bytes, Optional[bytes]]]) -> None:
+    """
+    Records the new versions of dashboards, as (id, content, previous content or None
+    for a new dashboard), in session's transaction
+    """
+    versions = list(versions)
+    if not versions:
+        return
+    latest = _latest(session, [dashboard_id for dashboard_id, _, _ in versions])
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    rows: List[Dict[str, Any]] = []
+
+    def add(dashboard_id: int, revision: int, data: bytes, base: Optional[bytes], snapshot_revision: int) -> None:
+        rows.append({"dashboardId": dashboard_id, "revision": revision, "snapshotRevision": snapshot_revision,
+                     "checksum": zlib.crc32(data), "data": _compress(data, base), "createdAt": now})
+
+    for dashboard_id, data, previous in versions:
+        revision, snapshot_revision, checksum = latest.get(dashboard_id, (0, 0, 0))
+        if previous is not None and (revision == 0 or zlib.crc32(previous) != checksum):
+            # The version being overwritten has no revision: record it first
+            revision = snapshot_revision = revision + 1
+            add(dashboard_id, revision, previous, None, snapshot_revision)
+        revision += 1
+        if previous is None or revision - snapshot_revision >= constants.REVISION_SNAPSHOT_INTERVAL:
+            add(dashboard_id, revision, data, None, revision)
+        else:
+            add(dashboard_id, revision, data, previous, snapshot_revision)
+    session.execute(insert(Revision), rows)
+
+
+def delete_all(session: Session, ids: Sequence[int]) -> None:
+    """
+    Deletes the revisions of the dashboards ids, in session's transaction
+    """
+    for i in range(0, len(ids), _CHUNK_SIZE):
+        session.execute(delete(Revision).where(Revision.dashboardId.in_(ids[i:i + _CHUNK_SIZE])))  # type: ignore
+
+
+def list_revisions(session: Session, dashboard_id: int) -> List[RevisionInfo]:
+    statement = select(Revision.revision, Revision.snapshotRevision, Revision.createdAt,
+                       func.length(Revision.data)).where(
+        Revision.dashboardId == dashboard_id).order_by(Revision.revision)  # type: ignore
+    return [RevisionInfo(revision=revision, createdAt=created_at, snapshot=revision == snapshot_revision, size=size)
+            for revision, snapshot_revision, created_at, size in session.exec(statement).all()]  # type: ignore
+
+
+def get(session: Session, dashboard_id: int, revision: int) -> TurniloDashboard:
+    """
+    The dashboard as of revision: its snapshot and the deltas up to it, in one query
+    """
+    snapshot_revision = select(Revision.snapshotRevision).where(
+        Revision.dashboardId == dashboard_id, Revision.revision == revision).scalar_subquery()
+    statement = select(Revision.revision, Revision.checksum, Revision.data).where(
+        Revision.dashboardId == dashboard_id, Revision.revision <= revision,
+        Revision.revision >= snapshot_revision).order_by(Revision.revision)  # type: ignore
+    chain = session.exec(statement).all()  # type: ignore
+    if not chain:
+        raise HTTPException(status_code=404, detail="Revision not found")
+    data: Optional[bytes] = None
+    for _, checksum, compressed in chain:
+        data = _decompress(compressed, data)
+        if zlib.crc32(data) != checksum:
+            raise HTTPException(status_code=500, detail="Corrupted revision")
+    assert data is not None
+    return TurniloDashboard(id=dashboard_id, **orjson.loads(data))
@@ -0,0 +1,242 @@
+import bisect
+import logging
+import math
+import re
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from sqlalchemy import Engine, func, text
+from sqlmodel import Session, select
+from models.turnilo_dashboard import TurniloDashboard
+from models.turnilo_dashboard_change import TurniloDashboardChange
+from services import change_feed
+
+import constants
+
+# Dashboard full-text search, on name and description
+#
+# Backends:
+# - fts5: SQLite FTS5 external content table, kept in sync by triggers on every
+#   write path (including bulk statements and upserts)
+# - tsvector: Postgres GIN index on a tsvector expression, so there is nothing to sync
+# - python: in-process inverted index, for engines without full-text search. It
+#   catches up from the change feed before every search
+#
+# Queries are split into words that must all match; the last one matches as a prefix
+# (search as you type). Matches in name rank higher than in description.
+
+logger = logging.getLogger(__name__)
+
+BACKEND_AUTO = "auto"
+BACKEND_FTS5 = "fts5"
+BACKEND_TSVECTOR = "tsvector"
+BACKEND_PYTHON = "python"
+
+FTS_TABLE = "turniloDashboardsFts"
+
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+# Same word boundaries as FTS5's unicode61 tokenizer: letters and digits
+_WORD_RE = re.compile(r"[^\W_]+")
+
+# The expression of the GIN index (data.migrations.v0004)
+_PG_TSVECTOR = "setweight(to_tsvector('simple', coalesce(name, '')), 'A') || " \
+               "setweight(to_tsvector('simple', coalesce(description, '')), 'B')"
+
+# Engines (by URL) with an FTS5 table
+_fts5_engines: Set[str] = set()
+
+
+def tokenize(s: Optional[str]) -> List[str]:
+    return [word.lower() for word in _WORD_RE.findall(s or "")]
+
+
+def enable_search_index(engine: Engine) -> None:
+    """
+    Uses the FTS5 table of engine's DB, if it has one (see data.migrations.v0004)
+    """
+    if engine.dialect.name != "sqlite":
+        return
+    with engine.connect() as conn:
+        if conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = :name"), {"name": FTS_TABLE}).first():
+            _fts5_engines.add(str(engine.url))
+
+
+def backend(session: Session) -> str:
+    bind = session.get_bind()
+    if constants.SEARCH_BACKEND == BACKEND_PYTHON:
+        return BACKEND_PYTHON
+    if bind.dialect.name == "postgresql":
+        return BACKEND_TSVECTOR
+    if bind.dialect.name == "sqlite" and str(bind.engine.url) in _fts5_engines:
+        return BACKEND_FTS5
+    return BACKEND_PYTHON
+
+
+def search(session: Session, q: str, limit: int) -> List[TurniloDashboard]:
+    """
+    Dashboards matching every word of q, best match first
+    """
+    words = tokenize(q)
+    if not words:
+        return []
+    search_backend = backend(session)
+    if search_backend == BACKEND_FTS5:
+        match = " ".join(f'"{word}"' for word in words) + "*"
+        statement = text(f'''SELECT d.* FROM "{FTS_TABLE}" f JOIN "turniloDashboards" d ON d.id = f.rowid
+                             WHERE "{FTS_TABLE}" MATCH :match
+                             ORDER BY bm25("{FTS_TABLE}", {NAME_WEIGHT}, {DESCRIPTION_WEIGHT}), d.id
+                             LIMIT :limit''').bindparams(match=match, limit=limit)
+    elif search_backend == BACKEND_TSVECTOR:
+        query = " & ".join(words) + ":*"
+        statement = text(f'''SELECT * FROM "turniloDashboards"
+                             WHERE ({_PG_TSVECTOR}) @@ to_tsquery('simple', :query)
+                             ORDER BY ts_rank(({_PG_TSVECTOR}), to_tsquery('simple', :query)) DESC, id
+                             LIMIT :limit''').bindparams(query=query, limit=limit)
+    else:
+        ids = _python_index(session).search(session, words, limit)
+        dashboards = {d.id: d for d in session.exec(select(TurniloDashboard).where(
+            TurniloDashboard.id.in_(ids))).all()}  # type: ignore
+        return [dashboards[_id] for _id in ids if _id in dashboards]
+    return list(session.execute(select(TurniloDashboard).from_statement(statement)).scalars().all())
+
+
+class InvertedIndex:
+    """
+    In-process inverted index of dashboard names and descriptions, ranked with BM25
+    (name and description term frequencies are weighted).
+
+    sync() brings it up to date with the DB: it applies the dashboards changed since
+    the last sync (read from the change feed), or reloads them all if the change feed
+    was pruned past that point.
+    """
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.seq: Optional[int] = None
+        self._postings: Dict[str, Dict[int, float]] = {}
+        self._doc_terms: Dict[int, Tuple[str, ...]] = {}
+        self._doc_len: Dict[int, float] = {}
+        self._total_len = 0.0
+        self._terms: List[str] = []  # Sorted, for prefix lookups
+        self._terms_dirty = False
+
+    def __len__(self) -> int:
+        return len(self._doc_len)
+
+    def add(self, _id: int, name: Optional[str], description: Optional[str]) -> None:
+        self.remove(_id)
+        tf: Dict[str, float] = {}
+        for word in tokenize(name):
+            tf[word] = tf.get(word, 0.0) + NAME_WEIGHT
+        for word in tokenize(description):
+            tf[word] = tf.get(word, 0.0) + DESCRIPTION_WEIGHT
+        for word, freq in tf.items():
+            postings = self._postings.get(word)
+            if postings is None:
+                postings = self._postings[word] = {}
+                self._terms_dirty = True
+            postings[_id] = freq
+        self._doc_terms[_id] = tuple(tf)
+        self._doc_len[_id] = sum(tf.values())
+        self._total_len += self._doc_len[_id]
+
+    def remove(self, _id: int) -> None:
+        for word in self._doc_terms.pop(_id, ()):
+            postings = self._postings[word]
+            del postings[_id]
+            if not postings:
+                del self._postings[word]
+                self._terms_dirty = True
+        self._total_len -= self._doc_len.pop(_id, 0.0)
+
+    def sync(self, session: Session) -> None:
+        with self._lock:
+            # Read the version first: changes committed meanwhile are applied by the next sync
+            newest = change_feed.last_seq(session)
+            oldest = session.exec(select(func.min(TurniloDashboardChange.seq))).one()
+            if self.seq is None or (oldest is not None and oldest > self.seq + 1):
+                self._clear()
+                self._load(session, None)
+            elif newest > self.seq:
+                ids = session.exec(select(TurniloDashboardChange.dashboardId).where(
+                    TurniloDashboardChange.seq > self.seq).distinct()).all()  # type: ignore
+                for _id in ids:
+                    self.remove(_id)
+                self._load(session, list(ids))
+            self.seq = newest
+
+    def search(self, session: Session, words: List[str], limit: int) -> List[int]:
+        self.sync(session)
+        with self._lock:
+            scores: Optional[Dict[int, float]] = None
+            for i, word in enumerate(words):
+                terms = self._prefixed(word) if i == len(words) - 1 else [word]
+                word_scores: Dict[int, float] = {}
+                for term in terms:
+                    for _id, score in self._score(term).items():
+                        word_scores[_id] = max(word_scores.get(_id, 0.0), score)
+                if scores is None:
+                    scores = word_scores
+                else:
+                    scores = {_id: s + word_scores[_id] for _id, s in scores.items() if _id in word_scores}
+                if not scores:
+                    return []
+            assert scores is not None
+            return [_id for _id, _ in sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]]
+
+    def _score(self, term: str) -> Dict[int, float]:
+        postings = self._postings.get(term, {})
+        n = len(self._doc_len)
+        idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+        avg_len = self._total_len / n if n else 1.0
+        return {_id: idf * tf * (self.K1 + 1) / (tf + self.K1 * (1 - self.B + self.B * self._doc_len[_id] / avg_len))
+                for _id, tf in postings.items()}
+
+    def _prefixed(self, prefix: str) -> List[str]:
+        if self._terms_dirty:
+            self._terms = sorted(self._postings)
+            self._terms_dirty = False
+        terms = []
+        for term in self._terms[bisect.bisect_left(self._terms, prefix):]:
+            if not term.startswith(prefix):
+                break
+            terms.append(term)
+        return terms
+
+    def _load(self, session: Session, ids: Optional[Iterable[int]]) -> None:
+        statement = select(TurniloDashboard.id, TurniloDashboard.name, TurniloDashboard.description)
+        if ids is None:
+            statements = [statement]
+        else:
+            ids = list(ids)
+            statements = [statement.where(TurniloDashboard.id.in_(ids[i:i + 500]))  # type: ignore
+                          for i in range(0, len(ids), 500)]
+        for statement in statements:
+            for _id, name, description in session.exec(statement).all():
+                self.add(_id, name, description)
+
+    def _clear(self) -> None:
+        self._postings.clear()
+        self._doc_terms.clear()
+        self._doc_len.clear()
+        self._total_len = 0.0
+        self._terms = []
+        self._terms_dirty = False
+
+
+# In-process indexes, by engine URL
+_python_indexes: Dict[str, InvertedIndex] = {}
+_python_indexes_lock = threading.Lock()
+
+
+def _python_index(session: Session) -> InvertedIndex:
+    url = str(session.get_bind().engine.url)
+    with _python_indexes_lock:
+        index = _python_indexes.get(url)
+        if index is None:
+            index = _python_indexes[url] = InvertedIndex()
+        return index
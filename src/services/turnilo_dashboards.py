@@ -1,20 +1,78 @@
+import asyncio
+import base64
+import contextlib
+import datetime
+import heapq
+import itertools
+import json
+import logging
 import re
-from typing import List, Optional
+from typing import (Any, AsyncGenerator, AsyncIterator, Callable, Dict, Generator, List, Optional, Sequence, Set,
+                    Tuple, TypeVar, Union)
 from sqlmodel import Session, select
-from pydantic import BaseModel, Field
-from sqlalchemy import exc
+from sqlmodel.ext.asyncio.session import AsyncSession
+from pydantic import BaseModel, Field, ValidationError
+from sqlalchemy import Select, delete, exc, insert, or_, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import UnaryExpression
 from models.turnilo_dashboard import TurniloDashboard
+from models.turnilo_dashboard_hash import TurniloDashboardHash
+from models.turnilo_dashboard_import import TurniloDashboardImport
+from services import archives, change_feed, etags, group_commit, hash_store, payloads, revisions, search
+from services.cache import dashboard_cache, invalidation_handler
 from fastapi import HTTPException
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+import orjson
+
+import constants
+import data.database as db
+import data.engine_config as engine_config
+import data.shards as shards
 
 # Turnilo Dashboards
 
+logger = logging.getLogger(__name__)
+
+# With a read replica, the listener reads the change log from it (see ChangeFeedListener)
+change_feed.subscribe(invalidation_handler(dashboard_cache,
+                                           None if engine_config.has_replica() else change_feed.replica_id))
+
+
+ORDER_BY_ID = "id"
+ORDER_BY_NAME = "name"
+ORDER_BY = [ORDER_BY_ID, ORDER_BY_NAME]
+
+# Ids are 32-bit integers on Postgres: a cursor past them can't be bound
+MAX_ID = 2 ** 31 - 1
+
+# Fields of the default representation. fields can also ask for hashDigest, the digest
+# of hash in the store: with it (or in place of it, saving its transfer)
+FIELDS = [f for f in TurniloDashboard.model_fields if f != "hashDigest"]
+LIST_FIELDS = FIELDS + ["hashDigest"]
+
+# Dashboard as read by the list queries: field name -> value
+DashboardRow = Dict[str, Any]
+
+T = TypeVar("T")
+
 
 class GetQueryParams(BaseModel):
     """
     Get query filtering params
     """
     shortName: Optional[str] = Field(default=None, description="Dashboard's shortName")
+    shortNamePrefix: Optional[str] = Field(default=None, description="Prefix of the dashboard's shortName")
+    shortNameIn: Optional[str] = Field(default=None, description="Comma separated list of shortNames")
     dataCube: Optional[str] = Field(default=None, description="Dashboard's dataCube")
+    dataCubePrefix: Optional[str] = Field(default=None, description="Prefix of the dashboard's dataCube")
+    dataCubeIn: Optional[str] = Field(default=None, description="Comma separated list of dataCubes")
+    preset: Optional[bool] = Field(default=None, description="Preset dashboards only (true) or non preset only (false)")
+    orderBy: Optional[str] = Field(default=None, description=f"Sort order: {ORDER_BY}. Default is id")
+    fields: Optional[str] = Field(default=None,
+                                  description="Comma separated list of the fields to return. id is always returned")
+    limit: Optional[int] = Field(default=None, description="Max number of dashboards to return (page size)")
+    after: Optional[str] = Field(default=None, description="Cursor of the page to return (X-Next-Cursor header)")
 
     def is_valid_param(self, s: str) -> bool:
         if len(s) > 256:
@@ -23,19 +81,376 @@ class GetQueryParams(BaseModel):
         return bool(re.match(pattern, s))
 
     def validate(self):
-        if self.shortName and not self.is_valid_param(self.shortName):
-            raise HTTPException(status_code=400, detail=f"Invalid shortName='{self.shortName}'")
-        if self.dataCube and not self.is_valid_param(self.dataCube):
-            raise HTTPException(status_code=400, detail=f"Invalid dataCube='{self.dataCube}'")
+        for name in ("shortName", "shortNamePrefix", "dataCube", "dataCubePrefix"):
+            value = getattr(self, name)
+            if value and not self.is_valid_param(value):
+                raise HTTPException(status_code=400, detail=f"Invalid {name}='{value}'")
+        for name in ("shortNameIn", "dataCubeIn"):
+            values = self.split(getattr(self, name))
+            if values is None:
+                continue
+            if not values or not all(self.is_valid_param(v) for v in values):
+                raise HTTPException(status_code=400, detail=f"Invalid {name}='{getattr(self, name)}'")
+            if len(values) > constants.FILTER_IN_MAX_VALUES:
+                raise HTTPException(status_code=400,
+                                    detail=f"Too many values in {name}. Max is {constants.FILTER_IN_MAX_VALUES}")
+        if self.orderBy is not None and self.orderBy not in ORDER_BY:
+            raise HTTPException(status_code=400, detail=f"Invalid orderBy='{self.orderBy}'. Valid values: {ORDER_BY}")
+        fields = self.split(self.fields)
+        if fields is not None and (not fields or not set(fields) <= set(LIST_FIELDS)):
+            raise HTTPException(status_code=400, detail=f"Invalid fields='{self.fields}'. Valid fields: {LIST_FIELDS}")
+        if self.limit is not None and (self.limit < 1 or self.limit > constants.PAGINATION_MAX_LIMIT):
+            raise HTTPException(status_code=400,
+                                detail=f"Invalid limit='{self.limit}'. Range is [1, {constants.PAGINATION_MAX_LIMIT}]")
+        if self.after is not None:
+            try:
+                self.after_key()
+            except ValueError:
+                raise HTTPException(status_code=400, detail=f"Invalid after='{self.after}'")
+
+    @staticmethod
+    def split(value: Optional[str]) -> Optional[List[str]]:
+        return None if value is None else [v for v in value.split(",") if v]
+
+    def is_paginated(self) -> bool:
+        return self.limit is not None or self.after is not None
+
+    def is_cacheable(self) -> bool:
+        # Only the exact match filters map to the cache keys that writes invalidate
+        return self.model_dump(exclude={"shortName", "dataCube"}, exclude_none=True) == {}
+
+    def order_by(self) -> str:
+        return self.orderBy or ORDER_BY_ID
+
+    def keep_digest(self) -> bool:
+        return "hashDigest" in (self.split(self.fields) or [])
+
+    def field_set(self) -> Optional[Set[str]]:
+        """
+        Fields to return (projection), None for all of them
+        """
+        fields = self.split(self.fields)
+        return None if fields is None else set(fields) | {"id"}
+
+    def after_key(self) -> Optional[Tuple[Any, ...]]:
+        """
+        Sort key of the last dashboard of the previous page. Raises ValueError if the cursor is not valid
+        """
+        if self.after is None:
+            return None
+        if self.order_by() == ORDER_BY_ID:
+            # isdigit() alone accepts any Unicode digit (e.g. "²"), that int() doesn't
+            if not (self.after.isascii() and self.after.isdigit()):
+                raise ValueError(self.after)
+            key: Any = [int(self.after)]
+        else:
+            # Opaque cursor: base64 of the JSON [name, id]
+            key = json.loads(base64.urlsafe_b64decode(self.after.encode()))
+            if not (isinstance(key, list) and len(key) == 2 and isinstance(key[0], str)
+                    and type(key[1]) is int):
+                raise ValueError(self.after)
+        if not 0 <= key[-1] <= MAX_ID:
+            raise ValueError(self.after)
+        return tuple(key)
+
+    def cursor(self, row: DashboardRow) -> str:
+        """
+        Cursor of the page that follows the dashboard row
+        """
+        if self.order_by() == ORDER_BY_ID:
+            return str(row["id"])
+        return base64.urlsafe_b64encode(json.dumps([row["name"], row["id"]]).encode()).decode()
+
+    def sort_key(self, row: DashboardRow) -> Tuple[Any, ...]:
+        if self.order_by() == ORDER_BY_ID:
+            return (row["id"],)
+        return (row["name"], row["id"])
+
+
+def _prefix_condition(session: Session, column, prefix: str):
+    # Index friendly prefix match. SQLite's LIKE is case insensitive, so it cannot use
+    # the (BINARY) indexes, but GLOB can. Valid params have no GLOB wildcards
+    if session.get_bind().dialect.name == "sqlite":
+        return column.op("GLOB")(prefix + "*")
+    return column.startswith(prefix, autoescape=True)
+
+
+def _walked(session: Session, column):
+    # Column of a filter that is evaluated on the rows of the index the query walks, not
+    # sought on: on SQLite, +column keeps the planner from seeking a range (or an IN
+    # list) and then sorting on the sort key. Postgres plans on its statistics
+    if session.get_bind().dialect.name == "sqlite":
+        return UnaryExpression(column, operator=operators.custom_op("+"), type_=column.type)
+    return column
+
+
+def _dashboards_select(session: Session, query_params: GetQueryParams,
+                       after_key: Optional[Tuple[Any, ...]] = None, limit: Optional[int] = None):
+    # The equality filters seek on an index that ends in id (ix_turniloDashboards_*_id),
+    # so keyset pages by id come out of it in order. The other ones are evaluated walking
+    # an index in sort key order. Without equality filters, the ids of a page are read,
+    # walking ix_turniloDashboards_id_filters alone, before the rows (by their id)
+    fields = query_params.field_set()
+    if fields is not None:
+        # The sort key is needed to build the next cursor
+        fields |= {"id", "name"} if query_params.order_by() == ORDER_BY_NAME else {"id"}
+    columns = [f for f in FIELDS if fields is None or f in fields]
+    if "hash" in columns or query_params.keep_digest():
+        # hash is read from the store
+        columns.append("hashDigest")
+    statement = select(*[getattr(TurniloDashboard, f) for f in columns])
+    sought: List[Any] = []
+    walked: List[Any] = []
+    for column, value, prefix, values in (
+            (TurniloDashboard.shortName, query_params.shortName, query_params.shortNamePrefix,
+             query_params.split(query_params.shortNameIn)),
+            (TurniloDashboard.dataCube, query_params.dataCube, query_params.dataCubePrefix,
+             query_params.split(query_params.dataCubeIn))):
+        if value:
+            sought.append(column == value)
+        if prefix:
+            walked.append(_prefix_condition(session, _walked(session, column), prefix))
+        if values:
+            walked.append(_walked(session, column).in_(values))  # type: ignore
+    preset = _walked(session, TurniloDashboard.preset)
+    if query_params.preset and query_params.dataCube:
+        # ix_turniloDashboards_preset_dataCube_id
+        sought.append(TurniloDashboard.preset == True)  # noqa: E712
+    elif query_params.preset:
+        walked.append(preset == True)  # noqa: E712
+    elif query_params.preset is not None:
+        walked.append(or_(preset == False, preset.is_(None)))  # noqa: E712
+    keyset: List[Any] = []
+    if after_key is not None:
+        # Keyset pagination: seek on the sort key (an index) instead of OFFSET, so every
+        # chunk costs the same regardless of how deep into the table it is
+        if query_params.order_by() == ORDER_BY_NAME:
+            keyset.append(tuple_(TurniloDashboard.name, TurniloDashboard.id) > tuple_(*after_key))
+        else:
+            keyset.append(TurniloDashboard.id > after_key[0])  # type: ignore
+    if query_params.order_by() == ORDER_BY_NAME:
+        statement = statement.where(*sought, *walked, *keyset).order_by(
+            TurniloDashboard.name, TurniloDashboard.id)  # type: ignore
+    elif walked and not sought and limit is not None:
+        ids = select(TurniloDashboard.id).where(*walked, *keyset).order_by(
+            TurniloDashboard.id).limit(limit)  # type: ignore
+        statement = statement.where(TurniloDashboard.id.in_(ids)).order_by(TurniloDashboard.id)  # type: ignore
+    else:
+        statement = statement.where(*sought, *walked, *keyset).order_by(TurniloDashboard.id)  # type: ignore
+    return statement if limit is None else statement.limit(limit)
+
+
+def _dashboards_fetch(session: Session, statement, keep_digest: bool = False) -> List[DashboardRow]:
+    # Plain rows instead of ORM instances: no identity map, no validation. The values
+    # come from the DB, so they already are valid dashboards
+    result = session.execute(statement)
+    keys = list(result.keys())
+    rows = [dict(zip(keys, row)) for row in result]
+    if "hash" in keys:
+        hash_store.resolve_rows(session, rows, keep_digest)
+    return rows
+
+
+def _dashboards_project(rows: List[DashboardRow], query_params: GetQueryParams) -> List[DashboardRow]:
+    # Drops the sort key columns that were not requested
+    fields = query_params.field_set()
+    if fields is None or not rows or len(rows[0]) == len(fields):
+        return rows
+    return [{k: v for k, v in row.items() if k in fields} for row in rows]
+
+
+def _dashboards_get_chunk(session: Session, query_params: GetQueryParams,
+                          after_key: Optional[Tuple[Any, ...]], limit: int) -> List[DashboardRow]:
+    statement = _dashboards_get_chunk_select(session, query_params, after_key, limit)
+    return _dashboards_fetch(session, statement, query_params.keep_digest())
+
+
+def _dashboards_get_chunk_select(session: Session, query_params: GetQueryParams,
+                                 after_key: Optional[Tuple[Any, ...]], limit: int):
+    return _dashboards_select(session, query_params, after_key, limit)
+
+
+def _dashboard_copy(dashboard: TurniloDashboard) -> TurniloDashboard:
+    # Cached objects must not be bound to (or expired by) the session that loaded them
+    return TurniloDashboard(**dashboard.model_dump(), hashDigest=dashboard.hashDigest)
+
+
+def _dashboards_invalidate(dashboard: TurniloDashboard) -> None:
+    dashboard_cache.invalidate_dashboard(dashboard.id, dashboard.dataCube, dashboard.shortName)
+
+
+# Shards (data.shards): list queries run on the shards that can have dashboards matching
+# them, and the rows of the shards are merged on the sort key. Single-dashboard
+# operations run on the shard of the dashboard: by its id, or its dataCube to create it
+
+
+def _query_shards(query_params: Optional[GetQueryParams] = None) -> List[int]:
+    if shards.count() == 1:
+        return [0]
+    if query_params is not None and query_params.dataCube:
+        return [shards.of_data_cube(query_params.dataCube)]
+    data_cubes = query_params.split(query_params.dataCubeIn) if query_params is not None else None
+    if data_cubes:
+        return sorted({shards.of_data_cube(data_cube) for data_cube in data_cubes})
+    return shards.all_shards()
+
+
+def _id_shard(_id: int) -> int:
+    shard = shards.of_id(_id)
+    if not 0 <= shard < shards.count():
+        raise HTTPException(status_code=404, detail="Item not found")
+    return shard
+
+
+def _in_shard(session: Session, shard: int, fn: Callable[..., T], *args: Any) -> T:
+    db.use_shard(session, shard)
+    return fn(session, *args)
+
+
+def _on_shards(session: Session, shard_ids: List[int], fn: Callable[..., T], *args: Any) -> List[T]:
+    # One shard after the other, on session
+    return [_in_shard(session, shard, fn, *args) for shard in shard_ids]
+
+
+def _dashboards_merge(query_params: GetQueryParams, parts: List[List[DashboardRow]]) -> List[DashboardRow]:
+    # The rows of each shard are sorted already
+    if len(parts) == 1:
+        return parts[0]
+    return list(heapq.merge(*parts, key=query_params.sort_key))
+
+
+def _dashboards_get_rows(session: Session, query_params: GetQueryParams) -> List[DashboardRow]:
+    return _dashboards_fetch(session, _dashboards_select(session, query_params), query_params.keep_digest())
+
+
+def dashboards_get_all(session: Session, query_params: GetQueryParams) -> List[DashboardRow]:
+    """
+    Returns all dashboards (rows) matching query_params
+    """
+    parts = _on_shards(session, _query_shards(query_params), _dashboards_get_rows, query_params)
+    return _dashboards_project(_dashboards_merge(query_params, parts), query_params)
+
+
+def dashboards_payload_key(query_params: GetQueryParams) -> Tuple[str, Optional[str], Optional[str]]:
+    return ("list", query_params.dataCube or None, query_params.shortName or None)
+
+
+def dashboards_get_payload(session: Session, query_params: GetQueryParams) -> payloads.Payload:
+    """
+    Returns the encoded JSON list of the dashboards matching query_params (which must
+    be cacheable), from the cache if possible. Writes drop the affected payloads
+    """
+    key = dashboards_payload_key(query_params)
+    cached = dashboard_cache.get(key)
+    if cached is not None:
+        return cached
+    generation = dashboard_cache.generation
+    # Version first: the payload can be newer than its version, never older
+    version = dashboards_version(session, query_params)
+    return _dashboards_payload(key, version, dashboards_get_all(session, query_params), generation)
+
+
+def _dashboards_payload(key: Any, version: int, rows: List[DashboardRow], generation: int) -> payloads.Payload:
+    payload = payloads.Payload(version, orjson.dumps(rows))
+    if dashboard_cache.enabled:
+        dashboard_cache.put(key, payload, [row["id"] for row in rows], generation)
+    return payload
+
+
+def dashboards_get_page(session: Session,
+                        query_params: GetQueryParams) -> Tuple[List[DashboardRow], Optional[str]]:
+    """
+    Returns a page of dashboards and the cursor of the next page, if any
+    """
+    limit = query_params.limit or constants.PAGINATION_MAX_LIMIT
+    # Fetch one extra row to know whether there is a next page
+    parts = _on_shards(session, _query_shards(query_params), _dashboards_get_chunk, query_params,
+                       query_params.after_key(), limit + 1)
+    return _dashboards_page(query_params, parts, limit)
+
+
+def _dashboards_page(query_params: GetQueryParams, parts: List[List[DashboardRow]],
+                     limit: int) -> Tuple[List[DashboardRow], Optional[str]]:
+    # Every shard seeks after the same cursor: the page is the first rows of their merge
+    rows = _dashboards_merge(query_params, parts)
+    if len(rows) <= limit:
+        return _dashboards_project(rows, query_params), None
+    rows = rows[:limit]
+    return _dashboards_project(rows, query_params), query_params.cursor(rows[-1])
+
+
+def dashboards_iter(session: Session, query_params: GetQueryParams) -> Generator[DashboardRow, None, None]:
+    """
+    Iterates over all dashboards matching query_params, fetching them from the DB in chunks
+    of constants.STREAM_CHUNK_SIZE so that memory usage does not depend on the table size
+    """
+    shard_ids = _query_shards(query_params)
+    if len(shard_ids) == 1:
+        for chunk in _dashboards_chunks(session, shard_ids[0], query_params):
+            yield from _dashboards_project(chunk, query_params)
+        return
+    rows = heapq.merge(*(itertools.chain.from_iterable(_dashboards_chunks(session, shard, query_params))
+                         for shard in shard_ids), key=query_params.sort_key)
+    for row in itertools.islice(rows, query_params.limit):
+        yield from _dashboards_project([row], query_params)
+
+
+def _dashboards_chunks(session: Session, shard: int,
+                       query_params: GetQueryParams) -> Generator[List[DashboardRow], None, None]:
+    # The chunks of the dashboards of shard (not projected)
+    after_key = query_params.after_key()
+    remaining = query_params.limit
+    while remaining is None or remaining > 0:
+        chunk_size = _dashboards_chunk_size(remaining)
+        chunk = _in_shard(session, shard, _dashboards_get_chunk, query_params, after_key, chunk_size)
+        yield chunk
+        if len(chunk) < chunk_size:
+            break
+        after_key = query_params.sort_key(chunk[-1])
+        if remaining is not None:
+            remaining -= len(chunk)
 
 
-def dashboards_get_all(session: Session, query_params: GetQueryParams) -> List[TurniloDashboard]:
-    statement = select(TurniloDashboard)
-    if query_params.shortName:
-        statement = statement.where(TurniloDashboard.shortName == query_params.shortName)
-    if query_params.dataCube:
-        statement = statement.where(TurniloDashboard.dataCube == query_params.dataCube)
-    return list(session.exec(statement).all())
+def _dashboards_chunk_size(remaining: Optional[int]) -> int:
+    return constants.STREAM_CHUNK_SIZE if remaining is None else min(remaining, constants.STREAM_CHUNK_SIZE)
+
+
+def dashboard_etag(dashboard: TurniloDashboard) -> str:
+    # Derived from id + hash, and the rest of the representation: a rename must not
+    # produce a 304 on a client that cached the old name
+    return etags.make_etag(dashboard.id, dashboard.hash, dashboard.dataCube, dashboard.shortName, dashboard.name,
+                           dashboard.description, bool(dashboard.preset))
+
+
+def dashboards_version(session: Session, query_params: Optional[GetQueryParams] = None) -> int:
+    """
+    Table version: bumped by every write (change feed sequence). With several shards,
+    the sum of the versions of the shards of query_params (all of them without)
+    """
+    return sum(_on_shards(session, _query_shards(query_params), change_feed.last_seq))
+
+
+def dashboards_list_etag(version: int, query_params: GetQueryParams, variant: str = "") -> str:
+    return etags.make_etag(version, query_params.model_dump_json(), variant)
+
+
+def _dashboards_check_precondition(session: Session, _id: int, if_match: Optional[List[str]]) -> TurniloDashboard:
+    # Locks the row (on Postgres) until the write commits, and serves as the existence
+    # check. Returns the current version of the dashboard
+    statement = select(TurniloDashboard).where(TurniloDashboard.id == _id).with_for_update()
+    dashboard = _dashboards_return_single_obj(list(session.exec(statement).all()))
+    hash_store.resolve(session, [dashboard])
+    if if_match is not None and not etags.strong_match(dashboard_etag(dashboard), if_match):
+        raise HTTPException(status_code=412, detail="Precondition failed: dashboard was modified")
+    return dashboard
+
+
+def _dashboards_log(msg: str, dashboard: TurniloDashboard) -> None:
+    # Whole dashboards are only serialized at DEBUG level
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(msg, extra={"dashboard_id": dashboard.id, "dashboard": dashboard.model_dump()})
+    elif logger.isEnabledFor(logging.INFO):
+        logger.info(msg, extra={"dashboard_id": dashboard.id})
 
 
 def _dashboards_return_single_obj(results: List[TurniloDashboard]):
@@ -47,57 +462,861 @@ def _dashboards_return_single_obj(results: List[TurniloDashboard]):
 
 
 def dashboards_get_id(session: Session, _id: int) -> TurniloDashboard:
+    key = ("id", _id)
+    cached = dashboard_cache.get(key)
+    if cached is not None:
+        return cached
+    generation = dashboard_cache.generation
+    db.use_shard(session, _id_shard(_id))
     statement = select(TurniloDashboard).where(TurniloDashboard.id == _id)
     results: List[TurniloDashboard] = list(session.exec(statement).all())
-    return _dashboards_return_single_obj(results)
+    dashboard = _dashboards_return_single_obj(results)
+    hash_store.resolve(session, [dashboard])
+    if dashboard_cache.enabled:
+        dashboard_cache.put(key, _dashboard_copy(dashboard), [_id], generation)
+    return dashboard
 
 
-def dashboards_create(session: Session, dashboard: TurniloDashboard) -> TurniloDashboard:
+def dashboards_hash_get(session: Session, digest: str) -> str:
+    """
+    A hash value by its digest (hashDigest)
+    """
+    # Values are stored on the shards of the dashboards that have them
+    for shard in shards.all_shards():
+        value = _in_shard(session, shard, hash_store.get, digest)
+        if value is not None:
+            return value
+    raise HTTPException(status_code=404, detail="Hash not found")
+
+
+def dashboards_search(session: Session, q: str, limit: int) -> List[TurniloDashboard]:
+    """
+    Full-text search on name and description. Returns the best matches first
+    """
+    _dashboards_search_validate(q, limit)
+    return _dashboards_search_merge(_on_shards(session, _query_shards(), _dashboards_search, q, limit), limit)
+
+
+def _dashboards_search_validate(q: str, limit: int) -> None:
+    if len(q) > 256 or not search.tokenize(q):
+        raise HTTPException(status_code=400, detail=f"Invalid q='{q}'")
+    if limit < 1 or limit > constants.PAGINATION_MAX_LIMIT:
+        raise HTTPException(status_code=400,
+                            detail=f"Invalid limit='{limit}'. Range is [1, {constants.PAGINATION_MAX_LIMIT}]")
+
+
+def _dashboards_search(session: Session, q: str, limit: int) -> List[TurniloDashboard]:
+    dashboards = search.search(session, q, limit)
+    hash_store.resolve(session, dashboards)
+    return dashboards
+
+
+def _dashboards_search_merge(parts: List[List[TurniloDashboard]], limit: int) -> List[TurniloDashboard]:
+    # Scores of different shards are not comparable (their term statistics differ): the
+    # best match of each shard, then the second ones...
+    if len(parts) == 1:
+        return parts[0]
+    return [d for rank in itertools.zip_longest(*parts) for d in rank if d is not None][:limit]
+
+
+def _dashboards_row(dashboard: TurniloDashboard, digest: str) -> Dict[str, Any]:
+    # Columns of dashboard (but its id), with its hash in the store
+    return dict(dashboard.model_dump(exclude={"id"}), hash="", hashDigest=digest)
+
+
+def _dashboards_insert(session: Session, dashboard: TurniloDashboard) -> TurniloDashboard:
     if dashboard.id:
         raise HTTPException(status_code=400, detail="'id' must NOT be set")
     if not dashboard.shortName or dashboard.shortName == "":
         raise HTTPException(status_code=400, detail="shortName not present or empty")
-    try:
-        session.add(dashboard)
-        session.commit()
-    except exc.IntegrityError as e:
-        print(str(e))
-        raise HTTPException(status_code=400, detail="Integrity error: duplicated datacube+shortName")
-    print("Created dashboard: " + str(dashboard.id))
-    print(dashboard)
+    dashboard.hashDigest = hash_store.store(session, [dashboard.hash])[0]
+    values = _dashboards_row(dashboard, dashboard.hashDigest)
+    if shards.count() > 1:
+        # Shard-prefixed id
+        values["id"] = shards.allocate_ids(session, 1)[0]
+    result = session.execute(insert(TurniloDashboard).values(**values))
+    dashboard.id = result.inserted_primary_key[0]  # type: ignore
+    assert dashboard.id is not None
+    revisions.record(session, [(dashboard.id, revisions.content(dashboard), None)])
+    change_feed.publish(session, change_feed.OP_CREATE, dashboard)
     return dashboard
 
 
-def dashboards_update(session: Session, dashboard: TurniloDashboard) -> TurniloDashboard:
+def _dashboards_replace(session: Session, dashboard: TurniloDashboard,
+                        if_match: Optional[List[str]] = None) -> TurniloDashboard:
     if not dashboard.id:
         raise HTTPException(status_code=400, detail="'id' MUST be set")
     if not dashboard.shortName or dashboard.shortName == "":
         raise HTTPException(status_code=400, detail="shortName not present or empty")
 
-    # First check if it exists
-    dashboards_get_id(session, dashboard.id)
+    # The current version is the base of the new revision
+    previous = _dashboards_check_precondition(session, dashboard.id, if_match)
+    previous_content = revisions.content(previous)
+    dashboard.hashDigest = hash_store.store(session, [dashboard.hash], [previous.hashDigest])[0]
+    statement = update(TurniloDashboard).where(TurniloDashboard.id == dashboard.id).values(  # type: ignore
+        **_dashboards_row(dashboard, dashboard.hashDigest))
+    session.execute(statement.execution_options(synchronize_session=False))
+    revisions.record(session, [(dashboard.id, revisions.content(dashboard), previous_content)])
+    change_feed.publish(session, change_feed.OP_UPDATE, dashboard)
+    return dashboard
+
+
+def _dashboards_remove(session: Session, _id: int, if_match: Optional[List[str]] = None) -> TurniloDashboard:
+    if if_match is not None:
+        _dashboards_check_precondition(session, _id, if_match)
+    deleted = _dashboards_delete_returning(session, TurniloDashboard.id == _id)
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Item not found")
+    dashboard = deleted[0]
+    hash_store.resolve(session, [dashboard])
+    hash_store.release(session, [dashboard.hashDigest])
+    revisions.delete_all(session, [_id])
+    change_feed.publish(session, change_feed.OP_DELETE, dashboard)
+    return dashboard
+
+
+def _dashboards_restore(session: Session, _id: int, revision: int,
+                        if_match: Optional[List[str]] = None) -> TurniloDashboard:
+    return _dashboards_replace(session, revisions.get(session, _id, revision), if_match)
+
+
+# Single-dashboard writes: the functions above write, these ones commit (in their own
+# transaction) and then drop the cached versions
+
+_WRITE_LOG_MESSAGES = {
+    _dashboards_insert: "Created dashboard",
+    _dashboards_replace: "Updated dashboard",
+    _dashboards_restore: "Updated dashboard",
+    _dashboards_remove: "Deleted dashboard",
+}
+
+
+def _dashboards_integrity_error(e: exc.IntegrityError) -> HTTPException:
+    logger.info("Integrity error: %s", e)
+    return HTTPException(status_code=400, detail="Integrity error: duplicated datacube+shortName")
+
+
+def _dashboards_write_shard(write: Callable[..., TurniloDashboard], *args: Any) -> int:
+    # Shard of the dashboard that write(session, *args) writes
+    if write is _dashboards_insert:
+        return shards.of_data_cube(args[0].dataCube)
+    if write is not _dashboards_replace:
+        # _dashboards_remove, _dashboards_restore: by id
+        return _id_shard(args[0])
+    dashboard = args[0]
+    shard = _id_shard(dashboard.id or 0)
+    if shards.of_data_cube(dashboard.dataCube) != shard:
+        raise HTTPException(status_code=400, detail="dataCube can't be changed to one of another shard: "
+                                                    "create a new dashboard instead")
+    return shard
+
+
+def _dashboards_write(session: Session, write: Callable[..., TurniloDashboard], *args: Any) -> TurniloDashboard:
+    db.use_shard(session, _dashboards_write_shard(write, *args))
     try:
-        session.merge(dashboard)
+        dashboard = write(session, *args)
         session.commit()
     except exc.IntegrityError as e:
-        print(str(e))
-        raise HTTPException(status_code=400, detail="Integrity error: duplicated datacube+shortName")
-    print("Updated dashboard:" + str(dashboard.id))
-    print(dashboard)
+        raise _dashboards_integrity_error(e)
+    return dashboard
+
+
+def _dashboards_written(write: Callable[..., TurniloDashboard], dashboard: TurniloDashboard) -> None:
+    _dashboards_invalidate(dashboard)
+    _dashboards_log(_WRITE_LOG_MESSAGES[write], dashboard)
+
+
+def dashboards_create(session: Session, dashboard: TurniloDashboard) -> TurniloDashboard:
+    dashboard = _dashboards_write(session, _dashboards_insert, dashboard)
+    _dashboards_written(_dashboards_insert, dashboard)
+    return dashboard
+
+
+def dashboards_update(session: Session, dashboard: TurniloDashboard,
+                      if_match: Optional[List[str]] = None) -> TurniloDashboard:
+    dashboard = _dashboards_write(session, _dashboards_replace, dashboard, if_match)
+    _dashboards_written(_dashboards_replace, dashboard)
+    return dashboard
+
+
+def dashboards_delete(session: Session, _id: int, if_match: Optional[List[str]] = None) -> TurniloDashboard:
+    dashboard = _dashboards_write(session, _dashboards_remove, _id, if_match)
+    _dashboards_written(_dashboards_remove, dashboard)
+    return dashboard
+
+
+def _dashboards_delete_returning(session: Session, condition) -> List[TurniloDashboard]:
+    """
+    Deletes the dashboards matching condition and returns them: DELETE ... RETURNING
+    where the dialect supports it, SELECT + DELETE otherwise
+    """
+    statement = delete(TurniloDashboard).where(condition).execution_options(synchronize_session=False)
+    if session.get_bind().dialect.delete_returning:
+        rows = session.execute(statement.returning(*TurniloDashboard.__table__.columns)).mappings().all()
+        return [TurniloDashboard(**row) for row in rows]
+    dashboards = [_dashboard_copy(d) for d in session.exec(select(TurniloDashboard).where(condition)).all()]
+    session.execute(statement)
+    return dashboards
+
+
+# Revisions
+
+
+def dashboards_revisions(session: Session, _id: int) -> List[revisions.RevisionInfo]:
+    db.use_shard(session, _id_shard(_id))
+    infos = revisions.list_revisions(session, _id)
+    if not infos:
+        # Dashboards written before revisions existed have none
+        dashboards_get_id(session, _id)
+    return infos
+
+
+def dashboards_revision_get(session: Session, _id: int, revision: int) -> TurniloDashboard:
+    return _in_shard(session, _id_shard(_id), revisions.get, _id, revision)
+
+
+def dashboards_revision_restore(session: Session, _id: int, revision: int,
+                                if_match: Optional[List[str]] = None) -> TurniloDashboard:
+    """
+    Updates the dashboard to its version as of revision (which records a new revision)
+    """
+    dashboard = _dashboards_write(session, _dashboards_restore, _id, revision, if_match)
+    _dashboards_written(_dashboards_restore, dashboard)
     return dashboard
 
 
-def dashboards_delete(session: Session, _id: int) -> TurniloDashboard:
-    dashboard = None
+# Bulk operations
+
+BULK_OP_CREATE = "create"
+BULK_OP_UPSERT = "upsert"
+BULK_OP_DELETE = "delete"
+BULK_OPS = [BULK_OP_CREATE, BULK_OP_UPSERT, BULK_OP_DELETE]
+
+# Rows per statement (keeps bound parameters below the SQLite/Postgres limits)
+_BULK_CHUNK_SIZE = 500
+
+_BULK_CONFLICT = "Integrity error: concurrent modification, retry the request"
+
+
+class BulkDeleteItem(BaseModel):
+    """
+    Dashboard to delete: by id, or by dataCube+shortName
+    """
+    id: Optional[int] = None
+    dataCube: Optional[str] = None
+    shortName: Optional[str] = None
+
+
+class BulkItemResult(BaseModel):
+    """
+    Result of a single item of a bulk request
+    """
+    index: int = Field(description="Position of the item in the request")
+    status: int = Field(description="HTTP status code of the item")
+    result: Optional[str] = Field(default=None, description="created, updated or deleted")
+    id: Optional[int] = None
+    detail: Optional[str] = None
+
+
+BulkItem = Union[TurniloDashboard, BulkDeleteItem, BulkItemResult]
+
+
+def bulk_parse_items(op: str, body: bytes, ndjson: bool) -> List[BulkItem]:
+    """
+    Parses a JSON array (or NDJSON) request body. Items that are not valid are
+    returned as (error) BulkItemResult
+    """
     try:
-        statement = select(TurniloDashboard).where(TurniloDashboard.id == _id)
-        dashboard = session.exec(statement).one()
-    except BaseException:
-        pass
-    if dashboard is None:
-        raise HTTPException(status_code=404, detail="Item not found")
-    session.delete(dashboard)
-    session.commit()
-    print("Deleted dashboard:")
-    print(dashboard)
+        if ndjson:
+            raw = [json.loads(line) for line in body.splitlines() if line.strip()]
+        else:
+            raw = json.loads(body)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail="Invalid JSON: " + str(e))
+    if not isinstance(raw, list):
+        raise HTTPException(status_code=400, detail="Body must be an array of dashboards")
+    if len(raw) > constants.BULK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Too many items. Max is {constants.BULK_MAX_ITEMS}")
+
+    model: Any = BulkDeleteItem if op == BULK_OP_DELETE else TurniloDashboard
+    items: List[BulkItem] = []
+    for index, obj in enumerate(raw):
+        try:
+            items.append(model.model_validate(obj))
+        except ValidationError as e:
+            items.append(BulkItemResult(index=index, status=400, detail=str(e)))
+    return items
+
+
+def _bulk_chunks(seq: List[Any]) -> Generator[List[Any], None, None]:
+    for i in range(0, len(seq), _BULK_CHUNK_SIZE):
+        yield seq[i:i + _BULK_CHUNK_SIZE]
+
+
+def _bulk_existing_keys(session: Session, keys: List[Tuple[str, str]]) -> Dict[Tuple[str, str], int]:
+    existing: Dict[Tuple[str, str], int] = {}
+    columns = tuple_(TurniloDashboard.dataCube, TurniloDashboard.shortName)
+    for chunk in _bulk_chunks(keys):
+        statement = select(TurniloDashboard.id, TurniloDashboard.dataCube,
+                           TurniloDashboard.shortName).where(columns.in_(chunk))
+        for _id, dataCube, shortName in session.exec(statement).all():  # type: ignore
+            existing[(dataCube, shortName)] = _id
+    return existing
+
+
+def _bulk_previous(session: Session, ids: List[int]) -> Dict[int, TurniloDashboard]:
+    """
+    Current versions of the dashboards ids (bases of their next revisions)
+    """
+    previous: Dict[int, TurniloDashboard] = {}
+    for chunk in _bulk_chunks(ids):
+        statement = select(TurniloDashboard).where(TurniloDashboard.id.in_(chunk))  # type: ignore
+        dashboards = list(session.exec(statement).all())
+        hash_store.resolve(session, dashboards)
+        previous.update((dashboard.id, dashboard) for dashboard in dashboards)  # type: ignore
+    return previous
+
+
+def _bulk_insert_statement(session: Session, upsert: bool):
+    dialect = session.get_bind().dialect.name
+    if not upsert:
+        statement = insert(TurniloDashboard)
+    elif dialect == "postgresql":
+        statement = postgresql.insert(TurniloDashboard)
+    elif dialect == "sqlite":
+        statement = sqlite.insert(TurniloDashboard)
+    else:
+        raise HTTPException(status_code=501, detail="Bulk upsert is not supported by " + dialect)
+    if upsert:
+        statement = statement.on_conflict_do_update(  # type: ignore
+            index_elements=["dataCube", "shortName"],
+            set_={c: statement.excluded[c]  # type: ignore
+                  for c in ("name", "description", "hash", "preset", "hashDigest")})
+    return statement.returning(TurniloDashboard.id, sort_by_parameter_order=True)
+
+
+def _bulk_write(session: Session, op: str, items: List[BulkItem]) -> List[BulkItemResult]:
+    results: List[Optional[BulkItemResult]] = [item if isinstance(item, BulkItemResult) else None for item in items]
+    changes: List[change_feed.Change] = []
+
+    # Validate and dedupe (the first occurrence of a dataCube+shortName wins)
+    valid: List[Tuple[int, TurniloDashboard]] = []
+    seen = set()
+    for index, item in enumerate(items):
+        if not isinstance(item, TurniloDashboard):
+            continue
+        key = (item.dataCube, item.shortName)
+        if item.id and op == BULK_OP_CREATE:
+            results[index] = BulkItemResult(index=index, status=400, detail="'id' must NOT be set")
+        elif not item.shortName:
+            results[index] = BulkItemResult(index=index, status=400, detail="shortName not present or empty")
+        elif key in seen:
+            results[index] = BulkItemResult(index=index, status=400,
+                                            detail="Integrity error: duplicated datacube+shortName in request")
+        else:
+            seen.add(key)
+            valid.append((index, item))
+
+    existing = _bulk_existing_keys(session, [(d.dataCube, d.shortName) for _, d in valid])
+    if op == BULK_OP_CREATE:
+        conflicts = [(i, d) for i, d in valid if (d.dataCube, d.shortName) in existing]
+        for index, _ in conflicts:
+            results[index] = BulkItemResult(index=index, status=400,
+                                            detail="Integrity error: duplicated datacube+shortName")
+        valid = [(i, d) for i, d in valid if (d.dataCube, d.shortName) not in existing]
+    previous = _bulk_previous(session, list(existing.values())) if op == BULK_OP_UPSERT else {}
+    versions: List[Tuple[int, bytes, Optional[bytes]]] = []
+
+    statement = _bulk_insert_statement(session, op == BULK_OP_UPSERT)
+    for chunk in _bulk_chunks(valid):
+        # The hash values that upserts replace are released. A row inserted concurrently
+        # (the upsert updates it) keeps its reference: its value is never deleted
+        replaced = [previous.get(existing.get((d.dataCube, d.shortName), 0)) for _, d in chunk]
+        digests = hash_store.store(session, [d.hash for _, d in chunk],
+                                   [p.hashDigest if p is not None else None for p in replaced])
+        rows = [_dashboards_row(d, digest) for (_, d), digest in zip(chunk, digests)]
+        if shards.count() > 1:
+            # Shard-prefixed ids. The ones of the rows that exist (upserts) are not used
+            for row, _id in zip(rows, shards.allocate_ids(session, len(rows))):
+                row["id"] = _id
+        ids = session.execute(statement, rows).scalars().all()
+        for (index, dashboard), _id, old in zip(chunk, ids, replaced):
+            created = (dashboard.dataCube, dashboard.shortName) not in existing
+            results[index] = BulkItemResult(index=index, status=200, id=_id,
+                                            result="created" if created else "updated")
+            changes.append((change_feed.OP_CREATE if created else change_feed.OP_UPDATE, _id,
+                            dashboard.dataCube, dashboard.shortName))
+            versions.append((_id, revisions.content(dashboard), revisions.content(old) if old is not None else None))
+    revisions.record(session, versions)
+    change_feed.publish_many(session, changes)
+    return [r for r in results if r is not None]
+
+
+def _bulk_delete(session: Session, items: List[BulkItem]) -> List[BulkItemResult]:
+    results: List[Optional[BulkItemResult]] = [item if isinstance(item, BulkItemResult) else None for item in items]
+    by_id: Dict[int, int] = {}
+    by_key: Dict[Tuple[str, str], int] = {}
+    for index, item in enumerate(items):
+        if not isinstance(item, BulkDeleteItem):
+            continue
+        if item.id is not None:
+            by_id.setdefault(item.id, index)
+        elif item.dataCube and item.shortName:
+            by_key.setdefault((item.dataCube, item.shortName), index)
+        else:
+            results[index] = BulkItemResult(index=index, status=400, detail="'id' or dataCube+shortName MUST be set")
+
+    deleted: List[Any] = []
+    digests: List[Optional[str]] = []
+    key_columns = tuple_(TurniloDashboard.dataCube, TurniloDashboard.shortName)
+    conditions = [TurniloDashboard.id.in_(chunk) for chunk in _bulk_chunks(list(by_id))]  # type: ignore
+    conditions += [key_columns.in_(chunk) for chunk in _bulk_chunks(list(by_key))]
+    for condition in conditions:
+        for d in _dashboards_delete_returning(session, condition):
+            deleted.append((d.id, d.dataCube, d.shortName))
+            digests.append(d.hashDigest)
+
+    for _id, dataCube, shortName in deleted:
+        # The same dashboard, by id and by dataCube+shortName: the first item deleted it
+        refs = [ref for ref in (by_id.pop(_id, None), by_key.pop((dataCube, shortName), None)) if ref is not None]
+        results[min(refs)] = BulkItemResult(index=min(refs), status=200, id=_id, result="deleted")
+    for index in list(by_id.values()) + list(by_key.values()):
+        if results[index] is None:
+            results[index] = BulkItemResult(index=index, status=404, detail="Item not found")
+    # Repeated items (and the later item of a dashboard deleted by id and by
+    # dataCube+shortName): only the first one deleted the dashboard
+    for index, item in enumerate(items):
+        if results[index] is None:
+            results[index] = BulkItemResult(index=index, status=404, detail="Item not found")
+
+    hash_store.release(session, digests)
+    revisions.delete_all(session, [_id for _id, _, _ in deleted])
+    change_feed.publish_many(session, [(change_feed.OP_DELETE, _id, dc, sn) for _id, dc, sn in deleted])
+    return [r for r in results if r is not None]
+
+
+def _bulk_invalidate(items: List[BulkItem], results: List[BulkItemResult]) -> None:
+    for item, result in zip(items, results):
+        if result.status == 200 and result.result:
+            dataCube = getattr(item, "dataCube", None)
+            shortName = getattr(item, "shortName", None)
+            dashboard_cache.invalidate_dashboard(result.id, dataCube, shortName)
+
+
+def _bulk_apply(session: Session, op: str, items: List[BulkItem]) -> List[BulkItemResult]:
+    if op == BULK_OP_DELETE:
+        return _bulk_delete(session, items)
+    return _bulk_write(session, op, items)
+
+
+def _bulk_item_shard(item: Union[TurniloDashboard, BulkDeleteItem]) -> Optional[int]:
+    # None: the dashboard can't exist
+    if isinstance(item, BulkDeleteItem) and item.id is not None:
+        shard = shards.of_id(item.id)
+        return shard if 0 <= shard < shards.count() else None
+    # Deletes without a dataCube fail on any shard
+    return shards.of_data_cube(item.dataCube) if item.dataCube else 0
+
+
+def _bulk_groups(items: List[BulkItem]) -> Tuple[List[BulkItemResult], Dict[int, List[int]]]:
+    # The results of the items that are known to fail, and the indexes of the others by shard
+    results: List[BulkItemResult] = []
+    groups: Dict[int, List[int]] = {}
+    for index, item in enumerate(items):
+        if isinstance(item, BulkItemResult):
+            results.append(item)
+            continue
+        shard = _bulk_item_shard(item)
+        if shard is None:
+            results.append(BulkItemResult(index=index, status=404, detail="Item not found"))
+        else:
+            groups.setdefault(shard, []).append(index)
+    return results, groups
+
+
+def _bulk_shard(session: Session, shard: int, op: str, items: List[BulkItem],
+                indexes: List[int]) -> List[BulkItemResult]:
+    """
+    Applies op to the items at indexes (all of shard) in a transaction on shard. A
+    concurrent writer fails them all (409). Returns their results
+    """
+    db.use_shard(session, shard)
+    try:
+        results = _bulk_apply(session, op, [items[i] for i in indexes])
+        session.commit()
+    except exc.IntegrityError as e:
+        logger.info("Integrity error: %s", e)
+        session.rollback()
+        results = [BulkItemResult(index=i, status=409, detail=_BULK_CONFLICT) for i in range(len(indexes))]
+    return [result.model_copy(update={"index": indexes[result.index]}) for result in results]
+
+
+def _bulk_sharded(session: Session, op: str, items: List[BulkItem]) -> List[BulkItemResult]:
+    # With several shards: a transaction per shard
+    results, groups = _bulk_groups(items)
+    for shard, indexes in sorted(groups.items()):
+        results += _bulk_shard(session, shard, op, items, indexes)
+    return sorted(results, key=lambda result: result.index)
+
+
+def _bulk_done(op: str, items: List[BulkItem], results: List[BulkItemResult]) -> List[BulkItemResult]:
+    _bulk_invalidate(items, results)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("Bulk %s", op, extra={"items": len(results), "ok": sum(1 for r in results if r.status == 200)})
+    return results
+
+
+def dashboards_bulk(session: Session, op: str, items: List[BulkItem]) -> List[BulkItemResult]:
+    """
+    Creates, upserts (on dataCube+shortName) or deletes items in a single transaction,
+    using multi-row statements. Returns the result of each item, in request order. With
+    several shards, in a transaction per shard
+    """
+    if op not in BULK_OPS:
+        raise HTTPException(status_code=400, detail=f"Invalid op='{op}'. Valid ops: {BULK_OPS}")
+    if shards.count() > 1:
+        return _bulk_done(op, items, _bulk_sharded(session, op, items))
+    try:
+        results = _bulk_apply(session, op, items)
+        session.commit()
+    except exc.IntegrityError as e:
+        # A concurrent writer inserted one of the dataCube+shortName pairs
+        logger.info("Integrity error: %s", e)
+        session.rollback()
+        raise HTTPException(status_code=409, detail=_BULK_CONFLICT)
+    return _bulk_done(op, items, results)
+
+
+# Export/import
+
+
+class ImportResult(BaseModel):
+    """
+    State of an import. Lines are counted from the start of the archive, including the
+    ones imported by the previous (failed) attempts of the same importId
+    """
+    importId: str
+    lines: int = Field(description="Lines of the archive imported (committed) so far")
+    created: int
+    updated: int
+    failed: int
+    done: bool = Field(description="The whole archive was imported: retrying it does nothing")
+    errors: List[BulkItemResult] = Field(
+        default_factory=list,
+        description=f"Failed lines of this request (first {constants.IMPORT_MAX_ERRORS}). index is the line, from 0")
+
+
+def _export_statement() -> Select[Any]:
+    # A single query: the archive is a consistent snapshot, read from a server-side
+    # cursor STREAM_CHUNK_SIZE rows at a time. The stored hash values come with the rows
+    columns = [getattr(TurniloDashboard, f) for f in FIELDS] + [
+        TurniloDashboard.hashDigest, TurniloDashboardHash.data.label("hashData")]  # type: ignore
+    return select(*columns) \
+        .outerjoin(TurniloDashboardHash, TurniloDashboardHash.digest == TurniloDashboard.hashDigest) \
+        .order_by(TurniloDashboard.id).execution_options(yield_per=constants.STREAM_CHUNK_SIZE)  # type: ignore
+
+
+def _export_rows(keys: List[str], rows: Sequence[Any]) -> Generator[DashboardRow, None, None]:
+    for values in rows:
+        row = dict(zip(keys, values))
+        key, data = row.pop("hashDigest"), row.pop("hashData")
+        if key is not None:
+            row["hash"] = hash_store.decode(key, data)
+        yield row
+
+
+def dashboards_export(session: Session) -> Generator[bytes, None, None]:
+    """
+    Yields all dashboards as a gzip'd NDJSON archive, in chunks. With several shards, a
+    snapshot of each shard, one after the other (ids are shard-prefixed: in id order)
+    """
+    writer = archives.ArchiveWriter()
+    for shard in shards.all_shards():
+        db.use_shard(session, shard)
+        result = session.execute(_export_statement())
+        keys = list(result.keys())
+        for rows in result.partitions():
+            yield writer.write(_export_rows(keys, rows))
+    yield writer.close()
+
+
+def dashboards_import_state(session: Session, import_id: str) -> TurniloDashboardImport:
+    """
+    Checkpoint of the import import_id: a new (not yet persisted) one if it never ran
+    """
+    # Checkpoints are kept on shard 0
+    db.use_shard(session, 0)
+    state = session.get(TurniloDashboardImport, import_id)
+    if state is None:
+        state = TurniloDashboardImport(importId=import_id, updatedAt=_utcnow())
+    return state
+
+
+def _utcnow() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def _import_parse(lines: List[bytes]) -> Tuple[List[BulkItem], List[int]]:
+    # Items of the non blank lines, and their positions in lines
+    items: List[BulkItem] = []
+    positions: List[int] = []
+    for position, line in enumerate(lines):
+        if not line.strip():
+            continue
+        index = len(items)
+        try:
+            items.append(TurniloDashboard.model_validate(orjson.loads(line)))
+        except orjson.JSONDecodeError as e:
+            items.append(BulkItemResult(index=index, status=400, detail="Invalid JSON: " + str(e)))
+        except ValidationError as e:
+            items.append(BulkItemResult(index=index, status=400, detail=str(e)))
+        positions.append(position)
+    return items, positions
+
+
+def dashboards_import_batch(session: Session, state: TurniloDashboardImport, lines: List[bytes],
+                            done: bool = False) -> List[BulkItemResult]:
+    """
+    Upserts the dashboards of the next lines of an import (the ones after state.lines)
+    and advances its checkpoint, in one transaction. Returns the failed lines. With
+    several shards, each shard commits its dashboards and then shard 0 the checkpoint: a
+    retry upserts the batch again
+    """
+    items, positions = _import_parse(lines)
+    try:
+        if shards.count() == 1:
+            results = _bulk_write(session, BULK_OP_UPSERT, items) if items else []
+        else:
+            results = _bulk_sharded(session, BULK_OP_UPSERT, items) if items else []
+            db.use_shard(session, 0)
+        state.lines += len(lines)
+        state.created += sum(1 for r in results if r.result == "created")
+        state.updated += sum(1 for r in results if r.result == "updated")
+        state.failed += sum(1 for r in results if r.status != 200)
+        state.done = done
+        state.updatedAt = _utcnow()
+        session.add(state)
+        session.commit()
+    except exc.IntegrityError as e:
+        # A concurrent writer: the batch is rolled back, a retry resumes from it
+        logger.info("Integrity error: %s", e)
+        session.rollback()
+        raise HTTPException(status_code=409, detail=_BULK_CONFLICT)
+
+    _bulk_invalidate(items, results)
+    first_line = state.lines - len(lines)
+    return [result.model_copy(update={"index": first_line + positions[result.index]})
+            for result in results if result.status != 200]
+
+
+# Async API
+#
+# Same semantics as the functions above. They accept either an AsyncSession (async
+# mode, run on the async driver) or a Session (sync mode, run in the threadpool). The
+# queries of several shards run at once, a session each
+
+
+async def _on_shards_async(session: db.DbSession, shard_ids: List[int], fn: Callable[..., T],
+                           *args: Any) -> List[T]:
+    if len(shard_ids) == 1:
+        return [await db.run(session, _in_shard, shard_ids[0], fn, *args)]
+    return await db.run_on_shards(shard_ids, fn, *args)
+
+
+async def dashboards_get_all_async(session: db.DbSession, query_params: GetQueryParams) -> List[DashboardRow]:
+    if shards.count() == 1:
+        return await db.run(session, dashboards_get_all, query_params)
+    parts = await _on_shards_async(session, _query_shards(query_params), _dashboards_get_rows, query_params)
+    return _dashboards_project(_dashboards_merge(query_params, parts), query_params)
+
+
+async def dashboards_get_payload_async(session: db.DbSession, query_params: GetQueryParams) -> payloads.Payload:
+    if shards.count() == 1:
+        return await db.run(session, dashboards_get_payload, query_params)
+    key = dashboards_payload_key(query_params)
+    cached = dashboard_cache.get(key)
+    if cached is not None:
+        return cached
+    generation = dashboard_cache.generation
+    version = await dashboards_version_async(session, query_params)
+    return _dashboards_payload(key, version, await dashboards_get_all_async(session, query_params), generation)
+
+
+async def dashboards_get_page_async(session: db.DbSession,
+                                    query_params: GetQueryParams) -> Tuple[List[DashboardRow], Optional[str]]:
+    if shards.count() == 1:
+        return await db.run(session, dashboards_get_page, query_params)
+    limit = query_params.limit or constants.PAGINATION_MAX_LIMIT
+    parts = await _on_shards_async(session, _query_shards(query_params), _dashboards_get_chunk, query_params,
+                                   query_params.after_key(), limit + 1)
+    return _dashboards_page(query_params, parts, limit)
+
+
+async def dashboards_iter_async(session: db.DbSession,
+                                query_params: GetQueryParams) -> AsyncGenerator[DashboardRow, None]:
+    shard_ids = _query_shards(query_params)
+    if len(shard_ids) == 1:
+        async for chunk in _dashboards_chunks_async(session, shard_ids[0], query_params):
+            for row in _dashboards_project(chunk, query_params):
+                yield row
+        return
+    async with contextlib.AsyncExitStack() as stack:
+        shard_chunks = []
+        for shard in shard_ids:
+            chunks = _dashboards_chunks_async(await stack.enter_async_context(db.shard_session(shard)), shard,
+                                              query_params)
+            stack.push_async_callback(chunks.aclose)
+            shard_chunks.append(chunks)
+        rows = _merge_chunks_async(shard_chunks, query_params.sort_key)
+        stack.push_async_callback(rows.aclose)
+        remaining = query_params.limit
+        async for row in rows:
+            if remaining is not None:
+                if remaining == 0:
+                    break
+                remaining -= 1
+            yield _dashboards_project([row], query_params)[0]
+
+
+async def _dashboards_chunks_async(session: db.DbSession, shard: int,
+                                   query_params: GetQueryParams) -> AsyncGenerator[List[DashboardRow], None]:
+    after_key = query_params.after_key()
+    remaining = query_params.limit
+    while remaining is None or remaining > 0:
+        chunk_size = _dashboards_chunk_size(remaining)
+        chunk = await db.run(session, _in_shard, shard, _dashboards_get_chunk, query_params, after_key, chunk_size)
+        yield chunk
+        if len(chunk) < chunk_size:
+            break
+        after_key = query_params.sort_key(chunk[-1])
+        if remaining is not None:
+            remaining -= len(chunk)
+
+
+async def _next_chunk(chunks: AsyncIterator[List[DashboardRow]]) -> List[DashboardRow]:
+    try:
+        return await chunks.__anext__()
+    except StopAsyncIteration:
+        return []
+
+
+async def _merge_chunks_async(shard_chunks: Sequence[AsyncIterator[List[DashboardRow]]],
+                              key: Callable[[DashboardRow], Any]) -> AsyncGenerator[DashboardRow, None]:
+    # Merge of the (sorted) rows of the shards, a chunk of each at a time. The first
+    # chunks are fetched at once; the next one of a shard when its rows are all merged
+    chunks = list(await asyncio.gather(*(_next_chunk(c) for c in shard_chunks)))
+    positions = [0] * len(chunks)
+    heap = [(key(chunk[0]), i) for i, chunk in enumerate(chunks) if chunk]
+    heapq.heapify(heap)
+    while heap:
+        _, i = heapq.heappop(heap)
+        yield chunks[i][positions[i]]
+        positions[i] += 1
+        if positions[i] == len(chunks[i]):
+            chunks[i], positions[i] = await _next_chunk(shard_chunks[i]), 0
+        if positions[i] < len(chunks[i]):
+            heapq.heappush(heap, (key(chunks[i][positions[i]]), i))
+
+
+async def dashboards_get_id_async(session: db.DbSession, _id: int) -> TurniloDashboard:
+    return await db.run(session, dashboards_get_id, _id)
+
+
+async def dashboards_hash_get_async(session: db.DbSession, digest: str) -> str:
+    return await db.run(session, dashboards_hash_get, digest)
+
+
+async def dashboards_search_async(session: db.DbSession, q: str, limit: int) -> List[TurniloDashboard]:
+    if shards.count() == 1:
+        return await db.run(session, dashboards_search, q, limit)
+    _dashboards_search_validate(q, limit)
+    return _dashboards_search_merge(await _on_shards_async(session, _query_shards(), _dashboards_search, q, limit),
+                                    limit)
+
+
+async def _dashboards_write_async(session: db.DbSession, write: Callable[..., TurniloDashboard],
+                                  *args: Any) -> TurniloDashboard:
+    # With group commit, the write joins the next batch of the writer instead of
+    # committing on its own (session is not used)
+    if constants.GROUP_COMMIT:
+        try:
+            shard = _dashboards_write_shard(write, *args)
+            dashboard = await asyncio.wrap_future(group_commit.submit(write, *args, shard=shard))
+        except exc.IntegrityError as e:
+            raise _dashboards_integrity_error(e)
+    else:
+        dashboard = await db.run(session, _dashboards_write, write, *args)
+    _dashboards_written(write, dashboard)
     return dashboard
+
+
+async def dashboards_create_async(session: db.DbSession, dashboard: TurniloDashboard) -> TurniloDashboard:
+    return await _dashboards_write_async(session, _dashboards_insert, dashboard)
+
+
+async def dashboards_update_async(session: db.DbSession, dashboard: TurniloDashboard,
+                                  if_match: Optional[List[str]] = None) -> TurniloDashboard:
+    return await _dashboards_write_async(session, _dashboards_replace, dashboard, if_match)
+
+
+async def dashboards_delete_async(session: db.DbSession, _id: int,
+                                  if_match: Optional[List[str]] = None) -> TurniloDashboard:
+    return await _dashboards_write_async(session, _dashboards_remove, _id, if_match)
+
+
+async def dashboards_revisions_async(session: db.DbSession, _id: int) -> List[revisions.RevisionInfo]:
+    return await db.run(session, dashboards_revisions, _id)
+
+
+async def dashboards_revision_get_async(session: db.DbSession, _id: int, revision: int) -> TurniloDashboard:
+    return await db.run(session, dashboards_revision_get, _id, revision)
+
+
+async def dashboards_revision_restore_async(session: db.DbSession, _id: int, revision: int,
+                                            if_match: Optional[List[str]] = None) -> TurniloDashboard:
+    return await _dashboards_write_async(session, _dashboards_restore, _id, revision, if_match)
+
+
+async def dashboards_version_async(session: db.DbSession, query_params: Optional[GetQueryParams] = None) -> int:
+    if shards.count() == 1:
+        return await db.run(session, dashboards_version, query_params)
+    return sum(await _on_shards_async(session, _query_shards(query_params), change_feed.last_seq))
+
+
+async def dashboards_bulk_async(session: db.DbSession, op: str, items: List[BulkItem]) -> List[BulkItemResult]:
+    if shards.count() == 1 or op not in BULK_OPS:
+        return await db.run(session, dashboards_bulk, op, items)
+    results, groups = _bulk_groups(items)
+
+    async def bulk_shard(shard: int, indexes: List[int]) -> List[BulkItemResult]:
+        async with db.shard_session(shard, write=True) as shard_session:
+            return await db.run(shard_session, _bulk_shard, shard, op, items, indexes)
+
+    for shard_results in await asyncio.gather(*(bulk_shard(*group) for group in groups.items())):
+        results += shard_results
+    return _bulk_done(op, items, sorted(results, key=lambda result: result.index))
+
+
+async def dashboards_export_async(session: db.DbSession) -> AsyncGenerator[bytes, None]:
+    if not isinstance(session, AsyncSession):
+        async for chunk in iterate_in_threadpool(dashboards_export(session)):
+            yield chunk
+        return
+    writer = archives.ArchiveWriter()
+    for shard in shards.all_shards():
+        db.use_shard(session, shard)
+        result = await session.stream(_export_statement())
+        keys = list(result.keys())
+        async for rows in result.partitions():
+            # Compression is CPU bound: off the event loop
+            yield await run_in_threadpool(writer.write, _export_rows(keys, rows))
+    yield writer.close()
+
+
+async def dashboards_import_state_async(session: db.DbSession, import_id: str) -> TurniloDashboardImport:
+    return await db.run(session, dashboards_import_state, import_id)
+
+
+async def dashboards_import_batch_async(session: db.DbSession, state: TurniloDashboardImport, lines: List[bytes],
+                                        done: bool = False) -> List[BulkItemResult]:
+    return await db.run(session, dashboards_import_batch, state, lines, done)
@@ -0,0 +1,280 @@
+import asyncio
+import time
+from typing import AsyncGenerator, AsyncIterator, List, NamedTuple, Optional, Tuple
+import orjson
+from pydantic import BaseModel, Field
+from sqlmodel import Session
+from models.turnilo_dashboard_change import TurniloDashboardChange
+from services import change_feed, metrics
+
+import constants
+import data.database as db
+
+# Dashboard watchers
+#
+# The writes of services.turnilo_dashboards record their changes in the change log. The
+# change feed listener of this process hands each change to the hub, which keeps the
+# last ones in memory and wakes up the watchers. Watchers only hold a position in the
+# buffer and all wait on the same future, so an idle one costs a suspended coroutine
+# (and its socket), and holds no DB connection. Watchers that resume from further back
+# than the buffer catch up from the change log.
+#
+# Cursors are change log sequence numbers: SSE event ids, and the after parameter.
+
+SSE_MEDIA_TYPE = "text/event-stream"
+
+MODE_STREAM = "stream"
+MODE_POLL = "poll"
+
+
+class WatchEvent(NamedTuple):
+    seq: int
+    op: str
+    dataCube: str
+    # JSON of the event, encoded once for all the watchers
+    data: bytes
+
+
+class DashboardEvent(BaseModel):
+    seq: int = Field(description="Sequence number of the change")
+    op: str = Field(description="create, update or delete")
+    id: int = Field(description="Id of the dashboard (get it for its new content)")
+    dataCube: str
+    shortName: str
+
+
+class WatchResult(BaseModel):
+    seq: int = Field(description="Cursor: pass it as after to get the next events")
+    reset: bool = Field(description="Events after the given cursor are no longer available (or the cursor is "
+                                    "unknown): get the dashboards again")
+    events: List[DashboardEvent]
+
+
+def _event(change: TurniloDashboardChange) -> WatchEvent:
+    assert change.seq is not None
+    return WatchEvent(change.seq, change.op, change.dataCube, orjson.dumps({
+        "seq": change.seq, "op": change.op, "id": change.dashboardId, "dataCube": change.dataCube,
+        "shortName": change.shortName}))
+
+
+class WatchHub:
+    """
+    Buffer of the last changes read by the change feed listener, and the future the
+    watchers wait on. Lives on the event loop passed to start(); changes are handed
+    over from the listener thread
+    """
+
+    def __init__(self, buffer_size: int = constants.WATCH_BUFFER_SIZE):
+        self.buffer_size = buffer_size
+        # Between buffer_size and 2 * buffer_size events; the oldest half is dropped at once
+        self._events: List[WatchEvent] = []
+        # Position of _events[0]: positions only grow
+        self._offset = 0
+        # Every change after this seq went through the buffer (None: not started)
+        self.covered_after: Optional[int] = None
+        self.last_seq = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._waiter: Optional["asyncio.Future[None]"] = None
+
+    @property
+    def position(self) -> int:
+        """
+        Position of the next event
+        """
+        return self._offset + len(self._events)
+
+    def start(self, loop: asyncio.AbstractEventLoop, since: int) -> None:
+        """
+        Starts buffering the changes after since (the last seq read by the listener)
+        """
+        self._offset = self.position
+        self._events = []
+        self.covered_after = since
+        self.last_seq = since
+        self._loop = loop
+
+    def stop(self) -> None:
+        self._loop = None
+        self.covered_after = None
+
+    def on_change(self, change: TurniloDashboardChange) -> None:
+        # Change feed handler: runs in the listener thread
+        loop = self._loop
+        if loop is None:
+            return
+        event = _event(change)
+        try:
+            loop.call_soon_threadsafe(self._append, event)
+        except RuntimeError:
+            # The loop is closed (shutdown)
+            pass
+
+    def _append(self, event: WatchEvent) -> None:
+        if self.covered_after is None:
+            return
+        self._events.append(event)
+        self.last_seq = max(self.last_seq, event.seq)
+        if len(self._events) >= 2 * self.buffer_size:
+            dropped = self._events[:self.buffer_size]
+            del self._events[:self.buffer_size]
+            self._offset += self.buffer_size
+            self.covered_after = max([self.covered_after] + [e.seq for e in dropped])
+        waiter, self._waiter = self._waiter, None
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def position_after(self, seq: int) -> Optional[int]:
+        """
+        Position of the first event after seq, None if the buffer does not have all of
+        them (or seq is ahead of it: a cursor from another replica, or unknown)
+        """
+        if self.covered_after is None or not self.covered_after <= seq <= self.last_seq:
+            return None
+        position = self.position
+        while position > self._offset and self._events[position - self._offset - 1].seq > seq:
+            position -= 1
+        return position
+
+    def events_since(self, position: int) -> Optional[List[WatchEvent]]:
+        """
+        The events from position on, None if some of them were dropped
+        """
+        if position < self._offset:
+            return None
+        return self._events[position - self._offset:]
+
+    async def wait(self, position: int, timeout: float) -> bool:
+        """
+        Waits up to timeout seconds for the event at position. Returns whether it came
+        """
+        if self.position > position:
+            return True
+        if self._waiter is None:
+            self._waiter = asyncio.get_running_loop().create_future()
+        done, _ = await asyncio.wait({self._waiter}, timeout=timeout)
+        return bool(done)
+
+
+hub = WatchHub()
+change_feed.subscribe(hub.on_change)
+
+
+def _read_change_log(session: Session, after: int,
+                     data_cube: Optional[str]) -> Tuple[List[WatchEvent], int, bool, bool]:
+    # The events after after (up to WATCH_BACKLOG_LIMIT), the cursor after them, whether
+    # events before them are missing (pruned, or after is unknown) and whether there are more
+    first, last = change_feed.seq_range(session)
+    if after > last:
+        return [], last, True, False
+    changes = change_feed.changes_after(session, after, data_cube, constants.WATCH_BACKLOG_LIMIT)
+    more = len(changes) == constants.WATCH_BACKLOG_LIMIT
+    seq = changes[-1].seq if more and changes[-1].seq is not None else last
+    return [_event(change) for change in changes], seq, first > after + 1, more
+
+
+async def _catch_up(after: int, data_cube: Optional[str]) -> Tuple[List[WatchEvent], int, bool, bool]:
+    # A session of its own, closed before waiting for the next events
+    async with db.read_session() as db_session:
+        return await db.run(db_session, _read_change_log, after, data_cube)
+
+
+async def _start(after: Optional[int]) -> Tuple[int, Optional[int]]:
+    # Cursor and buffer position to start from. Without after: the last committed change
+    # (the hub can be behind it), and the events that come after it
+    if after is not None:
+        return after, hub.position_after(after)
+    position = hub.position
+    async with db.read_session() as db_session:
+        return await db.run(db_session, change_feed.last_seq), position
+
+
+async def _batches(seq: int, position: Optional[int], data_cube: Optional[str], heartbeat: float,
+                   deadline: float) -> AsyncGenerator[Tuple[List[WatchEvent], int, bool], None]:
+    # Yields (events, cursor after them, events before them are missing) as they come.
+    # After heartbeat seconds without events, yields an empty batch (the cursor still
+    # moves past the events of the other dataCubes). Ends at deadline
+    floor = seq
+    yielded = time.monotonic()
+    while True:
+        if position is None:
+            # Events that come during the query are buffered after this position
+            position = hub.position
+            events, seq, reset, more = await _catch_up(seq, data_cube)
+            # The buffer can have (some of) the events just read
+            floor = seq
+            if more:
+                position = None
+            if events or reset:
+                yielded = time.monotonic()
+                yield events, seq, reset
+            continue
+        events_since = hub.events_since(position)
+        if events_since is None:
+            # The buffer moved on meanwhile (slow client)
+            position = None
+            continue
+        if events_since:
+            position += len(events_since)
+            seq = max([seq] + [e.seq for e in events_since])
+            events = [e for e in events_since if e.seq > floor and (data_cube is None or e.dataCube == data_cube)]
+            if events:
+                yielded = time.monotonic()
+                yield events, seq, False
+                continue
+        now = time.monotonic()
+        if now - yielded >= heartbeat:
+            yielded = now
+            yield [], seq, False
+        if now >= deadline:
+            return
+        await hub.wait(position, min(yielded + heartbeat, deadline) - now)
+
+
+def _result(seq: int, reset: bool, events: List[WatchEvent]) -> bytes:
+    return b'{"seq":%d,"reset":%s,"events":[%s]}' % (
+        seq, b"true" if reset else b"false", b",".join(e.data for e in events))
+
+
+async def poll(after: Optional[int], data_cube: Optional[str], timeout: float) -> bytes:
+    """
+    Long poll: the events after after (JSON of a WatchResult), as soon as there are
+    some, or none after timeout seconds. Without after, the current cursor right away
+    """
+    seq, position = await _start(after)
+    if after is None:
+        return _result(seq, False, [])
+    metrics.watchers.inc((MODE_POLL,))
+    batches = _batches(seq, position, data_cube, timeout, time.monotonic() + timeout)
+    try:
+        async for events, seq, reset in batches:
+            return _result(seq, reset, events)
+        return _result(seq, False, [])
+    finally:
+        await batches.aclose()
+        metrics.watchers.dec((MODE_POLL,))
+
+
+def _sse_frames(events: List[WatchEvent], seq: int, reset: bool) -> bytes:
+    frames = [b"event: reset\ndata: {}\n\n"] if reset else []
+    frames += [b"id: %d\nevent: %s\ndata: %s\n\n" % (e.seq, e.op.encode(), e.data) for e in events]
+    if not events or events[-1].seq < seq:
+        # No data: only moves the client's Last-Event-ID (also a heartbeat)
+        frames.append(b"id: %d\n\n" % seq)
+    return b"".join(frames)
+
+
+async def stream(after: Optional[int], data_cube: Optional[str]) -> AsyncIterator[bytes]:
+    """
+    Server-Sent Events: a ready event with the starting cursor, then an event per change
+    (the op, with a DashboardEvent as data) and a reset event when events are missing.
+    Ends after WATCH_MAX_DURATION seconds: clients reconnect with their Last-Event-ID
+    """
+    seq, position = await _start(after)
+    metrics.watchers.inc((MODE_STREAM,))
+    try:
+        yield b'retry: %d\nid: %d\nevent: ready\ndata: {"seq":%d}\n\n' % (constants.WATCH_RETRY_MS, seq, seq)
+        async for events, seq, reset in _batches(seq, position, data_cube, constants.WATCH_HEARTBEAT_INTERVAL,
+                                                 time.monotonic() + constants.WATCH_MAX_DURATION):
+            yield _sse_frames(events, seq, reset)
+    finally:
+        metrics.watchers.dec((MODE_STREAM,))
@@ -1,13 +1,20 @@
 #!/usr/bin/env python3
 import sys
 import json
+import time
+import uuid
 import requests
 import argparse
+from typing import Any
+from turnilo_client import ApiError, Client
 
 DEFAULT_HOST = "127.0.0.1"
 DEFAULT_PORT = 8080
 DEFAULT_PATH = "rest/turnilo/dashboards"
 
+# One request (and connection) per call, printing the responses. The CLI, and anything
+# that makes more than a few calls, should use the pooled clients of turnilo_client
+
 
 def create_dashboard(host, port, json_string) -> requests.Response:
     url = f"http://{host}:{port}/{DEFAULT_PATH}"
@@ -32,7 +39,9 @@ def delete_dashboard(host, port, dashboard_id) -> requests.Response:
     return response
 
 
-def get_dashboard(host, port, dashboard_id=None, shortName=None, dataCube=None) -> requests.Response:
+def get_dashboard(host, port, dashboard_id=None, shortName=None, dataCube=None, limit=None,
+                  after=None, **filters) -> requests.Response:
+    # filters: other list query params (dataCubePrefix, shortNameIn, preset, orderBy, fields...)
     params = None
     url = f"http://{host}:{port}/{DEFAULT_PATH}"
     if dashboard_id:
@@ -43,11 +52,67 @@ def get_dashboard(host, port, dashboard_id=None, shortName=None, dataCube=None)
             params["shortName"] = shortName
         if dataCube:
             params["dataCube"] = dataCube
+        if limit:
+            params["limit"] = limit
+        if after:
+            params["after"] = after
+        params.update({k: v for k, v in filters.items() if v is not None})
     response = requests.get(url, params=params)
     print_response(response)
     return response
 
 
+def _bulk(host, port, op, json_string) -> requests.Response:
+    url = f"http://{host}:{port}/{DEFAULT_PATH}/_bulk"
+    response = requests.post(url, params={"op": op}, data=json_string, headers={"Content-Type": "application/json"})
+    print_response(response)
+    return response
+
+
+def bulk_create(host, port, json_string) -> requests.Response:
+    return _bulk(host, port, "create", json_string)
+
+
+def bulk_upsert(host, port, json_string) -> requests.Response:
+    return _bulk(host, port, "upsert", json_string)
+
+
+def bulk_delete(host, port, json_string) -> requests.Response:
+    return _bulk(host, port, "delete", json_string)
+
+
+def export_dashboards(host, port, file_path) -> requests.Response:
+    # Streamed to the file: the archive is never held in memory
+    url = f"http://{host}:{port}/{DEFAULT_PATH}/_export"
+    with requests.get(url, stream=True) as response:
+        if response.ok:
+            with open(file_path, "wb") as file:
+                for chunk in response.iter_content(chunk_size=64 * 1024):
+                    file.write(chunk)
+        print(f"Status Code: {response.status_code}")
+    return response
+
+
+def import_dashboards(host, port, file_path, import_id=None, retries=3) -> requests.Response:
+    # Failed attempts are retried with the same importId: they resume after the lines
+    # that the server already committed
+    url = f"http://{host}:{port}/{DEFAULT_PATH}/_import"
+    params = {"importId": import_id or uuid.uuid4().hex}
+    content_type = "application/gzip" if file_path.endswith(".gz") else "application/x-ndjson"
+    for attempt in range(retries + 1):
+        try:
+            with open(file_path, "rb") as file:
+                response = requests.post(url, params=params, data=file, headers={"Content-Type": content_type})
+            if response.status_code not in (409, 503) or attempt == retries:
+                break
+        except requests.ConnectionError:
+            if attempt == retries:
+                raise
+        time.sleep(2 ** attempt)
+    print_response(response)
+    return response
+
+
 def print_response(response) -> None:
     print(f"Status Code: {response.status_code}")
     try:
@@ -56,42 +121,57 @@ def print_response(response) -> None:
         print(f"Response: {response.text}")
 
 
+def _read(path) -> bytes:
+    # Sent as is: no need to decode and re-encode the JSON
+    with open(path, 'rb') as file:
+        return file.read()
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(
         description="Interact with the REST API to create, update, delete, or get dashboards.")
-    parser.add_argument('action', choices=['create', 'update', 'delete', 'get'], help="Action to perform")
+    parser.add_argument('action', choices=['create', 'update', 'delete', 'get', 'bulk-create', 'bulk-upsert',
+                                           'bulk-delete', 'export', 'import'], help="Action to perform")
     parser.add_argument(
         'json_file_path_or_id',
         nargs='?',
-        help="Path to JSON file for create/update, ID for delete/get")
+        help="Path to JSON file for create/update/bulk-* (array of dashboards), ID for delete/get, "
+             "archive (.ndjson or .ndjson.gz) for export/import")
     parser.add_argument('dashboard_id', nargs='?', help="ID of the dashboard to update/delete/get")
     parser.add_argument('-H', '--host', default=DEFAULT_HOST, help="Host of the API (default: 127.0.0.1)")
     parser.add_argument('-p', '--port', type=int, default=DEFAULT_PORT, help="Port of the API (default: 8080)")
+    parser.add_argument('--import-id', help="Id of the import to resume (default: a new one)")
+    parser.add_argument('-q', '--quiet', action='store_true', help="Only print errors")
 
     args = parser.parse_args()
 
     action = args.action.lower()
+    path_or_id = args.json_file_path_or_id
+    if (not path_or_id and action != "get") or (action == "update" and not args.dashboard_id):
+        sys.exit(1)
 
-    if action == "create":
-        if not args.json_file_path_or_id:
-            sys.exit(1)
-        with open(args.json_file_path_or_id, 'r') as file:
-            json_string = file.read()
-        create_dashboard(args.host, args.port, json_string)
-    elif action == "update":
-        if not args.json_file_path_or_id or not args.dashboard_id:
+    result: Any = None
+    with Client(f"http://{args.host}:{args.port}") as client:
+        try:
+            if action == "create":
+                result = client.create(_read(path_or_id))
+            elif action == "update":
+                result = client.update(args.dashboard_id, _read(path_or_id))
+            elif action == "delete":
+                result = client.delete(path_or_id)
+            elif action == "get":
+                result = client.get(path_or_id) if path_or_id else client.list()
+            elif action.startswith("bulk-"):
+                result = client.bulk(action[len("bulk-"):], _read(path_or_id))
+            elif action == "export":
+                client.export(path_or_id)
+            else:
+                result = client.import_archive(path_or_id, args.import_id)
+        except ApiError as e:
+            print(f"Error: {e}", file=sys.stderr)
             sys.exit(1)
-        with open(args.json_file_path_or_id, 'r') as file:
-            json_string = file.read()
-        update_dashboard(args.host, args.port, json_string, args.dashboard_id)
-    elif action == "delete":
-        if not args.json_file_path_or_id:
-            sys.exit(1)
-        delete_dashboard(args.host, args.port, args.json_file_path_or_id)
-    elif action == "get":
-        get_dashboard(args.host, args.port, args.json_file_path_or_id)
-    else:
-        sys.exit(1)
+    if not args.quiet and result is not None:
+        print(json.dumps(result, indent=2))
 
 
 if __name__ == "__main__":
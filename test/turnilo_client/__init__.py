@@ -0,0 +1,5 @@
+from turnilo_client._base import ApiError, Capabilities, RetryPolicy
+from turnilo_client.async_client import AsyncClient
+from turnilo_client.client import Client
+
+__all__ = ["ApiError", "AsyncClient", "Capabilities", "Client", "RetryPolicy"]
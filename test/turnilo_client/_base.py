@@ -0,0 +1,176 @@
+import random
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+try:
+    import orjson
+except ImportError:  # Optional: faster encoding/decoding
+    orjson = None  # type: ignore
+import json
+
+# What the sync and async clients share: everything but the I/O
+
+DEFAULT_URL = "http://127.0.0.1:8080"
+DASHBOARDS_PATH = "/rest/turnilo/dashboards/"
+OPENAPI_PATH = "/openapi.json"
+
+JSON_MEDIA_TYPE = "application/json"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+GZIP_MEDIA_TYPE = "application/gzip"
+
+# Items per bulk request (the server accepts up to BULK_MAX_ITEMS)
+DEFAULT_BULK_SIZE = 1000
+DEFAULT_ETAG_CACHE_SIZE = 1024
+# Bytes per chunk of streamed uploads/downloads
+IO_CHUNK_SIZE = 64 * 1024
+
+# A dashboard (or a list of them): decoded JSON, or JSON text that is sent as is
+Payload = Union[Dict[str, Any], List[Any], bytes, str]
+Dashboard = Dict[str, Any]
+ItemResult = Dict[str, Any]
+
+
+def dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+
+def loads(data: Union[bytes, str]) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def encode(payload: Payload) -> bytes:
+    if isinstance(payload, bytes):
+        return payload
+    if isinstance(payload, str):
+        return payload.encode()
+    return dumps(payload)
+
+
+class ApiError(Exception):
+    """
+    Error response of the API
+    """
+
+    def __init__(self, status: int, detail: Any, method: str, url: str):
+        super().__init__(f"{method} {url}: {status} {detail}")
+        self.status = status
+        self.detail = detail
+
+
+def check(status: int, body: bytes, method: str, url: str) -> None:
+    if status < 400:
+        return
+    try:
+        detail = loads(body).get("detail")
+    except (ValueError, AttributeError):
+        detail = body.decode(errors="replace")
+    raise ApiError(status, detail, method, url)
+
+
+@dataclass
+class RetryPolicy:
+    """
+    Retries of the requests that the server rejected without processing them (503,
+    load shedding), and of the idempotent ones that failed to connect. Exponential
+    backoff with full jitter, but never sooner than the server's Retry-After
+    """
+    retries: int = 5
+    backoff: float = 0.1
+    max_backoff: float = 10.0
+    statuses: Tuple[int, ...] = (503,)
+
+    def delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        if retry_after:
+            try:
+                delay = max(delay, min(self.max_backoff, float(retry_after)))
+            except ValueError:
+                pass
+        return delay
+
+
+class EtagCache:
+    """
+    Last response (and its ETag) of the most recent GETs: they are revalidated with
+    If-None-Match, and a 304 reuses the cached body. Thread-safe
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_ETAG_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Tuple[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, etag: Optional[str], value: Any) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            if etag is None:
+                self._entries.pop(key, None)
+                return
+            self._entries[key] = (etag, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+@dataclass
+class Capabilities:
+    """
+    Endpoints of the server that the clients use when available
+    """
+    bulk: bool = False
+
+    @classmethod
+    def from_openapi(cls, spec: Dict[str, Any]) -> "Capabilities":
+        return cls(bulk=DASHBOARDS_PATH + "_bulk" in spec.get("paths", {}))
+
+
+def cache_key(path: str, params: Optional[Dict[str, Any]]) -> str:
+    if not params:
+        return path
+    return path + "?" + "&".join(f"{k}={v}" for k, v in sorted(params.items()))
+
+
+def list_params(filters: Dict[str, Any]) -> Dict[str, Any]:
+    # Filters of the list endpoint (dataCube, shortName, limit, after, fields...)
+    return {k: v for k, v in filters.items() if v is not None}
+
+
+def bulk_chunks(items: Sequence[Any], size: int) -> Iterator[Tuple[int, Sequence[Any]]]:
+    for offset in range(0, len(items), size):
+        yield offset, items[offset:offset + size]
+
+
+def offset_results(results: List[ItemResult], offset: int) -> List[ItemResult]:
+    # Indexes of a chunk's results, relative to the whole list of items
+    for result in results:
+        result["index"] += offset
+    return results
+
+
+def item_result(index: int, status: int, result: Optional[str] = None, _id: Optional[int] = None,
+                detail: Any = None) -> ItemResult:
+    # Same shape as the items of a _bulk response
+    return {"index": index, "status": status, "result": result, "id": _id, "detail": detail}
+
+
+def item_error(index: int, e: ApiError) -> ItemResult:
+    return item_result(index, e.status, detail=e.detail)
+
+
+def decoded(payload: Payload) -> Dashboard:
+    # Fallbacks of the bulk operations need the fields of raw JSON items
+    return loads(payload) if isinstance(payload, (bytes, str)) else payload  # type: ignore
@@ -0,0 +1,241 @@
+import asyncio
+import logging
+import uuid
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple, Type, TypeVar, Union
+
+try:
+    import httpx
+except ImportError:  # Optional: only the sync client is available without it
+    httpx = None  # type: ignore
+
+from turnilo_client import _base
+from turnilo_client._base import ApiError, Capabilities, Dashboard, ItemResult, Payload, RetryPolicy
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Connection errors (the request may not have reached the server)
+_CONNECT_ERRORS: Tuple[Type[BaseException], ...] = (httpx.TransportError,) if httpx is not None else ()
+
+
+async def _file_chunks(path: str) -> AsyncIterator[bytes]:
+    loop = asyncio.get_running_loop()
+    with open(path, "rb") as file:
+        while True:
+            chunk = await loop.run_in_executor(None, file.read, _base.IO_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+class AsyncClient:
+    """
+    asyncio client of the dashboards API (needs httpx). At most concurrency requests
+    are in flight at once, over as many pooled keep-alive connections; the others wait
+    for their turn. Same methods as Client, as coroutines, plus get_many()
+    """
+
+    def __init__(self, base_url: str = _base.DEFAULT_URL,
+                 concurrency: int = 10,
+                 timeout: float = 30.0,
+                 retry: Optional[RetryPolicy] = None,
+                 bulk_size: int = _base.DEFAULT_BULK_SIZE,
+                 etag_cache_size: int = _base.DEFAULT_ETAG_CACHE_SIZE):
+        if httpx is None:
+            raise ImportError("AsyncClient needs httpx: pip install httpx")
+        self.base_url = base_url.rstrip("/")
+        self.retry = retry or RetryPolicy()
+        self.bulk_size = bulk_size
+        self.http = httpx.AsyncClient(
+            base_url=self.base_url, timeout=timeout,
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency))
+        self._slots = asyncio.Semaphore(concurrency)
+        self._etags = _base.EtagCache(etag_cache_size)
+        self._capabilities: Optional[Capabilities] = None
+
+    async def close(self) -> None:
+        await self.http.aclose()
+
+    async def __aenter__(self) -> "AsyncClient":
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        await self.close()
+
+    async def _send(self, method: str, path: str, params: Optional[Dict[str, Any]] = None,
+                    body: Union[bytes, Callable[[], Any], None] = None, headers: Optional[Dict[str, str]] = None,
+                    idempotent: bool = True, retry_on: Tuple[int, ...] = ()) -> "httpx.Response":
+        # body can be a function that returns a fresh body (a stream) for every attempt.
+        # A request waiting to be retried does not hold a concurrency slot
+        attempt = 0
+        while True:
+            try:
+                async with self._slots:
+                    response = await self.http.request(method, path, params=params, headers=headers,
+                                                       content=body() if callable(body) else body)
+            except _CONNECT_ERRORS:
+                if not idempotent or attempt >= self.retry.retries:
+                    raise
+                delay = self.retry.delay(attempt)
+            else:
+                if response.status_code not in self.retry.statuses + retry_on or attempt >= self.retry.retries:
+                    return response
+                delay = self.retry.delay(attempt, response.headers.get("Retry-After"))
+            logger.debug("Retrying %s %s in %.2fs", method, path, delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _call(self, method: str, path: str, **kwargs: Any) -> "httpx.Response":
+        response = await self._send(method, path, **kwargs)
+        _base.check(response.status_code, response.content, method, path)
+        return response
+
+    async def capabilities(self) -> Capabilities:
+        if self._capabilities is None:
+            response = await self._send("GET", _base.OPENAPI_PATH)
+            self._capabilities = Capabilities.from_openapi(_base.loads(response.content)) \
+                if response.status_code == 200 else Capabilities()
+        return self._capabilities
+
+    async def _gather(self, calls: Sequence[Awaitable[T]]) -> List[T]:
+        # The semaphore bounds the requests in flight
+        return list(await asyncio.gather(*calls))
+
+    # Dashboards
+
+    async def _get(self, path: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        key = _base.cache_key(path, params)
+        cached = self._etags.get(key)
+        headers = {"If-None-Match": cached[0]} if cached else None
+        response = await self._send("GET", path, params=params, headers=headers)
+        if response.status_code == 304 and cached:
+            return cached[1]
+        _base.check(response.status_code, response.content, "GET", path)
+        value = _base.loads(response.content)
+        self._etags.put(key, response.headers.get("ETag"), value)
+        return value
+
+    async def get(self, _id: int) -> Dashboard:
+        return await self._get(f"{_base.DASHBOARDS_PATH}{_id}")
+
+    async def get_many(self, ids: Sequence[int]) -> List[Dashboard]:
+        """
+        The dashboards ids, fetched concurrently
+        """
+        return await self._gather([self.get(_id) for _id in ids])
+
+    async def list(self, **filters: Any) -> List[Dashboard]:
+        return await self._get(_base.DASHBOARDS_PATH, _base.list_params(filters))
+
+    async def iter(self, **filters: Any) -> AsyncIterator[Dashboard]:
+        async with self._slots:
+            async with self.http.stream("GET", _base.DASHBOARDS_PATH, params=_base.list_params(filters),
+                                        headers={"Accept": _base.NDJSON_MEDIA_TYPE}) as response:
+                if response.status_code >= 400:
+                    _base.check(response.status_code, await response.aread(), "GET", _base.DASHBOARDS_PATH)
+                async for line in response.aiter_lines():
+                    if line:
+                        yield _base.loads(line)
+
+    async def create(self, dashboard: Payload) -> Dashboard:
+        response = await self._call("POST", _base.DASHBOARDS_PATH, body=_base.encode(dashboard),
+                                    headers={"Content-Type": _base.JSON_MEDIA_TYPE}, idempotent=False)
+        return _base.loads(response.content)
+
+    async def update(self, _id: int, dashboard: Payload, if_match: Optional[str] = None) -> Dashboard:
+        headers = {"Content-Type": _base.JSON_MEDIA_TYPE}
+        if if_match:
+            headers["If-Match"] = if_match
+        response = await self._call("PUT", f"{_base.DASHBOARDS_PATH}{_id}", body=_base.encode(dashboard),
+                                    headers=headers)
+        return _base.loads(response.content)
+
+    async def delete(self, _id: int, if_match: Optional[str] = None) -> Dashboard:
+        headers = {"If-Match": if_match} if if_match else None
+        response = await self._call("DELETE", f"{_base.DASHBOARDS_PATH}{_id}", headers=headers)
+        return _base.loads(response.content)
+
+    def etag(self, _id: int) -> Optional[str]:
+        cached = self._etags.get(f"{_base.DASHBOARDS_PATH}{_id}")
+        return cached[0] if cached else None
+
+    # Bulk operations: the chunks of bulk_size items (or, without the _bulk endpoint,
+    # the items) are sent concurrently
+
+    async def bulk(self, op: str, items: Union[Sequence[Payload], bytes, str]) -> List[ItemResult]:
+        if isinstance(items, (bytes, str)):
+            return await self._bulk_request(op, _base.encode(items))
+        chunks = list(_base.bulk_chunks(items, self.bulk_size))
+        responses = await self._gather([
+            self._bulk_request(op, b"[" + b",".join(_base.encode(item) for item in chunk) + b"]")
+            for _, chunk in chunks])
+        results: List[ItemResult] = []
+        for (offset, _), chunk_results in zip(chunks, responses):
+            results += _base.offset_results(chunk_results, offset)
+        return results
+
+    async def _bulk_request(self, op: str, body: bytes) -> List[ItemResult]:
+        response = await self._call("POST", _base.DASHBOARDS_PATH + "_bulk", params={"op": op}, body=body,
+                                    headers={"Content-Type": _base.JSON_MEDIA_TYPE},
+                                    idempotent=op != "create", retry_on=(409,) if op != "create" else ())
+        return _base.loads(response.content)
+
+    async def create_many(self, dashboards: Sequence[Payload]) -> List[ItemResult]:
+        if (await self.capabilities()).bulk:
+            return await self.bulk("create", dashboards)
+        return await self._gather([self._create_item(index, d) for index, d in enumerate(dashboards)])
+
+    async def upsert_many(self, dashboards: Sequence[Payload]) -> List[ItemResult]:
+        if (await self.capabilities()).bulk:
+            return await self.bulk("upsert", dashboards)
+        return await self._gather([self._upsert_item(index, d) for index, d in enumerate(dashboards)])
+
+    async def delete_many(self, ids: Sequence[int]) -> List[ItemResult]:
+        if (await self.capabilities()).bulk:
+            return await self.bulk("delete", [{"id": _id} for _id in ids])
+        return await self._gather([self._delete_item(index, _id) for index, _id in enumerate(ids)])
+
+    async def _create_item(self, index: int, dashboard: Payload) -> ItemResult:
+        try:
+            return _base.item_result(index, 200, "created", (await self.create(dashboard))["id"])
+        except ApiError as e:
+            return _base.item_error(index, e)
+
+    async def _upsert_item(self, index: int, dashboard: Payload) -> ItemResult:
+        fields = _base.decoded(dashboard)
+        try:
+            existing = await self.list(dataCube=fields.get("dataCube"), shortName=fields.get("shortName"),
+                                       fields="id")
+            if not existing:
+                return _base.item_result(index, 200, "created", (await self.create(dashboard))["id"])
+            await self.update(existing[0]["id"], dashboard)
+            return _base.item_result(index, 200, "updated", existing[0]["id"])
+        except ApiError as e:
+            return _base.item_error(index, e)
+
+    async def _delete_item(self, index: int, _id: int) -> ItemResult:
+        try:
+            return _base.item_result(index, 200, "deleted", (await self.delete(_id))["id"])
+        except ApiError as e:
+            return _base.item_error(index, e)
+
+    # Archives
+
+    async def export(self, path: str) -> None:
+        loop = asyncio.get_running_loop()
+        async with self._slots:
+            async with self.http.stream("GET", _base.DASHBOARDS_PATH + "_export") as response:
+                if response.status_code >= 400:
+                    _base.check(response.status_code, await response.aread(), "GET", _base.DASHBOARDS_PATH)
+                with open(path, "wb") as file:
+                    async for chunk in response.aiter_bytes(_base.IO_CHUNK_SIZE):
+                        await loop.run_in_executor(None, file.write, chunk)
+
+    async def import_archive(self, path: str, import_id: Optional[str] = None) -> Dict[str, Any]:
+        params = {"importId": import_id or uuid.uuid4().hex}
+        content_type = _base.GZIP_MEDIA_TYPE if path.endswith(".gz") else _base.NDJSON_MEDIA_TYPE
+        response = await self._call("POST", _base.DASHBOARDS_PATH + "_import", params=params,
+                                    body=lambda: _file_chunks(path), headers={"Content-Type": content_type},
+                                    retry_on=(409,))
+        return _base.loads(response.content)
@@ -0,0 +1,247 @@
+import logging
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from turnilo_client import _base
+from turnilo_client._base import ApiError, Capabilities, Dashboard, ItemResult, Payload, RetryPolicy
+
+logger = logging.getLogger(__name__)
+
+Body = Union[bytes, Iterator[bytes], None]
+
+
+def _file_chunks(path: str) -> Iterator[bytes]:
+    with open(path, "rb") as file:
+        while True:
+            chunk = file.read(_base.IO_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+class Client:
+    """
+    Sync client of the dashboards API. Connections are pooled (pool_size per host) and
+    kept alive across calls; the client is thread-safe, so threads can share it
+    """
+
+    def __init__(self, base_url: str = _base.DEFAULT_URL,
+                 pool_size: int = 10,
+                 timeout: float = 30.0,
+                 retry: Optional[RetryPolicy] = None,
+                 bulk_size: int = _base.DEFAULT_BULK_SIZE,
+                 etag_cache_size: int = _base.DEFAULT_ETAG_CACHE_SIZE):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.retry = retry or RetryPolicy()
+        self.bulk_size = bulk_size
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._etags = _base.EtagCache(etag_cache_size)
+        self._capabilities: Optional[Capabilities] = None
+
+    def close(self) -> None:
+        self.session.close()
+
+    def __enter__(self) -> "Client":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def _send(self, method: str, path: str, params: Optional[Dict[str, Any]] = None,
+              body: Union[Body, Callable[[], Body]] = None, headers: Optional[Dict[str, str]] = None,
+              idempotent: bool = True, retry_on: Tuple[int, ...] = (), stream: bool = False) -> requests.Response:
+        # body can be a function that returns a fresh body (a stream) for every attempt
+        url = self.base_url + path
+        attempt = 0
+        while True:
+            try:
+                response = self.session.request(method, url, params=params, headers=headers, stream=stream,
+                                                data=body() if callable(body) else body, timeout=self.timeout)
+            except requests.ConnectionError:
+                if not idempotent or attempt >= self.retry.retries:
+                    raise
+                delay = self.retry.delay(attempt)
+            else:
+                if response.status_code not in self.retry.statuses + retry_on or attempt >= self.retry.retries:
+                    return response
+                delay = self.retry.delay(attempt, response.headers.get("Retry-After"))
+                response.close()
+            logger.debug("Retrying %s %s in %.2fs", method, url, delay)
+            time.sleep(delay)
+            attempt += 1
+
+    def _call(self, method: str, path: str, **kwargs: Any) -> requests.Response:
+        response = self._send(method, path, **kwargs)
+        _base.check(response.status_code, response.content, method, path)
+        return response
+
+    def capabilities(self) -> Capabilities:
+        """
+        Endpoints supported by the server (from its OpenAPI spec, fetched once)
+        """
+        if self._capabilities is None:
+            response = self._send("GET", _base.OPENAPI_PATH)
+            self._capabilities = Capabilities.from_openapi(_base.loads(response.content)) \
+                if response.status_code == 200 else Capabilities()
+        return self._capabilities
+
+    # Dashboards
+
+    def _get(self, path: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        # Conditional: a 304 reuses the body cached with the ETag
+        key = _base.cache_key(path, params)
+        cached = self._etags.get(key)
+        headers = {"If-None-Match": cached[0]} if cached else None
+        response = self._send("GET", path, params=params, headers=headers)
+        if response.status_code == 304 and cached:
+            return cached[1]
+        _base.check(response.status_code, response.content, "GET", path)
+        value = _base.loads(response.content)
+        self._etags.put(key, response.headers.get("ETag"), value)
+        return value
+
+    def get(self, _id: int) -> Dashboard:
+        return self._get(f"{_base.DASHBOARDS_PATH}{_id}")
+
+    def list(self, **filters: Any) -> List[Dashboard]:
+        """
+        Dashboards matching the filters of the list endpoint (dataCube, shortName,
+        limit, after, fields...)
+        """
+        return self._get(_base.DASHBOARDS_PATH, _base.list_params(filters))
+
+    def iter(self, **filters: Any) -> Iterator[Dashboard]:
+        """
+        Like list(), streamed (NDJSON): memory usage does not depend on the result size
+        """
+        response = self._call("GET", _base.DASHBOARDS_PATH, params=_base.list_params(filters),
+                              headers={"Accept": _base.NDJSON_MEDIA_TYPE}, stream=True)
+        with response:
+            for line in response.iter_lines(chunk_size=_base.IO_CHUNK_SIZE):
+                if line:
+                    yield _base.loads(line)
+
+    def create(self, dashboard: Payload) -> Dashboard:
+        response = self._call("POST", _base.DASHBOARDS_PATH, body=_base.encode(dashboard),
+                              headers={"Content-Type": _base.JSON_MEDIA_TYPE}, idempotent=False)
+        return _base.loads(response.content)
+
+    def update(self, _id: int, dashboard: Payload, if_match: Optional[str] = None) -> Dashboard:
+        """
+        With if_match (an ETag), fails with a 412 ApiError if the dashboard changed
+        """
+        headers = {"Content-Type": _base.JSON_MEDIA_TYPE}
+        if if_match:
+            headers["If-Match"] = if_match
+        response = self._call("PUT", f"{_base.DASHBOARDS_PATH}{_id}", body=_base.encode(dashboard), headers=headers)
+        return _base.loads(response.content)
+
+    def delete(self, _id: int, if_match: Optional[str] = None) -> Dashboard:
+        headers = {"If-Match": if_match} if if_match else None
+        response = self._call("DELETE", f"{_base.DASHBOARDS_PATH}{_id}", headers=headers)
+        return _base.loads(response.content)
+
+    def etag(self, _id: int) -> Optional[str]:
+        """
+        ETag of the last version of the dashboard that get() returned
+        """
+        cached = self._etags.get(f"{_base.DASHBOARDS_PATH}{_id}")
+        return cached[0] if cached else None
+
+    # Bulk operations: on the _bulk endpoint if the server has it, one request per item
+    # otherwise. Both return the result of each item, in order
+
+    def bulk(self, op: str, items: Union[Sequence[Payload], bytes, str]) -> List[ItemResult]:
+        """
+        op (create, upsert or delete) on the items, in requests of bulk_size items. JSON
+        text (an array) is sent as is, in a single request
+        """
+        if isinstance(items, (bytes, str)):
+            return self._bulk_request(op, _base.encode(items))
+        results: List[ItemResult] = []
+        for offset, chunk in _base.bulk_chunks(items, self.bulk_size):
+            body = b"[" + b",".join(_base.encode(item) for item in chunk) + b"]"
+            results += _base.offset_results(self._bulk_request(op, body), offset)
+        return results
+
+    def _bulk_request(self, op: str, body: bytes) -> List[ItemResult]:
+        # Creates are not idempotent; upserts and deletes are, and a 409 (concurrent
+        # modification) rolled the whole request back
+        response = self._call("POST", _base.DASHBOARDS_PATH + "_bulk", params={"op": op}, body=body,
+                              headers={"Content-Type": _base.JSON_MEDIA_TYPE},
+                              idempotent=op != "create", retry_on=(409,) if op != "create" else ())
+        return _base.loads(response.content)
+
+    def create_many(self, dashboards: Sequence[Payload]) -> List[ItemResult]:
+        if self.capabilities().bulk:
+            return self.bulk("create", dashboards)
+        return [self._create_item(index, d) for index, d in enumerate(dashboards)]
+
+    def upsert_many(self, dashboards: Sequence[Payload]) -> List[ItemResult]:
+        """
+        Updates the dashboards that exist (by dataCube+shortName), creates the others
+        """
+        if self.capabilities().bulk:
+            return self.bulk("upsert", dashboards)
+        return [self._upsert_item(index, d) for index, d in enumerate(dashboards)]
+
+    def delete_many(self, ids: Sequence[int]) -> List[ItemResult]:
+        if self.capabilities().bulk:
+            return self.bulk("delete", [{"id": _id} for _id in ids])
+        return [self._delete_item(index, _id) for index, _id in enumerate(ids)]
+
+    def _create_item(self, index: int, dashboard: Payload) -> ItemResult:
+        try:
+            return _base.item_result(index, 200, "created", self.create(dashboard)["id"])
+        except ApiError as e:
+            return _base.item_error(index, e)
+
+    def _upsert_item(self, index: int, dashboard: Payload) -> ItemResult:
+        fields = _base.decoded(dashboard)
+        try:
+            existing = self.list(dataCube=fields.get("dataCube"), shortName=fields.get("shortName"), fields="id")
+            if not existing:
+                return _base.item_result(index, 200, "created", self.create(dashboard)["id"])
+            self.update(existing[0]["id"], dashboard)
+            return _base.item_result(index, 200, "updated", existing[0]["id"])
+        except ApiError as e:
+            return _base.item_error(index, e)
+
+    def _delete_item(self, index: int, _id: int) -> ItemResult:
+        try:
+            return _base.item_result(index, 200, "deleted", self.delete(_id)["id"])
+        except ApiError as e:
+            return _base.item_error(index, e)
+
+    # Archives
+
+    def export(self, path: str) -> None:
+        """
+        Writes all dashboards to path, as a gzip'd NDJSON archive (streamed)
+        """
+        response = self._call("GET", _base.DASHBOARDS_PATH + "_export", stream=True)
+        with response, open(path, "wb") as file:
+            for chunk in response.iter_content(chunk_size=_base.IO_CHUNK_SIZE):
+                file.write(chunk)
+
+    def import_archive(self, path: str, import_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Imports an archive (.ndjson, or .ndjson.gz) made by export(). Failed attempts
+        are retried with the same import id, which resumes after the lines that the
+        server already committed
+        """
+        # The server would make one up, but retries need to know it beforehand
+        params = {"importId": import_id or uuid.uuid4().hex}
+        content_type = _base.GZIP_MEDIA_TYPE if path.endswith(".gz") else _base.NDJSON_MEDIA_TYPE
+        response = self._call("POST", _base.DASHBOARDS_PATH + "_import", params=params,
+                              body=lambda: _file_chunks(path), headers={"Content-Type": content_type},
+                              retry_on=(409,))
+        return _base.loads(response.content)
@@ -1,18 +1,53 @@
+import asyncio
+import concurrent.futures
+import datetime
+import gzip
+import http.server
 import threading
 import time
 import json
 import signal
 import pytest
+import requests
+from contextlib import contextmanager
+from sqlalchemy import URL, event, func, insert, inspect
 
 import uvicorn
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
+from pydantic import TypeAdapter
 
-# REST API routes
-from routes import routes
+# REST API
+from main import app
 
 # Python Client (test it too)
 from client import create_dashboard, get_dashboard, update_dashboard, delete_dashboard
-from typing import Generator, Any
+from client import bulk_create, bulk_upsert, bulk_delete
+from client import export_dashboards, import_dashboards
+from turnilo_client import ApiError, AsyncClient, Capabilities, Client, RetryPolicy
+from services.cache import DashboardCache, dashboard_cache, invalidation_handler
+from services import change_feed
+from services import turnilo_dashboards as td
+from services import search as search_service
+from services import payloads
+from services import metrics
+from services import health
+from services import group_commit
+from services import watch
+from services import hash_store
+from middleware.admission import AdmissionMiddleware
+from models.turnilo_dashboard import TurniloDashboard
+from models.turnilo_dashboard_change import TurniloDashboardChange
+from models.turnilo_dashboard_hash import TurniloDashboardHash
+from models.turnilo_dashboard_revision import TurniloDashboardRevision
+from sqlmodel import Session, select
+import data.engine_config as engine_config
+import data.database as db
+import data.migrations as migrations
+from data.migrations import v0007_hash_store
+import data.shards as shards
+import constants
+from typing import Generator, Any, Dict, Iterator, List, Optional, Tuple
 
 HOST = "127.0.0.1"
 PORT = 8080
@@ -30,13 +65,20 @@ def sample_dashboard() -> dict[str, str]:
 
 @pytest.fixture(scope="session", autouse=True)
 def rest_server() -> Generator[None, Any, None]:
-    app = FastAPI()
-    app.include_router(routes.api_router)
     c = uvicorn.Config(app, host=HOST, port=PORT)
     server = uvicorn.Server(c)
     t = threading.Thread(target=server.run)
     t.start()
-    time.sleep(3)
+    # Ready once the lifespan (schema initialization) has run
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            if requests.get(f"http://{HOST}:{PORT}/health/ready").status_code == 200:
+                break
+        except requests.ConnectionError:
+            pass
+        assert time.monotonic() < deadline, "The server did not become ready"
+        time.sleep(0.01)
     yield
     server.handle_exit(signal.SIGINT, None)
     t.join()
@@ -106,6 +148,48 @@ def test_get_all_dashboards(sample_dashboard: dict[str, Any]) -> None:
     assert res.status_code == 200
 
 
+def test_list_serialization_contract(sample_dashboard: dict[str, Any]) -> None:
+    # Lists are encoded from the DB rows with orjson, skipping the response_model: the
+    # schema and the bodies are the ones of the response_model path
+    path = constants.URL_PATH + "/turnilo/dashboards/"
+    reference = FastAPI()
+
+    @reference.get(path, response_model=List[TurniloDashboard])
+    async def turnilo_get_dashboards() -> Any:
+        return []
+
+    def list_schema(openapi: dict[str, Any]) -> dict[str, Any]:
+        schema = openapi["paths"][path]["get"]["responses"]["200"]["content"]["application/json"]["schema"]
+        items = openapi["components"]["schemas"][schema["items"]["$ref"].split("/")[-1]]
+        return dict(schema, items=items)
+    assert list_schema(requests.get(f"http://{HOST}:{PORT}/openapi.json").json()) == list_schema(reference.openapi())
+
+    # None, missing and non-ASCII values
+    dashboards = [dict(sample_dashboard, shortName="a", name="Tráfico ✓", description=None, preset=None),
+                  dict(sample_dashboard, shortName="b")]
+    dashboards[1].pop("description", None)
+    res = bulk_create(HOST, PORT, json.dumps(dashboards))
+    assert [item["status"] for item in res.json()] == [200, 200]
+    with Session(db.engine) as session:
+        stored = session.exec(select(TurniloDashboard).order_by(TurniloDashboard.id)).all()  # type: ignore
+        hash_store.resolve(session, stored)
+        expected = TypeAdapter(List[TurniloDashboard]).dump_json(list(stored))
+    url = f"http://{HOST}:{PORT}{path}"
+    for params in [{}, {"limit": 10}, {"dataCubePrefix": "network"}]:
+        res = requests.get(url, params=params)
+        assert res.json() == json.loads(expected), params
+    res = requests.get(url, headers={"Accept": "application/x-ndjson"})
+    assert [json.loads(line) for line in res.text.splitlines()] == json.loads(expected)
+
+    # Datetimes (the DB returns them naive) and None, as pydantic serializes them
+    row = {"createdAt": datetime.datetime(2024, 5, 1, 12, 30, 15, 123456), "updatedAt": None}
+    assert ORJSONResponse(row).body == TypeAdapter(Dict[str, Optional[datetime.datetime]]).dump_json(row)
+
+    # Cleanup
+    res = bulk_delete(HOST, PORT, json.dumps([{"id": d["id"]} for d in json.loads(expected)]))
+    assert all(item["status"] == 200 for item in res.json())
+
+
 def test_get_all_dashboards_query_params(sample_dashboard: dict[str, Any]) -> None:
     res = get_dashboard(HOST, PORT)
     assert res.json() == []
@@ -223,6 +307,1409 @@ def test_get_all_dashboards_query_params(sample_dashboard: dict[str, Any]) -> No
     assert res.status_code == 200
 
 
+def test_get_all_dashboards_pagination(sample_dashboard: dict[str, Any]) -> None:
+    for i in range(5):
+        dashboard = sample_dashboard.copy()
+        dashboard["shortName"] = f"dashboard_{i}"
+        res = create_dashboard(HOST, PORT, json.dumps(dashboard))
+        assert res.json()["id"] == i + 1
+    dashboard = sample_dashboard.copy()
+    dashboard["dataCube"] = "myDatacube"
+    res = create_dashboard(HOST, PORT, json.dumps(dashboard))
+    assert res.json()["id"] == 6
+
+    # Invalid params
+    res = get_dashboard(HOST, PORT, limit=-1)
+    assert res.status_code == 400
+    res = get_dashboard(HOST, PORT, limit=100000)
+    assert res.status_code == 400
+    res = get_dashboard(HOST, PORT, after="1;2")
+    assert res.status_code == 400
+    # Not an id: out of range of the id column, non-ASCII digits
+    for after in ["1" * 30, str(2 ** 31), "²", "١٢"]:
+        res = get_dashboard(HOST, PORT, after=after)
+        assert res.status_code == 400, after
+        res = requests.get(f"http://{HOST}:{PORT}/rest/turnilo/dashboards/", params={"after": after},
+                           headers={"Accept": "application/x-ndjson"})
+        assert res.status_code == 400, after
+    after = td.GetQueryParams(orderBy="name").cursor({"id": 10 ** 30, "name": "x"})
+    assert get_dashboard(HOST, PORT, orderBy="name", after=after).status_code == 400
+
+    # Walk all pages
+    ids = []
+    cursor = None
+    pages = 0
+    while True:
+        res = get_dashboard(HOST, PORT, limit=2, after=cursor)
+        assert res.status_code == 200
+        assert len(res.json()) <= 2
+        ids += [dash["id"] for dash in res.json()]
+        pages += 1
+        cursor = res.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert ids == [1, 2, 3, 4, 5, 6]
+    assert pages == 3
+
+    # Pagination + filters
+    res = get_dashboard(HOST, PORT, dataCube="networkFlows", limit=3, after="2")
+    assert [dash["id"] for dash in res.json()] == [3, 4, 5]
+    assert "X-Next-Cursor" not in res.headers
+
+    # Streamed NDJSON
+    url = f"http://{HOST}:{PORT}/rest/turnilo/dashboards/"
+    res = requests.get(url, headers={"Accept": "application/x-ndjson"})
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in res.text.splitlines()]
+    assert [dash["id"] for dash in lines] == [1, 2, 3, 4, 5, 6]
+    assert lines == get_dashboard(HOST, PORT).json()
+
+    res = requests.get(url, params={"dataCube": "networkFlows", "after": "1", "limit": "3"},
+                       headers={"Accept": "application/x-ndjson"})
+    assert [json.loads(line)["id"] for line in res.text.splitlines()] == [2, 3, 4]
+
+    # Cleanup
+    for i in range(6):
+        res = delete_dashboard(HOST, PORT, i + 1)
+        assert res.status_code == 200
+
+
+def test_get_all_dashboards_filters(sample_dashboard: dict[str, Any]) -> None:
+    dashboards = []
+    for dataCube, shortName, name, preset in [("networkFlows", "dash_a", "Zeta", True),
+                                              ("networkFlows", "dash_b", "Alpha", False),
+                                              ("networkEvents", "dash_c", "Mu", True),
+                                              ("myDatacube", "other", "Alpha", False)]:
+        dashboards.append(dict(sample_dashboard, dataCube=dataCube, shortName=shortName, name=name, preset=preset))
+    res = bulk_create(HOST, PORT, json.dumps(dashboards))
+    assert [item["id"] for item in res.json()] == [1, 2, 3, 4]
+
+    def ids(**params: Any) -> List[int]:
+        res = get_dashboard(HOST, PORT, **params)
+        assert res.status_code == 200
+        return [dash["id"] for dash in res.json()]
+
+    assert ids(dataCubePrefix="network") == [1, 2, 3]
+    assert ids(dataCubePrefix="network", shortNamePrefix="dash_") == [1, 2, 3]
+    assert ids(shortNamePrefix="dash") == [1, 2, 3]
+    assert ids(dataCubeIn="networkEvents,myDatacube") == [3, 4]
+    assert ids(shortNameIn="dash_a,other,missing") == [1, 4]
+    assert ids(preset="true") == [1, 3]
+    assert ids(preset="false", dataCube="networkFlows") == [2]
+    assert ids(orderBy="name") == [2, 4, 3, 1]
+    assert ids(orderBy="name", dataCubePrefix="network") == [2, 3, 1]
+
+    # Keyset pagination on name (opaque cursor)
+    res = get_dashboard(HOST, PORT, orderBy="name", limit=3)
+    assert [dash["id"] for dash in res.json()] == [2, 4, 3]
+    cursor = res.headers["X-Next-Cursor"]
+    res = get_dashboard(HOST, PORT, orderBy="name", limit=3, after=cursor)
+    assert [dash["id"] for dash in res.json()] == [1]
+    assert "X-Next-Cursor" not in res.headers
+    url = f"http://{HOST}:{PORT}/rest/turnilo/dashboards/"
+    res = requests.get(url, params={"orderBy": "name", "after": cursor}, headers={"Accept": "application/x-ndjson"})
+    assert [json.loads(line)["id"] for line in res.text.splitlines()] == [1]
+
+    # Projection
+    res = get_dashboard(HOST, PORT, fields="shortName", dataCube="networkFlows")
+    assert res.json() == [{"id": 1, "shortName": "dash_a"}, {"id": 2, "shortName": "dash_b"}]
+    res = get_dashboard(HOST, PORT, fields="name,preset", orderBy="name", limit=1)
+    assert res.json() == [{"id": 2, "name": "Alpha", "preset": False}]
+    res = requests.get(url, params={"fields": "dataCube"}, headers={"Accept": "application/x-ndjson"})
+    assert json.loads(res.text.splitlines()[0]) == {"id": 1, "dataCube": "networkFlows"}
+
+    # Invalid params
+    for params in [{"dataCubePrefix": "a%"}, {"shortNameIn": "a,b;c"}, {"shortNameIn": ","}, {"orderBy": "hash"},
+                   {"fields": "id,secret"}, {"orderBy": "name", "after": "2"}, {"preset": "maybe"}]:
+        res = get_dashboard(HOST, PORT, **params)
+        assert res.status_code in (400, 422), params
+
+    # Every supported query shape uses an index, in sort key order: keyset pages are not
+    # sorted (with every matching row)
+    after_name = td.GetQueryParams(orderBy="name").cursor({"id": 1, "name": "x"})
+    shapes: List[dict[str, Any]] = [
+        {"dataCube": "a"}, {"shortName": "a"}, {"dataCubePrefix": "a"}, {"shortNamePrefix": "a"},
+        {"dataCubeIn": "a,b"}, {"shortNameIn": "a,b"}, {"preset": True}, {"preset": False},
+        {"preset": True, "dataCubePrefix": "a"}, {"orderBy": "name"}, {"orderBy": "name", "after": after_name},
+        {"fields": "name", "dataCube": "a", "shortNamePrefix": "a"}, {"after": "1"},
+        {"dataCube": "a", "after": "1"}, {"dataCube": "a", "preset": True}, {"dataCubeIn": "a,b", "after": "1"},
+        {"shortNamePrefix": "a", "preset": False, "after": "1"}, {"shortName": "a", "dataCubePrefix": "a"}]
+    with Session(db.read_engine) as session:
+        for shape in shapes:
+            query_params = td.GetQueryParams(**shape)
+            query_params.validate()
+            statement = td._dashboards_get_chunk_select(session, query_params, query_params.after_key(), 10)
+            sql = str(statement.compile(dialect=db.read_engine.dialect, compile_kwargs={"literal_binds": True}))
+            plan = [row[3] for row in session.connection().exec_driver_sql("EXPLAIN QUERY PLAN " + sql)]
+            assert all("USING" in step for step in plan if step.startswith(("SCAN", "SEARCH"))), (shape, plan)
+            assert not any("TEMP B-TREE" in step for step in plan), (shape, plan)
+
+    # Cleanup
+    res = bulk_delete(HOST, PORT, json.dumps([{"id": i} for i in range(1, 5)]))
+    assert all(item["status"] == 200 for item in res.json())
+
+
+def test_search(sample_dashboard: dict[str, Any]) -> None:
+    url = f"http://{HOST}:{PORT}/rest/turnilo/dashboards/_search"
+    dashboards = [dict(sample_dashboard, shortName="a", name="Top talkers", description="Traffic by country"),
+                  dict(sample_dashboard, shortName="b", name="Country overview", description="Top ASNs"),
+                  dict(sample_dashboard, shortName="c", name="Latency", description=None)]
+    res = bulk_create(HOST, PORT, json.dumps(dashboards))
+    assert [item["id"] for item in res.json()] == [1, 2, 3]
+
+    def search(q: str, **params: Any) -> List[int]:
+        res = requests.get(url, params={"q": q, **params})
+        assert res.status_code == 200
+        return [dash["id"] for dash in res.json()]
+
+    # Name matches rank higher; every word must match; the last one is a prefix
+    assert search("country") == [2, 1]
+    assert search("top") == [1, 2]
+    assert search("TOP country") == [2, 1]
+    assert search("top lat") == []
+    assert search("lat") == [3]
+    assert search("country", limit=1) == [2]
+    assert requests.get(url, params={"q": "country"}).json()[0]["shortName"] == "b"
+
+    # Kept in sync with every write path
+    res = update_dashboard(HOST, PORT, json.dumps(dict(dashboards[2], description="Country latency")), 3)
+    assert res.status_code == 200
+    assert search("country") == [2, 3, 1]
+    res = delete_dashboard(HOST, PORT, 2)
+    assert res.status_code == 200
+    assert search("country") == [3, 1]
+    res = bulk_upsert(HOST, PORT, json.dumps([dict(dashboards[0], name="Bytes")]))
+    assert res.json()[0]["id"] == 1
+    assert search("talkers") == []
+    assert search("bytes") == [1]
+
+    # In-process index (engines without full-text search)
+    index = search_service.InvertedIndex()
+    with Session(db.read_engine) as session:
+        assert index.search(session, ["country"], 10) == [3, 1]
+        assert index.search(session, ["byt"], 10) == [1]
+        res = update_dashboard(HOST, PORT, json.dumps(dict(dashboards[2], name="Bytes by country")), 3)
+        assert res.status_code == 200
+        assert index.search(session, ["country"], 10) == [3, 1]
+        assert index.search(session, ["bytes"], 10) == [1, 3]
+        assert len(index) == 2
+
+    # Invalid params
+    invalid: List[dict[str, Any]] = [{"q": ""}, {"q": "%$"}, {"q": "x" * 300}, {"q": "top", "limit": 0}]
+    for params in invalid:
+        assert requests.get(url, params=params).status_code == 400, params
+
+    # Cleanup
+    res = bulk_delete(HOST, PORT, json.dumps([{"id": 1}, {"id": 3}]))
+    assert all(item["status"] == 200 for item in res.json())
+
+
+def test_cache(sample_dashboard: dict[str, Any]) -> None:
+    url = f"http://{HOST}:{PORT}/rest/turnilo/cache/stats"
+    dashboard = sample_dashboard.copy()
+    res = create_dashboard(HOST, PORT, json.dumps(dashboard))
+    assert res.status_code == 200
+    dashboard = res.json()
+
+    # Reads by id: first one populates the cache
+    get_dashboard(HOST, PORT, 1)
+    stats = requests.get(url).json()
+    res = get_dashboard(HOST, PORT, 1)
+    assert res.json() == dashboard
+    after = requests.get(url).json()
+    assert after["hits"] == stats["hits"] + 1
+    assert after["misses"] == stats["misses"]
+
+    # Reads by query params
+    get_dashboard(HOST, PORT, dataCube="networkFlows")
+    stats = requests.get(url).json()
+    res = get_dashboard(HOST, PORT, dataCube="networkFlows")
+    assert res.json() == [dashboard]
+    assert requests.get(url).json()["hits"] == stats["hits"] + 1
+
+    # Writes invalidate: moving the dashboard to another dataCube must
+    # update both the old and the new query results
+    get_dashboard(HOST, PORT, dataCube="myDatacube")
+    dashboard["dataCube"] = "myDatacube"
+    res = update_dashboard(HOST, PORT, json.dumps(dashboard), 1)
+    assert res.status_code == 200
+    assert get_dashboard(HOST, PORT, 1).json() == dashboard
+    assert get_dashboard(HOST, PORT, dataCube="networkFlows").json() == []
+    assert get_dashboard(HOST, PORT, dataCube="myDatacube").json() == [dashboard]
+    assert get_dashboard(HOST, PORT).json() == [dashboard]
+
+    # Cleanup
+    res = delete_dashboard(HOST, PORT, 1)
+    assert res.status_code == 200
+    assert get_dashboard(HOST, PORT, 1).status_code == 404
+    assert get_dashboard(HOST, PORT, dataCube="myDatacube").json() == []
+    assert get_dashboard(HOST, PORT).json() == []
+
+
+def test_payload_cache(sample_dashboard: dict[str, Any]) -> None:
+    url = f"http://{HOST}:{PORT}/rest/turnilo/dashboards/"
+    dashboards = [dict(sample_dashboard, shortName=f"dashboard_{i}", description="Long description " * 20)
+                  for i in range(5)]
+    res = bulk_create(HOST, PORT, json.dumps(dashboards))
+    assert [item["id"] for item in res.json()] == [1, 2, 3, 4, 5]
+
+    # Content negotiation
+    identity = requests.get(url, headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in identity.headers
+    assert identity.headers["Vary"] == "Accept-Encoding"
+    assert [dash["id"] for dash in identity.json()] == [1, 2, 3, 4, 5]
+    gzipped = requests.get(url, headers={"Accept-Encoding": "gzip"})
+    assert gzipped.headers["Content-Encoding"] == "gzip"
+    assert int(gzipped.headers["Content-Length"]) < int(identity.headers["Content-Length"])
+    assert gzipped.json() == identity.json()
+    assert gzipped.headers["ETag"] != identity.headers["ETag"]
+    res = requests.get(url, headers={"Accept-Encoding": "br;q=1, gzip;q=0.5"})
+    assert res.headers["Content-Encoding"] == ("br" if payloads.brotli else "gzip")
+    assert res.json() == identity.json()
+    res = requests.get(url, headers={"Accept-Encoding": "gzip;q=0, *;q=0"})
+    assert "Content-Encoding" not in res.headers
+
+    # Small bodies are not compressed
+    res = requests.get(url, params={"shortName": "dashboard_0"}, headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in res.headers
+    assert [dash["id"] for dash in res.json()] == [1]
+
+    # Served from the cache until a write changes it
+    res = requests.get(url, headers={"Accept-Encoding": "gzip", "If-None-Match": gzipped.headers["ETag"]})
+    assert res.status_code == 304
+    stats = dashboard_cache.stats()
+    res = requests.get(url, headers={"Accept-Encoding": "gzip"})
+    assert res.content == gzipped.content
+    assert dashboard_cache.stats()["hits"] == stats["hits"] + 1
+    res = update_dashboard(HOST, PORT, json.dumps(dict(dashboards[0], name="Renamed")), 1)
+    assert res.status_code == 200
+    res = requests.get(url, headers={"Accept-Encoding": "gzip", "If-None-Match": gzipped.headers["ETag"]})
+    assert res.status_code == 200
+    assert res.json()[0]["name"] == "Renamed"
+
+    assert payloads.negotiate("gzip, deflate", 10000) == "gzip"
+    assert payloads.negotiate("gzip;q=0.5, br", 10000) == ("br" if payloads.brotli else "gzip")
+    assert payloads.negotiate("identity", 10000) is None
+    assert payloads.negotiate("gzip", 10) is None
+    assert payloads.negotiate(None, 10000) is None
+
+    # Concurrent builds of the same payload: a single one runs
+    async def concurrent_builds() -> List[int]:
+        builds = []
+
+        async def build() -> int:
+            builds.append(1)
+            await asyncio.sleep(0.05)
+            return len(builds)
+
+        flights = payloads.SingleFlight()
+        return await asyncio.gather(*[flights.do("key", build) for _ in range(10)])
+    assert asyncio.run(concurrent_builds()) == [1] * 10
+
+    # The caller running the build is cancelled (its client went away): the callers
+    # waiting for it still get the payload, built again by one of them
+    async def cancelled_build() -> Tuple[List[int], int]:
+        builds = []
+
+        async def build() -> int:
+            builds.append(1)
+            await asyncio.sleep(0.05)
+            return len(builds)
+
+        flights = payloads.SingleFlight()
+        leader = asyncio.create_task(flights.do("key", build))
+        await asyncio.sleep(0.01)
+        waiters = [asyncio.create_task(flights.do("key", build)) for _ in range(5)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await asyncio.gather(*waiters), len(builds)
+    assert asyncio.run(cancelled_build()) == ([2] * 5, 2)
+
+    # Cleanup
+    res = bulk_delete(HOST, PORT, json.dumps([{"id": i} for i in range(1, 6)]))
+    assert all(item["status"] == 200 for item in res.json())
+
+
+def test_cache_lru_ttl() -> None:
+    cache = DashboardCache(max_entries=2, ttl=60)
+    cache.put(("id", 1), "a", [1], cache.generation)
+    cache.put(("id", 2), "b", [2], cache.generation)
+    assert cache.get(("id", 1)) == "a"
+    # ("id", 2) is the least recently used
+    cache.put(("list", None, None), ["a", "c"], [1, 3], cache.generation)
+    assert cache.get(("id", 2)) is None
+    assert cache.stats()["evictions"] == 1
+
+    # Writes to dashboard 3 only drop the entries containing it
+    cache.invalidate_dashboard(3, "dc", "sn")
+    assert cache.get(("list", None, None)) is None
+    assert cache.get(("id", 1)) == "a"
+
+    # Populating with a stale generation is a no-op
+    generation = cache.generation
+    cache.invalidate_dashboard(1, "dc", "sn")
+    cache.put(("id", 1), "a", [1], generation)
+    assert cache.get(("id", 1)) is None
+
+    cache = DashboardCache(max_entries=2, ttl=0)
+    cache.put(("id", 1), "a", [1], cache.generation)
+    assert cache.get(("id", 1)) is None
+    assert cache.stats()["expirations"] == 1
+
+
+def _wait_for(condition, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_change_feed_replicas(sample_dashboard: dict[str, Any]) -> None:
+    # Replica A is the REST server of this process (dashboard_cache). Replica B shares
+    # the same DB, with its own cache
+    cache_b = DashboardCache(max_entries=16, ttl=60)
+    listener_a = change_feed.ChangeFeedListener(
+        db.engine, [invalidation_handler(dashboard_cache, change_feed.replica_id)], poll_interval=0.02)
+    listener_b = change_feed.ChangeFeedListener(
+        db.engine, [invalidation_handler(cache_b, lambda: "replica-b")], poll_interval=0.02)
+    listener_a.start()
+    listener_b.start()
+    try:
+        dashboard = sample_dashboard.copy()
+        res = create_dashboard(HOST, PORT, json.dumps(dashboard))
+        dashboard = res.json()
+
+        # A writes: B's cached entries for the dashboard are dropped
+        cache_b.put(("id", 1), "stale", [1], cache_b.generation)
+        cache_b.put(("list", None, None), ["stale"], [1], cache_b.generation)
+        cache_b.put(("id", 2), "other", [2], cache_b.generation)
+        dashboard["name"] = "Updated by A"
+        res = update_dashboard(HOST, PORT, json.dumps(dashboard), 1)
+        assert res.status_code == 200
+        assert _wait_for(lambda: cache_b.get(("id", 1)) is None)
+        assert cache_b.get(("list", None, None)) is None
+        assert cache_b.get(("id", 2)) == "other"
+
+        # B writes: A (REST) must stop serving its cached copy
+        assert get_dashboard(HOST, PORT, 1).json()["name"] == "Updated by A"
+        assert get_dashboard(HOST, PORT, 1).json()["name"] == "Updated by A"
+        with Session(db.engine) as session:
+            row = session.get(TurniloDashboard, 1)
+            assert row is not None
+            row.name = "Updated by B"
+            session.add(row)
+            change_feed.publish(session, change_feed.OP_UPDATE, row, origin="replica-b")
+            session.commit()
+        assert _wait_for(lambda: get_dashboard(HOST, PORT, 1).json()["name"] == "Updated by B")
+
+        # The change log is monotonic. The app's own listener (woken up by the commit) can
+        # invalidate A's cache before listener_a polls
+        assert _wait_for(lambda: listener_b.last_seq is not None and listener_a.last_seq == listener_b.last_seq)
+    finally:
+        listener_a.stop()
+        listener_b.stop()
+
+    # Cleanup
+    res = delete_dashboard(HOST, PORT, 1)
+    assert res.status_code == 200
+
+
+def test_change_feed_read_replica(tmp_path: Any) -> None:
+    # With a read replica, changes (the local ones too) are applied once the replica has
+    # them: a cache filled from the replica is not invalidated before it has the new rows
+    primary, replica = (engine_config.make_engine(URL.create("sqlite", database=str(tmp_path / f"{name}.db")))
+                        for name in ("primary", "replica"))
+    cache = DashboardCache(max_entries=16, ttl=60)
+    listener = change_feed.ChangeFeedListener(primary, [invalidation_handler(cache, None)], read_engine=replica)
+    try:
+        for engine in (primary, replica):
+            migrations.migrate(engine)
+        listener.last_seq = 0
+        with Session(primary) as session:
+            change_feed.publish_many(session, [(change_feed.OP_UPDATE, 1, "c", "s")], origin=change_feed.replica_id())
+            session.commit()
+        cache.put(("id", 1), "old", [1], cache.generation)
+        assert listener.poll_once() == 0
+        assert cache.get(("id", 1)) == "old"
+
+        # Replicated
+        with primary.connect() as source, replica.begin() as target:
+            rows = source.execute(TurniloDashboardChange.__table__.select()).mappings().all()  # type: ignore
+            target.execute(insert(TurniloDashboardChange), [dict(row) for row in rows])
+        assert listener.poll_once() == 1
+        assert cache.get(("id", 1)) is None
+    finally:
+        primary.dispose()
+        replica.dispose()
+
+
+def test_etags(sample_dashboard: dict[str, Any]) -> None:
+    url = f"http://{HOST}:{PORT}/rest/turnilo/dashboards/"
+    res = create_dashboard(HOST, PORT, json.dumps(sample_dashboard))
+    assert res.status_code == 200
+    dashboard = res.json()
+    etag = res.headers["ETag"]
+
+    # Conditional GET by id
+    res = requests.get(url + "1")
+    assert res.headers["ETag"] == etag
+    res = requests.get(url + "1", headers={"If-None-Match": etag})
+    assert res.status_code == 304
+    assert res.headers["ETag"] == etag
+    res = requests.get(url + "1", headers={"If-None-Match": '"other", W/' + etag})
+    assert res.status_code == 304
+    res = requests.get(url + "1", headers={"If-None-Match": '"other"'})
+    assert res.status_code == 200
+
+    # Conditional GET of the list
+    res = requests.get(url)
+    list_etag = res.headers["ETag"]
+    res = requests.get(url, headers={"If-None-Match": list_etag})
+    assert res.status_code == 304
+    res = requests.get(url, params={"dataCube": "networkFlows"}, headers={"If-None-Match": list_etag})
+    assert res.status_code == 200
+
+    # If-Match on PUT
+    dashboard["name"] = "Renamed"
+    res = requests.put(url + "1", json=dashboard, headers={"If-Match": '"other"'})
+    assert res.status_code == 412
+    res = requests.put(url + "1", json=dashboard, headers={"If-Match": "W/" + etag})
+    assert res.status_code == 412
+    res = requests.put(url + "99", json=dashboard, headers={"If-Match": etag})
+    assert res.status_code == 404
+    res = requests.put(url + "1", json=dashboard, headers={"If-Match": etag})
+    assert res.status_code == 200
+    assert res.headers["ETag"] != etag
+    new_etag = res.headers["ETag"]
+
+    # Writes change the ETags
+    res = requests.get(url + "1", headers={"If-None-Match": etag})
+    assert res.status_code == 200
+    assert res.json()["name"] == "Renamed"
+    res = requests.get(url, headers={"If-None-Match": list_etag})
+    assert res.status_code == 200
+    assert res.headers["ETag"] != list_etag
+
+    # If-Match on DELETE
+    res = requests.delete(url + "1", headers={"If-Match": etag})
+    assert res.status_code == 412
+    res = requests.delete(url + "1", headers={"If-Match": new_etag})
+    assert res.status_code == 200
+    res = requests.delete(url + "1", headers={"If-Match": "*"})
+    assert res.status_code == 404
+
+
+def test_if_match_concurrent(sample_dashboard: dict[str, Any]) -> None:
+    # Writers with the same If-Match: only one of them wins, every round
+    url = f"http://{HOST}:{PORT}/rest/turnilo/dashboards/"
+    res = create_dashboard(HOST, PORT, json.dumps(dict(sample_dashboard, shortName="contended")))
+    dashboard, etag = res.json(), res.headers["ETag"]
+    writers = 4
+    barrier = threading.Barrier(writers)
+
+    def put(name: str, if_match: str) -> requests.Response:
+        barrier.wait()
+        return requests.put(url + str(dashboard["id"]), json=dict(dashboard, name=name),
+                            headers={"If-Match": if_match})
+
+    winners = [dashboard["name"]]
+    with concurrent.futures.ThreadPoolExecutor(writers) as pool:
+        for attempt in range(10):
+            names = [f"Writer {attempt}.{i}" for i in range(writers)]
+            responses = list(pool.map(put, names, [etag] * writers))
+            assert sorted(r.status_code for r in responses) == [200] + [412] * (writers - 1)
+            winner = next(r for r in responses if r.status_code == 200)
+            assert get_dashboard(HOST, PORT, dashboard["id"]).json()["name"] == winner.json()["name"]
+            etag = winner.headers["ETag"]
+            winners.append(winner.json()["name"])
+    # No lost update: the revisions are the versions of the winners, in order
+    revisions = requests.get(f"{url}{dashboard['id']}/revisions").json()
+    assert [requests.get(f"{url}{dashboard['id']}/revisions/{r['revision']}").json()["name"]
+            for r in revisions] == winners
+    assert requests.delete(url + str(dashboard["id"]), headers={"If-Match": etag}).status_code == 200
+
+
+def test_bulk(sample_dashboard: dict[str, Any]) -> None:
+    dashboards = []
+    for i in range(3):
+        dashboard = sample_dashboard.copy()
+        dashboard["shortName"] = f"dashboard_{i}"
+        dashboards.append(dashboard)
+    res = create_dashboard(HOST, PORT, json.dumps(dashboards[0]))
+    assert res.json()["id"] == 1
+
+    # Create: conflicts with the existing dashboard and within the request are per item
+    invalid = sample_dashboard.copy()
+    invalid.pop("hash")
+    res = bulk_create(HOST, PORT, json.dumps(dashboards + [dashboards[1], invalid]))
+    assert res.status_code == 200
+    results = res.json()
+    assert [r["status"] for r in results] == [400, 200, 200, 400, 400]
+    assert [r["index"] for r in results] == [0, 1, 2, 3, 4]
+    assert [r["id"] for r in results[1:3]] == [2, 3]
+    assert all(r["result"] == "created" for r in results[1:3])
+    assert len(get_dashboard(HOST, PORT).json()) == 3
+
+    # Upsert (NDJSON): updates on dataCube+shortName, creates the rest
+    dashboards[0]["name"] = "Upserted"
+    new = sample_dashboard.copy()
+    new["shortName"] = "dashboard_3"
+    url = f"http://{HOST}:{PORT}/rest/turnilo/dashboards/_bulk"
+    body = "\n".join(json.dumps(d) for d in [dashboards[0], new])
+    res = requests.post(url, params={"op": "upsert"}, data=body, headers={"Content-Type": "application/x-ndjson"})
+    assert res.status_code == 200
+    assert [(r["status"], r["result"], r["id"]) for r in res.json()] == [(200, "updated", 1), (200, "created", 4)]
+    assert get_dashboard(HOST, PORT, 1).json()["name"] == "Upserted"
+    res = bulk_upsert(HOST, PORT, json.dumps([new]))
+    assert res.json()[0]["result"] == "updated"
+
+    # Invalid requests
+    res = requests.post(url, params={"op": "merge"}, json=[])
+    assert res.status_code == 400
+    res = requests.post(url, data="{", headers={"Content-Type": "application/json"})
+    assert res.status_code == 400
+
+    # Delete: by id and by dataCube+shortName
+    to_delete = [{"id": 1}, {"dataCube": "networkFlows", "shortName": "dashboard_1"}, {"id": 99}, {"id": 1}, {}]
+    res = bulk_delete(HOST, PORT, json.dumps(to_delete))
+    assert [r["status"] for r in res.json()] == [200, 200, 404, 404, 400]
+    assert [d["id"] for d in get_dashboard(HOST, PORT).json()] == [3, 4]
+    # The same dashboard by dataCube+shortName and by id: deleted by the first item
+    res = bulk_delete(HOST, PORT, json.dumps([{"dataCube": "networkFlows", "shortName": "dashboard_2"}, {"id": 3},
+                                              {"id": 4}]))
+    assert [(r["status"], r["id"]) for r in res.json()] == [(200, 3), (404, None), (200, 4)]
+    assert get_dashboard(HOST, PORT).json() == []
+
+
+@contextmanager
+def count_statements() -> Iterator[List[str]]:
+    statements: List[str] = []
+
+    def before_cursor_execute(conn, cursor, statement, *args) -> None:
+        # Ignore the background polling of the change feed, and the explicit BEGIN of the
+        # SQLite write transactions (it replaces the one that pysqlite sends on its own)
+        if threading.current_thread().name != "change-feed-listener" and statement != "BEGIN IMMEDIATE":
+            statements.append(statement)
+
+    engines = [db.engine] + ([db.async_engine.sync_engine] if db.async_engine else [])
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        for engine in engines:
+            event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def test_write_round_trips(sample_dashboard: dict[str, Any]) -> None:
+    # Every write is a single statement on turniloDashboards, plus the revision (last
+    # revision SELECT + INSERT) and the change feed INSERT. Updates read the current
+    # version first: it is the base of the new revision. Writes that change the hash also
+    # take (upsert) and drop (UPDATE) a reference on the values of the hash store
+    dashboard = sample_dashboard.copy()
+    with count_statements() as statements:
+        res = create_dashboard(HOST, PORT, json.dumps(dashboard))
+    assert res.status_code == 200
+    assert len(statements) == 5, statements
+    assert statements[0].startswith("INSERT INTO \"turniloDashboardHashes\"")
+
+    dashboard["name"] = "Updated Dashboard Name"
+    with count_statements() as statements:
+        res = update_dashboard(HOST, PORT, json.dumps(dashboard), 1)
+    assert res.status_code == 200
+    assert len(statements) == 5, statements
+    assert statements[1].startswith("UPDATE")
+
+    with count_statements() as statements:
+        res = update_dashboard(HOST, PORT, json.dumps(dashboard), 99)
+    assert res.status_code == 404
+    assert len(statements) == 1, statements
+
+    # Integrity errors are still reported
+    other = sample_dashboard.copy()
+    other["shortName"] = "other"
+    res = create_dashboard(HOST, PORT, json.dumps(other))
+    assert res.status_code == 200
+    res = update_dashboard(HOST, PORT, json.dumps(dashboard), 2)
+    assert res.status_code == 400
+    assert get_dashboard(HOST, PORT, 2).json()["shortName"] == "other"
+
+    with count_statements() as statements:
+        res = delete_dashboard(HOST, PORT, 1)
+    assert res.status_code == 200
+    assert res.json()["name"] == "Updated Dashboard Name"
+    # The value is still referenced by dashboard 2: not deleted
+    assert len(statements) == 4, statements
+    assert statements[0].startswith("DELETE")
+
+    with count_statements() as statements:
+        res = delete_dashboard(HOST, PORT, 1)
+    assert res.status_code == 404
+    assert len(statements) == 1, statements
+
+    # Cleanup
+    res = delete_dashboard(HOST, PORT, 2)
+    assert res.status_code == 200
+
+
+def test_sqlite_concurrent_load(tmp_path: Any) -> None:
+    # Readers and writers on the same SQLite file: with WAL and busy_timeout, none of
+    # them fails with "database is locked". The throughput of the journal modes is
+    # compared by bench/sqlite_bench.py (make bench-sqlite)
+    pragmas = dict(engine_config.sqlite_pragmas(), journal_mode="WAL")
+    assert pragmas["busy_timeout"] > 0
+    engine = engine_config.make_engine(URL.create("sqlite", database=str(tmp_path / "load.db")), pragmas)
+    db.init_schema(engine)
+
+    duration = 0.2
+    counts = {"reads": 0, "writes": 0}
+    errors: List[Exception] = []
+    deadline = time.monotonic() + duration
+
+    def reader() -> None:
+        while time.monotonic() < deadline:
+            try:
+                with Session(engine) as session:
+                    session.exec(select(func.count()).select_from(TurniloDashboard).where(
+                        TurniloDashboard.dataCube == "networkFlows")).one()
+                counts["reads"] += 1
+            except Exception as e:
+                errors.append(e)
+
+    def writer(n: int) -> None:
+        i = 0
+        while time.monotonic() < deadline:
+            try:
+                with Session(engine) as session:
+                    session.add(TurniloDashboard(dataCube="networkFlows", shortName=f"load_{n}_{i}",
+                                                 name="load", hash="#"))
+                    session.commit()
+                counts["writes"] += 1
+                i += 1
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=reader) for _ in range(4)]
+    threads += [threading.Thread(target=writer, args=(n,)) for n in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    engine.dispose()
+
+    assert errors == []
+    assert counts["reads"] > 0 and counts["writes"] > 0
+
+
+def test_metrics(sample_dashboard: dict[str, Any]) -> None:
+    url = f"http://{HOST}:{PORT}/metrics"
+    res = create_dashboard(HOST, PORT, json.dumps(sample_dashboard))
+    assert res.status_code == 200
+    get_dashboard(HOST, PORT, 1)
+    get_dashboard(HOST, PORT, "abc")
+
+    res = requests.get(url)
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("text/plain; version=0.0.4")
+    lines = res.text.splitlines()
+
+    def sample(prefix: str) -> float:
+        matches = [line for line in lines if line.startswith(prefix + " ")]
+        assert len(matches) == 1, prefix
+        return float(matches[0].rsplit(" ", 1)[1])
+
+    # Per route template, not per URL
+    route = 'route="/rest/turnilo/dashboards/{id}"'
+    assert sample('http_requests_total{method="GET",' + route + ',status="200"}') >= 1
+    assert sample('http_requests_total{method="GET",' + route + ',status="400"}') >= 1
+    assert sample('http_request_duration_seconds_count{method="GET",' + route + '}') >= 2
+    assert sample('http_request_duration_seconds_bucket{method="GET",' + route + ',le="+Inf"}') >= 2
+    # Create: INSERT dashboard + INSERT change
+    route = 'route="/rest/turnilo/dashboards/"'
+    assert sample('http_request_db_queries_sum{method="POST",' + route + '}') >= 2
+    assert sample('db_queries_total{statement="INSERT"}') >= 2
+    assert "# TYPE dashboard_cache_hits_total counter" in lines
+    assert any(line.startswith("dashboard_cache_entries ") for line in lines)
+
+    # Cleanup
+    res = delete_dashboard(HOST, PORT, 1)
+    assert res.status_code == 200
+
+
+def test_admission_control() -> None:
+    # Event of the running loop (one per asyncio.run())
+    release: List[asyncio.Event] = []
+
+    async def slow_app(scope: Any, receive: Any, send: Any) -> None:
+        await release[-1].wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    middleware = AdmissionMiddleware(slow_app, max_reads=2, max_writes=1, queue_size=1, queue_timeout=0.5,
+                                     retry_after=3, exempt_paths=["/metrics"])
+
+    async def call(method: str, path: str = "/rest/turnilo/dashboards/") -> tuple[int, dict[bytes, bytes]]:
+        start: dict[str, Any] = {}
+
+        async def send(message: Any) -> None:
+            if message["type"] == "http.response.start":
+                start.update(message)
+
+        async def receive() -> Any:
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        await middleware({"type": "http", "method": method, "path": path, "headers": []}, receive, send)
+        return start["status"], dict(start["headers"])
+
+    async def burst() -> List[tuple[int, dict[bytes, bytes]]]:
+        release.append(asyncio.Event())
+        # 2 reads in flight, 1 queued (admitted once a slot is released), 1 rejected
+        tasks = [asyncio.create_task(call("GET")) for _ in range(4)]
+        await asyncio.sleep(0.05)
+        assert middleware.limiters["read"].in_flight == 2
+        assert middleware.limiters["read"].queue_depth == 1
+        # Writes have their own limit; exempt paths have none
+        writes = [asyncio.create_task(call("PUT")) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        rejected_write = await call("DELETE")
+        exempt = asyncio.create_task(call("GET", "/metrics"))
+        await asyncio.sleep(0.05)
+        release[-1].set()
+        return await asyncio.gather(*tasks, *writes) + [rejected_write, await exempt]
+
+    rejected = metrics.admission_rejected_total.value(("read", "queue_full"))
+    results = asyncio.run(burst())
+    assert [status for status, _ in results] == [200, 200, 200, 503, 200, 200, 503, 200]
+    assert results[3][1][b"retry-after"] == b"3"
+    assert metrics.admission_rejected_total.value(("read", "queue_full")) == rejected + 1
+    assert middleware.limiters["read"].in_flight == 0
+    assert middleware.limiters["write"].in_flight == 0
+
+    # Queued requests time out
+    async def timeout() -> List[int]:
+        release.append(asyncio.Event())
+        tasks = [asyncio.create_task(call("PUT")) for _ in range(2)]
+        await asyncio.sleep(0.6)
+        assert middleware.limiters["write"].queue_depth == 0
+        release[-1].set()
+        return [status for status, _ in await asyncio.gather(*tasks)]
+
+    assert asyncio.run(timeout()) == [200, 503]
+    assert metrics.admission_rejected_total.value(("write", "timeout")) >= 1
+
+    text = requests.get(f"http://{HOST}:{PORT}/metrics").text
+    assert "admission_queue_depth" in text
+    assert "admission_rejected_total" in text
+
+
+def test_health(tmp_path: Any) -> None:
+    res = requests.get(f"http://{HOST}:{PORT}/health/live")
+    assert res.status_code == 200
+
+    res = requests.get(f"http://{HOST}:{PORT}/health/ready")
+    assert res.status_code == 200
+    report = res.json()
+    assert report["ready"] and report["serving"]
+    assert report["engines"]["primary"]["ok"]
+    assert report["engines"]["primary"]["pool"]["exhausted"] is False
+
+    # Not ready while shutting down
+    health.set_serving(False)
+    try:
+        res = requests.get(f"http://{HOST}:{PORT}/health/ready")
+        assert res.status_code == 503
+        assert not res.json()["ready"]
+    finally:
+        health.set_serving(True)
+
+    # Nor when a pool has no connection to spare
+    engine = engine_config.make_engine(URL.create("sqlite", database=str(tmp_path / "health.db")))
+    assert asyncio.run(health.check_engine(engine))["ok"]
+    conns = [engine.connect() for _ in range(constants.DB_POOL_SIZE + constants.DB_POOL_MAX_OVERFLOW)]
+    try:
+        check = asyncio.run(health.check_engine(engine))
+        assert not check["ok"] and check["pool"]["exhausted"]
+    finally:
+        for conn in conns:
+            conn.close()
+        engine.dispose()
+
+    # Schema initialization is idempotent (every worker/replica runs it)
+    assert db.init_schema(db.engine) == []
+
+
+def test_migrations(tmp_path: Any) -> None:
+    engine = engine_config.make_engine(URL.create("sqlite", database=str(tmp_path / "migrations.db")))
+    try:
+        assert migrations.current_version(engine) == 0
+        assert not migrations.is_current(engine)
+
+        # Dry run: reports the locks of every step, changes nothing
+        plan = migrations.plan(engine)
+        assert [m["version"] for m in plan] == list(range(1, migrations.LATEST_VERSION + 1))
+        steps = {s["step"]: s for m in plan for s in m["steps"]}
+        assert not steps["Create table turniloDashboards"]["blocksWrites"]
+        assert steps["Create index ix_turniloDashboards_name_id"]["blocksWrites"]
+        assert "Create index ix_turniloDashboards_dataCube_pattern" not in steps  # Postgres only
+        assert migrations.current_version(engine) == 0
+
+        # Up to a version, then the rest, on existing data
+        assert migrations.migrate(engine, target=1) == [1]
+        with engine.begin() as conn:
+            conn.execute(insert(TurniloDashboard), [{"dataCube": "c", "shortName": "s", "name": "Network traffic",
+                                                     "description": "", "hash": "h", "preset": False}])
+        plan = migrations.plan(engine)
+        assert plan[0]["version"] == 2
+        steps = {s["step"]: s for m in plan for s in m["steps"]}
+        assert steps["Create index ix_turniloDashboards_name_id"]["rows"] == 1
+        assert migrations.migrate(engine) == list(range(2, migrations.LATEST_VERSION + 1))
+        assert migrations.is_current(engine)
+        assert migrations.migrate(engine) == []
+
+        # The existing hash values are moved to the store
+        with Session(engine) as session:
+            row = session.exec(select(TurniloDashboard)).one()
+            assert (row.hash, row.hashDigest) == ("", hash_store.digest("h"))
+            assert hash_store.get(session, hash_store.digest("h")) == "h"
+
+        # The migrations create the indexes that the models declare
+        inspector = inspect(engine)
+        for table in (TurniloDashboard.__table__, TurniloDashboardChange.__table__):
+            declared = {index.name for index in table.indexes  # type: ignore
+                        if not str(index.name).endswith("_pattern")}  # Postgres only
+            assert declared <= {index["name"] for index in inspector.get_indexes(table.name)}  # type: ignore
+
+        # The rows that existed before the FTS table are searchable
+        search_service.enable_search_index(engine)
+        with Session(engine) as session:
+            assert search_service.backend(session) == search_service.BACKEND_FTS5
+            assert [d.name for d in search_service.search(session, "traffic", 10)] == ["Network traffic"]
+    finally:
+        engine.dispose()
+
+
+def test_migration_batches(tmp_path: Any, monkeypatch: Any) -> None:
+    # The hash values are moved a transaction per batch: a failure keeps the batches
+    # committed before it, and the re-run resumes from there
+    engine = engine_config.make_engine(URL.create("sqlite", database=str(tmp_path / "batches.db")))
+    try:
+        migrations.migrate(engine, target=6)
+        with engine.begin() as conn:
+            conn.execute(insert(TurniloDashboard), [{"dataCube": "c", "shortName": f"s{i}", "name": "",
+                                                     "description": "", "hash": f"h{i}", "preset": False}
+                                                    for i in range(5)])
+        steps = {s["step"]: s for m in migrations.plan(engine) for s in m["steps"]}
+        assert not steps["Move the hash values to the store"]["blocksWrites"]
+
+        monkeypatch.setattr(v0007_hash_store, "_BATCH_SIZE", 2)
+        upsert = v0007_hash_store._upsert
+        calls = []
+
+        def failing_upsert(conn: Any, rows: List[Any]) -> None:
+            calls.append(rows)
+            if len(calls) == 2:
+                raise RuntimeError("Failed batch")
+            upsert(conn, rows)
+        monkeypatch.setattr(v0007_hash_store, "_upsert", failing_upsert)
+        with pytest.raises(RuntimeError):
+            migrations.migrate(engine)
+        assert migrations.current_version(engine) == 6
+        with Session(engine) as session:
+            moved = session.exec(select(TurniloDashboard.shortName).where(
+                TurniloDashboard.hashDigest.is_not(None))).all()  # type: ignore
+            assert moved == ["s0", "s1"]
+
+        assert migrations.migrate(engine) == list(range(7, migrations.LATEST_VERSION + 1))
+        assert len(calls) == 2 + 2
+        with Session(engine) as session:
+            assert set(session.exec(select(TurniloDashboard.hash)).all()) == {""}
+            assert [hash_store.get(session, hash_store.digest(f"h{i}")) for i in range(5)] == \
+                [f"h{i}" for i in range(5)]
+    finally:
+        engine.dispose()
+
+
+def test_revisions(sample_dashboard: dict[str, Any]) -> None:
+    url = f"http://{HOST}:{PORT}/rest/turnilo/dashboards/"
+    dashboard = sample_dashboard.copy()
+    dashboard["hash"] = "".join(f"<filter {i}>" for i in range(500))
+    res = create_dashboard(HOST, PORT, json.dumps(dashboard))
+    assert res.status_code == 200
+    _id = res.json()["id"]
+
+    # Every update records a revision; the hash churns a little every time
+    versions = [res.json()]
+    for i in range(12):
+        dashboard["hash"] = dashboard["hash"].replace(f"<filter {i}>", f"<filter {i} changed>")
+        dashboard["name"] = f"Revision {i + 2}"
+        res = update_dashboard(HOST, PORT, json.dumps(dashboard), _id)
+        assert res.status_code == 200
+        versions.append(res.json())
+    infos = requests.get(f"{url}{_id}/revisions").json()
+    assert [info["revision"] for info in infos] == list(range(1, 14))
+    snapshots = [info["revision"] for info in infos if info["snapshot"]]
+    assert snapshots == [1, 1 + constants.REVISION_SNAPSHOT_INTERVAL]
+    # Deltas are a fraction of a snapshot
+    assert all(info["size"] < infos[0]["size"] / 4 for info in infos if not info["snapshot"])
+
+    # Any revision is rebuilt from its snapshot
+    for revision in (1, 5, 11, 13):
+        res = requests.get(f"{url}{_id}/revisions/{revision}")
+        assert res.status_code == 200
+        assert res.json() == versions[revision - 1]
+    assert requests.get(f"{url}{_id}/revisions/99").status_code == 404
+
+    # Restoring is an update, conditional with If-Match
+    res = requests.post(f"{url}{_id}/revisions/5/_restore", headers={"If-Match": '"stale"'})
+    assert res.status_code == 412
+    res = requests.post(f"{url}{_id}/revisions/5/_restore")
+    assert res.status_code == 200
+    assert res.json() == versions[4]
+    assert get_dashboard(HOST, PORT, _id).json() == versions[4]
+    assert requests.get(f"{url}{_id}/revisions").json()[-1]["revision"] == 14
+
+    # Bulk upserts record revisions too
+    upserted = versions[0].copy()
+    upserted.pop("id")
+    assert bulk_upsert(HOST, PORT, json.dumps([upserted])).status_code == 200
+    assert requests.get(f"{url}{_id}/revisions/15").json() == versions[0]
+
+    # A dashboard written before revisions existed (or behind the app's back) gets its
+    # current version recorded before the update
+    other = sample_dashboard.copy()
+    other["shortName"] = "legacy"
+    with Session(db.engine) as session:
+        session.execute(insert(TurniloDashboard), [other])
+        session.commit()
+        legacy_id = session.exec(select(TurniloDashboard.id).where(TurniloDashboard.shortName == "legacy")).one()
+    assert requests.get(f"{url}{legacy_id}/revisions").json() == []
+    other["name"] = "Updated legacy"
+    assert update_dashboard(HOST, PORT, json.dumps(other), legacy_id).status_code == 200
+    infos = requests.get(f"{url}{legacy_id}/revisions").json()
+    assert [(info["revision"], info["snapshot"]) for info in infos] == [(1, True), (2, False)]
+    assert requests.get(f"{url}{legacy_id}/revisions/1").json()["name"] == sample_dashboard["name"]
+
+    # Deleting a dashboard deletes its revisions
+    assert delete_dashboard(HOST, PORT, _id).status_code == 200
+    assert bulk_delete(HOST, PORT, json.dumps([{"id": legacy_id}])).status_code == 200
+    assert requests.get(f"{url}{_id}/revisions").status_code == 404
+    with Session(db.engine) as session:
+        assert session.exec(select(func.count()).select_from(TurniloDashboardRevision)).one() == 0
+
+
+def test_export_import(sample_dashboard: dict[str, Any], tmp_path: Any, monkeypatch: Any) -> None:
+    # Several cursor chunks and import batches
+    monkeypatch.setattr(constants, "STREAM_CHUNK_SIZE", 7)
+    monkeypatch.setattr(constants, "IMPORT_BATCH_SIZE", 10)
+    url = f"http://{HOST}:{PORT}/rest/turnilo/dashboards/_import"
+    dashboards = []
+    for i in range(25):
+        dashboard = sample_dashboard.copy()
+        dashboard["shortName"] = f"dashboard_{i}"
+        dashboard["dataCube"] = f"cube_{i % 3}"
+        dashboards.append(dashboard)
+    assert bulk_create(HOST, PORT, json.dumps(dashboards)).status_code == 200
+    exported = get_dashboard(HOST, PORT).json()
+
+    archive = str(tmp_path / "dashboards.ndjson.gz")
+    res = export_dashboards(HOST, PORT, archive)
+    assert res.status_code == 200
+    assert res.headers["Content-Type"] == "application/gzip"
+    with gzip.open(archive) as archive_file:
+        assert [json.loads(line) for line in archive_file] == exported
+    res = bulk_delete(HOST, PORT, json.dumps([{"id": d["id"]} for d in exported]))
+    assert all(r["status"] == 200 for r in res.json())
+
+    def keys(rows: List[dict[str, Any]]) -> List[tuple]:
+        return sorted((d["dataCube"], d["shortName"], d["name"]) for d in rows)
+
+    # A truncated upload fails after committing its complete batches...
+    with open(archive, "rb") as file:
+        data = file.read()
+    res = requests.post(url, params={"importId": "restore"}, data=data[:len(data) // 2],
+                        headers={"Content-Type": "application/gzip"})
+    assert res.status_code == 400
+    committed = len(get_dashboard(HOST, PORT).json())
+    assert committed % 10 == 0 and committed < 25
+
+    # ...and the retry resumes after them
+    res = import_dashboards(HOST, PORT, archive, import_id="restore")
+    assert res.status_code == 200
+    result = res.json()
+    assert (result["lines"], result["created"], result["updated"], result["failed"], result["done"]) == \
+        (25, 25, 0, 0, True)
+    assert keys(get_dashboard(HOST, PORT).json()) == keys(exported)
+    # Once done, retrying does nothing
+    version = td.dashboards_version(Session(db.engine))
+    res = import_dashboards(HOST, PORT, archive, import_id="restore")
+    assert res.json()["lines"] == 25 and res.json()["errors"] == []
+    assert td.dashboards_version(Session(db.engine)) == version
+
+    # Plain NDJSON: upserts on dataCube+shortName, failed lines are reported by line
+    invalid = sample_dashboard.copy()
+    invalid.pop("hash")
+    updated = dict(dashboards[0], name="Imported")
+    body = "\n".join([json.dumps(updated), "", "{", json.dumps(invalid)])
+    res = requests.post(url, data=body, headers={"Content-Type": "application/x-ndjson"})
+    assert res.status_code == 200
+    result = res.json()
+    assert (result["lines"], result["created"], result["updated"], result["failed"]) == (4, 0, 1, 2)
+    assert [(e["index"], e["status"]) for e in result["errors"]] == [(2, 400), (3, 400)]
+    assert get_dashboard(HOST, PORT, dataCube="cube_0", shortName="dashboard_0").json()[0]["name"] == "Imported"
+    res = requests.post(url, data=b"not gzip", headers={"Content-Type": "application/gzip"})
+    assert res.status_code == 400
+
+    res = bulk_delete(HOST, PORT, json.dumps([{"id": d["id"]} for d in get_dashboard(HOST, PORT).json()]))
+    assert get_dashboard(HOST, PORT).json() == []
+
+
+def test_client(sample_dashboard: dict[str, Any]) -> None:
+    with Client(f"http://{HOST}:{PORT}", bulk_size=2) as client:
+        assert client.capabilities().bulk
+        dashboards = [dict(sample_dashboard, shortName=f"client_{i}") for i in range(5)]
+        # Raw JSON is sent as is
+        results = client.create_many(dashboards[:4] + [json.dumps(dashboards[4])])
+        assert [(r["index"], r["status"], r["result"]) for r in results] == [(i, 200, "created") for i in range(5)]
+        ids = [r["id"] for r in results]
+
+        # GETs are revalidated: a 304 returns the cached dashboard
+        codes: List[int] = []
+        client.session.hooks["response"].append(lambda r, *args, **kwargs: codes.append(r.status_code))
+        first = client.get(ids[0])
+        assert client.get(ids[0]) == first
+        assert codes == [200, 304]
+        assert client.update(ids[0], dict(first, name="Renamed"), if_match=client.etag(ids[0]))["name"] == "Renamed"
+        with pytest.raises(ApiError) as e:
+            client.update(ids[0], first, if_match=client.etag(ids[0]))
+        assert e.value.status == 412
+        assert client.get(ids[0])["name"] == "Renamed"
+        assert [d["id"] for d in client.iter(dataCube="networkFlows")] == ids
+
+        # Without the _bulk endpoint, one request per item, same results
+        client._capabilities = Capabilities(bulk=False)
+        upserted = [dict(dashboards[0], name="Upserted"), dict(sample_dashboard, shortName="client_5")]
+        results = client.upsert_many(upserted)
+        assert [(r["status"], r["result"]) for r in results] == [(200, "updated"), (200, "created")]
+        ids.append(results[1]["id"])
+        assert [r["status"] for r in client.delete_many([ids[5], 9999])] == [200, 404]
+
+    async def run_async() -> None:
+        async with AsyncClient(f"http://{HOST}:{PORT}", concurrency=4) as client:
+            dashboards = await client.get_many(ids[:5])
+            assert [d["id"] for d in dashboards] == ids[:5]
+            assert [d["id"] async for d in client.iter(dataCube="networkFlows")] == ids[:5]
+            results = await client.upsert_many([dict(d, name="Async") for d in dashboards])
+            assert all(r["result"] == "updated" for r in results)
+            results = await client.delete_many(ids[:5])
+            assert [r["status"] for r in results] == [200] * 5
+    asyncio.run(run_async())
+    assert get_dashboard(HOST, PORT).json() == []
+
+
+def test_client_retries() -> None:
+    # A server that sheds the first two requests
+    statuses = [503, 503, 200]
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            self.send_response(statuses.pop(0) if len(statuses) > 1 else statuses[0])
+            self.send_header("Retry-After", "0")
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+    server = http.server.ThreadingHTTPServer((HOST, 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://{HOST}:{server.server_address[1]}"
+    try:
+        with Client(url, retry=RetryPolicy(backoff=0.01)) as client:
+            assert client.get(1) == {}
+        statuses[:] = [503, 503, 200]
+        with Client(url, retry=RetryPolicy(retries=1, backoff=0.01)) as client:
+            with pytest.raises(ApiError) as e:
+                client.get(1)
+            assert e.value.status == 503
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_group_commit(sample_dashboard: dict[str, Any], monkeypatch: Any) -> None:
+    # A long delay: the concurrent writes below end up in a few batches
+    monkeypatch.setattr(constants, "GROUP_COMMIT", True)
+    monkeypatch.setattr(group_commit, "writer", group_commit.GroupCommitter(max_delay=0.2))
+    batches = metrics.group_commit_batch_size.count()
+    url = f"http://{HOST}:{PORT}/rest/turnilo/dashboards/"
+    dashboards = [dict(sample_dashboard, shortName=f"group_{i % 12}") for i in range(16)]
+    try:
+        with concurrent.futures.ThreadPoolExecutor(16) as pool:
+            responses = list(pool.map(lambda d: requests.post(url, json=d), dashboards))
+        # Each caller gets its own result: the duplicates fail alone
+        statuses = [r.status_code for r in responses]
+        assert sorted(statuses) == [200] * 12 + [400] * 4
+        assert all("duplicated" in r.json()["detail"] for r in responses if r.status_code == 400)
+        ids = [r.json()["id"] for r in responses if r.status_code == 200]
+        assert len(set(ids)) == 12
+        assert metrics.group_commit_batch_size.count() - batches < 12
+
+        updated = [dict(sample_dashboard, shortName=f"group_{i}", name="Updated") for i in range(12)]
+        updates: List[Tuple[int, dict[str, Any], dict[str, str]]] = [(_id, d, {}) for _id, d in zip(ids, updated)]
+        updates += [(ids[0], updated[0], {"If-Match": '"stale"'}), (9999, updated[0], {})]
+        with concurrent.futures.ThreadPoolExecutor(16) as pool:
+            responses = list(pool.map(lambda args: requests.put(f"{url}{args[0]}", json=args[1], headers=args[2]),
+                                      updates))
+        assert [r.status_code for r in responses] == [200] * 12 + [412, 404]
+        assert all(d["name"] == "Updated" for d in get_dashboard(HOST, PORT).json())
+        with concurrent.futures.ThreadPoolExecutor(16) as pool:
+            responses = list(pool.map(lambda _id: requests.delete(f"{url}{_id}"), ids + [ids[0]]))
+        assert sorted(r.status_code for r in responses) == [200] * 12 + [404]
+        assert get_dashboard(HOST, PORT).json() == []
+    finally:
+        group_commit.stop()
+
+
+def _sse_events(response: requests.Response) -> Iterator[dict[str, str]]:
+    # Fields of each Server-Sent Event (comments skipped)
+    fields: dict[str, str] = {}
+    for line in response.iter_lines(decode_unicode=True):
+        if line:
+            name, _, value = line.partition(": ")
+            fields[name] = value
+        elif fields:
+            yield fields
+            fields = {}
+
+
+def test_watch(sample_dashboard: dict[str, Any], monkeypatch: Any) -> None:
+    url = f"http://{HOST}:{PORT}/rest/turnilo/dashboards/_watch"
+    base = f"http://{HOST}:{PORT}/rest/turnilo/dashboards/"
+
+    # Without a cursor, a long poll returns the current one right away
+    start = requests.get(url).json()
+    assert start["events"] == [] and not start["reset"]
+
+    # A long poll waits for the next event
+    with concurrent.futures.ThreadPoolExecutor(1) as pool:
+        waiting = pool.submit(requests.get, url, params={"after": start["seq"], "timeout": 10})
+        time.sleep(0.2)
+        t0 = time.monotonic()
+        created = requests.post(base, json=dict(sample_dashboard, shortName="watched")).json()
+        res = waiting.result()
+    # Woken up by the commit, not by the change log poll interval
+    assert time.monotonic() - t0 < constants.CHANGE_FEED_POLL_INTERVAL
+    assert res.status_code == 200
+    result = res.json()
+    assert [(e["op"], e["id"], e["shortName"]) for e in result["events"]] == [("create", created["id"], "watched")]
+    assert result["seq"] == result["events"][0]["seq"] > start["seq"]
+
+    # Filtered out: the long poll times out, but the cursor moves on
+    created_seq = result["seq"]
+    updated = requests.put(f"{base}{created['id']}", json=dict(created, name="Updated")).json()
+    result = requests.get(url, params={"after": created_seq, "dataCube": "other", "timeout": 0.5}).json()
+    assert result["events"] == []
+    assert result["seq"] > created_seq
+    requests.delete(f"{base}{created['id']}")
+    ops = [("create", created["id"]), ("update", updated["id"]), ("delete", created["id"])]
+
+    def resumed() -> List[dict[str, str]]:
+        # Server-Sent Events after the cursor
+        with requests.get(url, params={"dataCube": sample_dashboard["dataCube"]}, stream=True, timeout=10,
+                          headers={"Accept": watch.SSE_MEDIA_TYPE, "Last-Event-ID": str(start["seq"])}) as res:
+            assert res.headers["content-type"].startswith(watch.SSE_MEDIA_TYPE)
+            events = _sse_events(res)
+            ready = next(events)
+            assert ready["event"] == "ready" and ready["id"] == str(start["seq"]) and "retry" in ready
+            return [next(events) for _ in ops]
+
+    # From the buffer, then (older than the buffer) from the change log
+    got = resumed()
+    assert [(e["event"], json.loads(e["data"])["id"]) for e in got] == ops
+    assert [int(e["id"]) for e in got] == sorted(int(e["id"]) for e in got)
+    monkeypatch.setattr(watch.hub, "covered_after", watch.hub.last_seq)
+    assert resumed() == got
+    monkeypatch.undo()
+
+    # Live: the stream gets the events of later writes
+    with requests.get(url, stream=True, timeout=10, headers={"Accept": watch.SSE_MEDIA_TYPE}) as res:
+        events = _sse_events(res)
+        assert next(events)["event"] == "ready"
+        created = requests.post(base, json=dict(sample_dashboard, shortName="watched_live")).json()
+        event = next(events)
+        assert event["event"] == "create" and json.loads(event["data"])["id"] == created["id"]
+    requests.delete(f"{base}{created['id']}")
+
+    # A cursor that is not in the change log: the client must start over
+    result = requests.get(url, params={"after": 0, "timeout": 1}).json()
+    assert result["seq"] > 0
+    result = requests.get(url, params={"after": 10 ** 9, "timeout": 1}).json()
+    assert result["reset"]
+    assert requests.get(url, params={"after": 1, "timeout": 3600}).status_code == 400
+    assert requests.get(url, headers={"Accept": watch.SSE_MEDIA_TYPE, "Last-Event-ID": "x"}).status_code == 400
+
+
+def _hash_refs() -> dict[str, int]:
+    with Session(db.engine) as session:
+        return {h.digest: h.refs for h in session.exec(select(TurniloDashboardHash)).all()}
+
+
+def test_hash_store(sample_dashboard: dict[str, Any]) -> None:
+    base = f"http://{HOST}:{PORT}/rest/turnilo/dashboards/"
+    shared, other = "<shared hash>" * 100, "<other hash>"
+    created = [requests.post(base, json=dict(sample_dashboard, shortName=f"hashed_{i}", hash=h)).json()
+               for i, h in enumerate([shared, shared, other])]
+    # Each value is stored once, compressed, with a reference per dashboard
+    assert _hash_refs() == {hash_store.digest(shared): 2, hash_store.digest(other): 1}
+    with Session(db.engine) as session:
+        stored = session.get(TurniloDashboardHash, hash_store.digest(shared))
+        assert stored is not None and stored.size == len(shared) and len(stored.data) < len(shared)
+        assert set(session.exec(select(TurniloDashboard.hash)).all()) == {""}
+    # Read from the store, not the cache
+    hash_store.value_cache.clear()
+    assert [d["hash"] for d in get_dashboard(HOST, PORT).json()] == [shared, shared, other]
+    assert get_dashboard(HOST, PORT, created[0]["id"]).json()["hash"] == shared
+    assert "hashDigest" not in get_dashboard(HOST, PORT).json()[0]
+
+    # The list can return the digests in place of the values, that are fetched once each
+    res = requests.get(base, params={"fields": "id,hashDigest"})
+    assert res.json() == [{"id": d["id"], "hashDigest": hash_store.digest(d["hash"])} for d in created]
+    res = requests.get(f"{base}_hashes/{hash_store.digest(shared)}")
+    assert res.status_code == 200 and res.text == shared
+    assert "immutable" in res.headers["cache-control"]
+    res = requests.get(f"{base}_hashes/{hash_store.digest(shared)}", headers={"If-None-Match": res.headers["etag"]})
+    assert res.status_code == 304
+    assert requests.get(f"{base}_hashes/{hash_store.digest('unknown')}").status_code == 404
+
+    # Writes move the references; unreferenced values are deleted
+    res = requests.put(f"{base}{created[2]['id']}", json=dict(created[2], hash=shared))
+    assert res.status_code == 200
+    assert _hash_refs() == {hash_store.digest(shared): 3}
+    res = bulk_upsert(HOST, PORT, json.dumps([dict(created[0], hash=other), dict(created[1], hash="<new hash>")]))
+    assert [r["status"] for r in res.json()] == [200, 200]
+    assert _hash_refs() == {hash_store.digest(shared): 1, hash_store.digest(other): 1,
+                            hash_store.digest("<new hash>"): 1}
+    assert requests.get(f"{base}{created[1]['id']}/revisions/1").json()["hash"] == shared
+    assert delete_dashboard(HOST, PORT, created[0]["id"]).status_code == 200
+    res = bulk_delete(HOST, PORT, json.dumps([{"id": d["id"]} for d in created[1:]]))
+    assert [r["status"] for r in res.json()] == [200, 200]
+    assert _hash_refs() == {}
+
+    # Rows with their hash inline (written before the store) are served as is
+    with Session(db.engine) as session:
+        session.execute(insert(TurniloDashboard).values(dict(sample_dashboard, shortName="inline", hash="inline")))
+        session.commit()
+    dashboards = get_dashboard(HOST, PORT).json()
+    assert [d["hash"] for d in dashboards] == ["inline"]
+    assert requests.get(base, params={"fields": "id,hashDigest"}).json() == [{"id": dashboards[0]["id"],
+                                                                              "hashDigest": None}]
+    assert delete_dashboard(HOST, PORT, dashboards[0]["id"]).json()["hash"] == "inline"
+
+
+def test_shards(sample_dashboard: dict[str, Any], tmp_path: Any, monkeypatch: Any) -> None:
+    # The server runs on 3 SQLite shards in place of its DB
+    monkeypatch.setattr(constants, "DB_SHARDS", 3)
+    monkeypatch.setattr(constants, "SQLITE_FILE", str(tmp_path / "shards.db"))
+    monkeypatch.setattr(constants, "STREAM_CHUNK_SIZE", 4)
+    monkeypatch.setattr(db, "_engines", None)
+    monkeypatch.setattr(db, "_schema_initialized", False)
+    dashboard_cache.clear()
+    db.init()
+    base = f"http://{HOST}:{PORT}/rest/turnilo/dashboards/"
+    try:
+        # cube_0..cube_11 are on every shard
+        dashboards = [dict(sample_dashboard, dataCube=f"cube_{i % 12}", shortName=f"sharded_{i}",
+                           name=f"Traffic {i % 5}", hash=f"<hash {i}>") for i in range(24)]
+        assert {shards.of_data_cube(d["dataCube"]) for d in dashboards} == {0, 1, 2}
+        res = bulk_create(HOST, PORT, json.dumps(dashboards))
+        assert [r["status"] for r in res.json()] == [200] * 24
+        ids = [r["id"] for r in res.json()]
+        # Ids are shard-prefixed, and each shard has the dashboards of its dataCubes
+        assert [shards.of_id(_id) for _id in ids] == [shards.of_data_cube(d["dataCube"]) for d in dashboards]
+        for shard, engines in enumerate(db.shard_engines()):
+            with Session(engines.engine) as session:
+                rows = session.exec(select(TurniloDashboard)).all()
+                assert rows and {shards.of_data_cube(d.dataCube) for d in rows} == {shard}
+
+        # Lists of all the shards are merged on the sort key
+        by_id = get_dashboard(HOST, PORT).json()
+        assert [d["id"] for d in by_id] == sorted(ids)
+        by_name = get_dashboard(HOST, PORT, orderBy="name").json()
+        assert [(d["name"], d["id"]) for d in by_name] == sorted((d["name"], d["id"]) for d in by_id)
+        for order_by, expected in ((None, by_id), ("name", by_name)):
+            pages: List[dict[str, Any]] = []
+            cursor = None
+            while True:
+                res = get_dashboard(HOST, PORT, limit=5, after=cursor, **({"orderBy": order_by} if order_by else {}))
+                pages += res.json()
+                cursor = res.headers.get("X-Next-Cursor")
+                if cursor is None:
+                    break
+            assert pages == expected
+            params = {"orderBy": order_by} if order_by else {}
+            res = requests.get(base, params=dict(params, limit=10), headers={"Accept": "application/x-ndjson"})
+            assert [json.loads(line) for line in res.text.splitlines()] == expected[:10]
+            res = requests.get(base, params=dict(params, fields="id"), headers={"Accept": "application/x-ndjson"})
+            assert [json.loads(line) for line in res.text.splitlines()] == [{"id": d["id"]} for d in expected]
+        # Single-shard lists
+        assert get_dashboard(HOST, PORT, dataCube="cube_7").json() == [d for d in by_id if d["dataCube"] == "cube_7"]
+        res = get_dashboard(HOST, PORT, dataCubeIn="cube_0,cube_7")
+        assert res.json() == [d for d in by_id if d["dataCube"] in ("cube_0", "cube_7")]
+        assert get_dashboard(HOST, PORT, dataCube="cube_7", shortName="sharded_7").json()[0]["id"] == ids[7]
+        version = requests.get(base).headers["ETag"]
+
+        # Single-dashboard operations go to the shard of the dashboard
+        res = create_dashboard(HOST, PORT, json.dumps(dict(sample_dashboard, dataCube="cube_10")))
+        created = res.json()
+        assert shards.of_id(created["id"]) == 2 and created["id"] > max(ids)
+        assert requests.get(base).headers["ETag"] != version
+        assert get_dashboard(HOST, PORT, created["id"]).json() == created
+        res = update_dashboard(HOST, PORT, json.dumps(dict(created, name="Renamed")), created["id"])
+        assert res.status_code == 200 and res.json()["name"] == "Renamed"
+        assert requests.get(f"{base}{created['id']}/revisions").json()[-1]["revision"] == 2
+        res = update_dashboard(HOST, PORT, json.dumps(dict(created, dataCube="cube_0")), created["id"])
+        assert res.status_code == 400
+        assert delete_dashboard(HOST, PORT, created["id"]).status_code == 200
+        assert get_dashboard(HOST, PORT, created["id"]).status_code == 404
+        assert get_dashboard(HOST, PORT, 9 * shards.SHARD_ID_SPAN).status_code == 404
+
+        # Search, hash values and export cover every shard
+        found = requests.get(f"{base}_search", params={"q": "traffic 3", "limit": "10"}).json()
+        assert sorted(d["id"] for d in found) == sorted(d["id"] for d in by_id if d["name"] == "Traffic 3")
+        assert requests.get(f"{base}_hashes/{hash_store.digest('<hash 23>')}").text == "<hash 23>"
+        archive = str(tmp_path / "shards.ndjson.gz")
+        assert export_dashboards(HOST, PORT, archive).status_code == 200
+        with gzip.open(archive) as archive_file:
+            assert [json.loads(line) for line in archive_file] == by_id
+        assert requests.get(f"{base}_watch").status_code == 501
+
+        # A shard does not start with dashboards of other shards
+        monkeypatch.setattr(constants, "DB_SHARDS", 2)
+        with pytest.raises(RuntimeError, match="export them"):
+            shards.register(db.get_engines(1).engine, 1)
+        monkeypatch.setattr(constants, "DB_SHARDS", 3)
+
+        # Bulk items go to their shards; ids of no shard don't exist
+        items = [{"id": ids[0]}, {"dataCube": "cube_7", "shortName": "sharded_7"}, {"id": 9 * shards.SHARD_ID_SPAN}]
+        res = bulk_delete(HOST, PORT, json.dumps(items))
+        assert [(r["index"], r["status"]) for r in res.json()] == [(0, 200), (1, 200), (2, 404)]
+        res = bulk_upsert(HOST, PORT, json.dumps([dict(dashboards[1], name="Upserted"), dashboards[7]]))
+        assert [r["result"] for r in res.json()] == ["updated", "created"]
+        assert len(get_dashboard(HOST, PORT).json()) == 23
+        res = bulk_delete(HOST, PORT, json.dumps([{"id": d["id"]} for d in get_dashboard(HOST, PORT).json()]))
+        assert all(r["status"] == 200 for r in res.json())
+        assert get_dashboard(HOST, PORT).json() == []
+    finally:
+        asyncio.run(db.dispose_engines())
+        dashboard_cache.clear()
+
+
 def test_update_dashboard(sample_dashboard: dict[str, Any]) -> None:
     dashboard = sample_dashboard.copy()
 